@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark of 'bootstrapCohortExposures' against a loop of 'bootstrapSigExposures' over the samples.
+
+For every number of mutations and decomposition backend, the script reports the time of the loop, the time of the
+cohort function and the speedup, and splits the loop into its two parts: drawing the replicates one mutation at a
+time and solving them. Only the draws are vectorized by the cohort function, so the speedup is bounded by the time
+of the loop over the time of the solves.
+
+Usage:
+    python benchmarks/bootstrap_cohort.py
+    python benchmarks/bootstrap_cohort.py --samples 20 --R 200 --mutations 2000,20000 --backends qp,kkt,simplex
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sigconfide.modelselection.analyzer import load_catalog
+from sigconfide.decompose.registry import get_backend
+from sigconfide.estimates.bootstrap import bootstrapSigExposures, bootstrapCohortExposures
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.utils.synthetic import generate_cohort
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Speedup of bootstrapCohortExposures over a loop of samples')
+    parser.add_argument('--signatures', type=float, default=2.0, help='COSMIC version (default: 2.0)')
+    parser.add_argument('--samples', type=int, default=20, help='Number of synthetic samples (default: 20)')
+    parser.add_argument('--R', type=int, default=200, help='Replicates per sample (default: 200)')
+    parser.add_argument('--mutations', type=str, default='2000,20000',
+                        help='Comma-separated numbers of mutations per sample (default: 2000,20000)')
+    parser.add_argument('--backends', type=str, default='qp,kkt,simplex',
+                        help='Comma-separated decomposition backends (default: qp,kkt,simplex)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the cohort and of the replicates (default: 0)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    P, _ = load_catalog(args.signatures)
+    counts, _, _ = generate_cohort(args.samples, signatures=args.signatures, seed=args.seed, mutation_counts=2000)
+    profiles = counts / counts.sum(axis=0)
+
+    print(f"COSMIC v{args.signatures}, {args.samples} samples, R={args.R}")
+    print(f"{'mutations':>9} {'backend':<8} {'loop':>7} {'draws':>7} {'solves':>7} {'cohort':>7} {'speedup':>8} "
+          f"{'bound':>6}")
+    for mutations in (int(n) for n in args.mutations.split(',')):
+        np.random.seed(args.seed)
+        start = time.perf_counter()
+        replicates = np.column_stack([np.bincount(np.random.choice(len(m), size=mutations, p=m), minlength=len(m))
+                                      for m in profiles.T for _ in range(args.R)]) / mutations
+        draws = time.perf_counter() - start
+        for name in args.backends.split(','):
+            method = get_backend(name)
+            # Compiles and warms up the backend
+            bootstrapCohortExposures(profiles[:, :1], P, 2, mutations, decomposition_method=method)
+
+            start = time.perf_counter()
+            findSigExposures(replicates, P, decomposition_method=method)
+            solves = time.perf_counter() - start
+
+            np.random.seed(args.seed)
+            start = time.perf_counter()
+            for m in profiles.T:
+                bootstrapSigExposures(m, P, args.R, mutations, decomposition_method=method)
+            loop = time.perf_counter() - start
+
+            np.random.seed(args.seed)
+            start = time.perf_counter()
+            bootstrapCohortExposures(profiles, P, args.R, mutations, decomposition_method=method)
+            cohort = time.perf_counter() - start
+            print(f"{mutations:>9} {name:<8} {loop:>7.2f} {draws:>7.2f} {solves:>7.2f} {cohort:>7.2f} "
+                  f"{loop / cohort:>7.1f}x {loop / solves:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the decision stability of the hybrid selection for multinomial and stratified bootstrap replicates.
+
+For every synthetic sample, the hybrid selection is repeated with independent replicates, and the stability is the
+fraction of pairs of repetitions that select the same signatures. The whole benchmark is run for several seeds (cohort
+and replicates); the script reports the mean and the standard deviation across seeds of the stability and of the time
+for each R and sampling method, the smallest R reaching the target stability, and the stability of both methods at
+equal wall time (the largest R of each method that fits in the time of every row).
+
+Usage:
+    python benchmarks/bootstrap_sampling.py
+    python benchmarks/bootstrap_sampling.py --signatures 3.4 --samples 20 --repeats 8 --R 50,100,200,400 --target 0.8
+    python benchmarks/bootstrap_sampling.py --seeds 0,1,2,3
+"""
+
+import argparse
+import sys
+import time
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sigconfide.modelselection.analyzer import load_catalog
+from sigconfide.modelselection.backward import bootstraped_patient
+from sigconfide.modelselection.hybrid import hybrid_selection
+from sigconfide.utils.synthetic import generate_cohort
+
+
+def selection(m, P, R, sampling, seed, threshold, significance_level):
+    np.random.seed(seed)
+    M = bootstraped_patient(m, None, R, sampling)
+    try:
+        best_columns, _ = hybrid_selection(m, P, R, threshold, None, significance_level, replicates=M)
+    except ValueError:
+        return ()
+    return tuple(sorted(int(col) for col in best_columns))
+
+
+def stability(selections):
+    pairs = list(combinations(selections, 2))
+    return sum(first == second for first, second in pairs) / len(pairs)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Decision stability of multinomial and stratified bootstrap replicates')
+    parser.add_argument('--signatures', type=float, default=2.0, help='COSMIC version (default: 2.0)')
+    parser.add_argument('--samples', type=int, default=10, help='Number of synthetic samples (default: 10)')
+    parser.add_argument('--mutations', type=int, default=500, help='Mutations per sample (default: 500)')
+    parser.add_argument('--repeats', type=int, default=6, help='Repetitions per sample and R (default: 6)')
+    parser.add_argument('--R', type=str, default='25,50,100,200', help='Comma-separated grid of R (default: 25,50,100,200)')
+    parser.add_argument('--target', type=float, default=0.75, help='Target stability (default: 0.75)')
+    parser.add_argument('--threshold', type=float, default=0.01, help='Threshold (default: 0.01)')
+    parser.add_argument('--significance', type=float, default=0.01, help='Significance level (default: 0.01)')
+    parser.add_argument('--seeds', type=str, default='0,1,2',
+                        help='Comma-separated seeds of the cohort and of the replicates (default: 0,1,2)')
+    return parser.parse_args()
+
+
+def run(args, P, sampling, R, seed):
+    counts, _, _ = generate_cohort(args.samples, signatures=args.signatures, seed=seed,
+                                   mutation_counts=args.mutations)
+    start = time.perf_counter()
+    scores = []
+    for i in range(args.samples):
+        m = counts[:, i].astype(float)
+        selections = [selection(m, P, R, sampling, [seed, i, repeat], args.threshold, args.significance)
+                      for repeat in range(args.repeats)]
+        scores.append(stability(selections))
+    return np.mean(scores), time.perf_counter() - start
+
+
+def main():
+    args = parse_arguments()
+    grid = [int(R) for R in args.R.split(',')]
+    seeds = [int(seed) for seed in args.seeds.split(',')]
+    P, _ = load_catalog(args.signatures)
+
+    print(f"COSMIC v{args.signatures}, {args.samples} samples, {args.mutations} mutations, {args.repeats} repeats, "
+          f"seeds {args.seeds}")
+    print(f"{'sampling':<12} {'R':>6} {'stability':>10} {'std':>7} {'seconds':>9} {'std':>7}")
+    results = {}
+    for sampling in ('multinomial', 'stratified'):
+        for R in grid:
+            scores, seconds = np.array([run(args, P, sampling, R, seed) for seed in seeds]).T
+            results[sampling, R] = scores.mean(), seconds.mean()
+            print(f"{sampling:<12} {R:>6} {scores.mean():>10.3f} {scores.std():>7.3f} {seconds.mean():>9.1f} "
+                  f"{seconds.std():>7.1f}")
+
+    print()
+    for sampling in ('multinomial', 'stratified'):
+        R = next((R for R in grid if results[sampling, R][0] >= args.target), None)
+        print(f"R needed for stability {args.target} with {sampling} sampling: {R if R is not None else f'> {grid[-1]}'}")
+
+    print()
+    print(f"{'seconds':>9} {'multinomial':>12} {'stratified':>12}")
+    for budget in sorted({seconds for _, seconds in results.values()}):
+        row = []
+        for sampling in ('multinomial', 'stratified'):
+            fitting = [results[sampling, R][0] for R in grid if results[sampling, R][1] <= budget]
+            row.append(f"{fitting[-1]:.3f}" if fitting else '-')
+        print(f"{budget:>9.1f} {row[0]:>12} {row[1]:>12}")
+
+
+if __name__ == "__main__":
+    main()
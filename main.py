@@ -11,6 +11,10 @@ Usage:
 
     # Run with custom parameters
     python main.py --samples tests/data/reduced_data.dat --output output/custom --signatures 3.4
+
+    # Run one shard of a large cohort and merge the shards afterwards
+    python main.py --samples cohort.dat --output output/shards --signatures 3.4 --shard 0/4 --seed 7
+    python main.py --merge output/shards --output output/custom --drop-zeros
 """
 
 import os
@@ -23,39 +27,127 @@ project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from sigconfide.modelselection.analyzer import fit
+from sigconfide.modelselection.shards import fit_shard, merge_shards
+from sigconfide.modelselection.sweep import sweep
+from sigconfide.modelselection.refit import refit
+from sigconfide.utils.inputs import expand_sample_files
+from sigconfide.decompose.registry import BACKENDS
 
 
 def run_single_analysis(samples_file, output_dir, signatures, threshold=0.01, 
                        mutation_count=None, R=100, significance_level=0.01, 
-                       drop_zeros_columns=False):
+                       drop_zeros_columns=False, seed=None, shard=None, chunk_size=None,
+                       n_jobs=1, save_bootstrap=False, schedule='cost', cost_model=None, output_format='csv',
+                       screening=None, sampling='multinomial', time_budget=None, work_budget=None,
+                       degrade='reduced_R', max_memory=None, replicate_jobs=1, clusters=None, backend='qp',
+                       allowed_signatures=None, sample_groups=None):
     """Run a single analysis with specified parameters."""
     print(f"Input file: {samples_file}")
     print(f"Output directory: {output_dir}")
     
-    if isinstance(signatures, (int, float)):
-        print(f"Signatures: COSMIC v{signatures}")
-    else:
-        print(f"Signatures file: {signatures}")
+    for catalog in (signatures if isinstance(signatures, list) else [signatures]):
+        if isinstance(catalog, (int, float)):
+            print(f"Signatures: COSMIC v{catalog}")
+        else:
+            print(f"Signatures file: {catalog}")
     
     print(f"Parameters: threshold={threshold}, R={R}, significance_level={significance_level}")
     if mutation_count is not None:
         print(f"  mutation_count={mutation_count}")
     print(f"  drop_zeros_columns={drop_zeros_columns}")
+    if seed is not None:
+        print(f"  seed={seed}")
+    if shard is not None:
+        print(f"  shard={shard[0]}/{shard[1]}")
+    if chunk_size is not None:
+        print(f"  chunk_size={chunk_size}")
+    if n_jobs > 1:
+        print(f"  n_jobs={n_jobs}, schedule={schedule}")
+    if save_bootstrap:
+        print(f"  save_bootstrap={save_bootstrap}")
+    if screening is not None:
+        print(f"  screening={screening}")
+    if clusters is not None:
+        print(f"  clusters={clusters}")
+    if backend != 'qp':
+        print(f"  backend={backend}")
+    if allowed_signatures is not None:
+        print(f"  allowed_signatures={allowed_signatures}, sample_groups={sample_groups}")
+    if sampling != 'multinomial':
+        print(f"  sampling={sampling}")
+    if time_budget is not None or work_budget is not None:
+        print(f"  time_budget={time_budget}, work_budget={work_budget}, degrade={degrade}")
+    if max_memory is not None:
+        print(f"  max_memory={max_memory}")
+    if replicate_jobs > 1:
+        print(f"  replicate_jobs={replicate_jobs}")
+    if output_format != 'csv':
+        print(f"  output_format={output_format}")
     print()
     
     try:
-        fit(
-            str(samples_file),
-            str(output_dir),
-            signatures=signatures,
-            threshold=threshold,
-            mutation_count=mutation_count,
-            R=R,
-            significance_level=significance_level,
-            drop_zeros_columns=drop_zeros_columns
-        )
+        if shard is not None:
+            result_file = fit_shard(
+                str(samples_file),
+                str(output_dir),
+                shard[0],
+                shard[1],
+                signatures=signatures,
+                threshold=threshold,
+                mutation_count=mutation_count,
+                R=R,
+                significance_level=significance_level,
+                seed=seed,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+                schedule=schedule,
+                cost_model=cost_model,
+                screening=screening,
+                sampling=sampling,
+                time_budget=time_budget,
+                work_budget=work_budget,
+                degrade=degrade,
+                replicate_jobs=replicate_jobs,
+                clusters=clusters,
+                backend=backend,
+                allowed_signatures=allowed_signatures,
+                sample_groups=sample_groups
+            )
+        else:
+            fit(
+                str(samples_file),
+                str(output_dir),
+                signatures=signatures,
+                threshold=threshold,
+                mutation_count=mutation_count,
+                R=R,
+                significance_level=significance_level,
+                drop_zeros_columns=drop_zeros_columns,
+                seed=seed,
+                chunk_size=chunk_size,
+                n_jobs=n_jobs,
+                save_bootstrap=save_bootstrap,
+                schedule=schedule,
+                cost_model=cost_model,
+                output_format=output_format,
+                screening=screening,
+                sampling=sampling,
+                time_budget=time_budget,
+                work_budget=work_budget,
+                degrade=degrade,
+                max_memory=max_memory,
+                replicate_jobs=replicate_jobs,
+                clusters=clusters,
+                backend=backend,
+                allowed_signatures=allowed_signatures,
+                sample_groups=sample_groups
+            )
+            result_file = Path(output_dir)
+            if not isinstance(signatures, list):
+                extension = 'npz' if output_format == 'sparse' else 'csv'
+                result_file = result_file / f'Assignment_Solution_Activities.{extension}'
         print(f"\n✓ Analysis completed successfully!")
-        print(f"  Results saved to: {Path(output_dir) / 'Assignment_Solution_Activities.csv'}")
+        print(f"  Results saved to: {result_file}")
         return True
     except Exception as e:
         print(f"\n✗ Error during analysis: {e}")
@@ -159,16 +251,36 @@ Examples:
   python main.py --samples tests/data/reduced_data.dat --output output/custom \\
                  --signatures tests/data/Breast_Signatures.csv
 
+  # Fit several catalogs in one pass, one output subfolder per catalog
+  python main.py --samples tests/data/reduced_data.dat --output output/custom --signatures 2.0,3.1,3.4
+
+  # Sweep thresholds and significance levels in one run, one output subfolder per combination
+  python main.py --samples tests/data/reduced_data.dat --output output/sweep --signatures 3.4 \\
+                 --sweep-thresholds 0.01,0.02,0.05 --sweep-significance 0.01,0.05
+
+  # Process the second of four shards, then merge all shards into one result
+  python main.py --samples tests/data/reduced_data.dat --output output/shards \\
+                 --signatures 3.4 --shard 1/4 --seed 7
+  python main.py --merge output/shards --output output/custom --drop-zeros
+
+  # Recompute the exposures of a previous result without repeating the selection
+  python main.py --samples tests/data/reduced_data.dat --output output/refit --signatures 3.4 \\
+                 --refit output/custom/Assignment_Solution_Activities.csv
+
   # Specify all parameters
   python main.py --samples tests/data/reduced_data.dat --output output/custom \\
                  --signatures 2.0 --threshold 0.02 --R 50 --significance 0.05
+
+  # Fit several compressed sample files in one run, with one combined output
+  python main.py --samples 'cohort/*.txt.gz' --output output/cohort --signatures 3.4 --n-jobs 8
         """
     )
     
     parser.add_argument(
         '--samples',
         type=str,
-        help='Path to samples file (mutational matrix)'
+        help='Path to samples file (mutational matrix), a glob pattern or a .manifest listing several files; '
+             'files can be compressed with gzip or bzip2'
     )
     
     parser.add_argument(
@@ -180,7 +292,8 @@ Examples:
     parser.add_argument(
         '--signatures',
         type=str,
-        help='COSMIC version (1.0, 2.0, 3.0, 3.1, 3.4) or path to custom signatures file'
+        help='COSMIC version (1.0, 2.0, 3.0, 3.1, 3.4) or path to custom signatures file, '
+             'several catalogs separated by commas are fitted in one pass'
     )
     
     parser.add_argument(
@@ -218,13 +331,231 @@ Examples:
         help='Drop columns with all zero values from output'
     )
     
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=None,
+        help='Generate and solve bootstrap replicates in chunks of this size, memory does not grow with R (default: None)'
+    )
+    
+    parser.add_argument(
+        '--n-jobs',
+        type=int,
+        default=1,
+        help='Number of worker processes (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--schedule',
+        choices=['cost', 'fifo'],
+        default='cost',
+        help='Order in which samples are dispatched to the workers: longest expected first or file order (default: cost)'
+    )
+    
+    parser.add_argument(
+        '--cost-model',
+        type=str,
+        default=None,
+        help='JSON file with the per-sample cost model, loaded and refined by every run (default: None)'
+    )
+    
+    parser.add_argument(
+        '--sampling',
+        choices=['multinomial', 'stratified'],
+        default='multinomial',
+        help='How bootstrap replicates are generated: independent multinomial replicates or replicates stratified across each mutation draw (default: multinomial)'
+    )
+    
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        default=None,
+        metavar='SECONDS',
+        help='Time budget of the selection of each sample, samples over budget are degraded and flagged (default: None)'
+    )
+    
+    parser.add_argument(
+        '--work-budget',
+        type=int,
+        default=None,
+        metavar='SOLVES',
+        help='Work budget of the selection of each sample in replicate solves (default: None)'
+    )
+    
+    parser.add_argument(
+        '--degrade',
+        choices=['reduced_R', 'screening', 'current_model'],
+        default='reduced_R',
+        help='First degradation of a sample over budget (default: reduced_R)'
+    )
+    
+    parser.add_argument(
+        '--replicate-jobs',
+        type=int,
+        default=1,
+        help='With --n-jobs 1, number of processes solving the bootstrap replicates of each sample, '
+             'for a lower latency per sample with the same results (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--max-memory',
+        type=str,
+        default=None,
+        metavar='SIZE',
+        help='Memory budget of the run, e.g. 512M or 16G; --n-jobs (as an upper bound), --chunk-size and the number '
+             'of samples dispatched at once are chosen to stay within it (default: None)'
+    )
+    
+    parser.add_argument(
+        '--screening',
+        type=float,
+        default=None,
+        metavar='MARGIN',
+        help='Decide clear-cut signatures analytically with a margin of MARGIN standard deviations, e.g. 3 (default: None)'
+    )
+    
+    parser.add_argument(
+        '--backend',
+        choices=list(BACKENDS) + ['auto'],
+        default='qp',
+        help='Decomposition backend solving the bootstrap replicates; auto picks the fastest one for the problem '
+             'shape once per machine (default: qp)'
+    )
+    
+    parser.add_argument(
+        '--clusters',
+        type=float,
+        default=None,
+        metavar='SIMILARITY',
+        help='Group signatures with a cosine similarity of about SIMILARITY, e.g. 0.8, and decide the presence of '
+             'the clusters before their members (default: None)'
+    )
+    
+    parser.add_argument(
+        '--allowed-signatures',
+        type=str,
+        default=None,
+        metavar='JSON_FILE',
+        help='JSON file with the signatures allowed for every sample, or for every group with --sample-groups '
+             '(default: None)'
+    )
+    
+    parser.add_argument(
+        '--sample-groups',
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='Annotation file with a sample and its group (e.g. cancer type) per line (default: None)'
+    )
+    
+    parser.add_argument(
+        '--output-format',
+        choices=['csv', 'sparse'],
+        default='csv',
+        help='Save a dense CSV or a compressed sparse row .npz file (default: csv)'
+    )
+    
+    parser.add_argument(
+        '--save-bootstrap',
+        action='store_true',
+        help='Save the bootstrap exposures of the final models to Bootstrap_Exposures.npy'
+    )
+    
+    parser.add_argument(
+        '--sweep-thresholds',
+        type=str,
+        default=None,
+        help='Comma-separated grid of thresholds, runs a parameter sweep (default: --threshold)'
+    )
+    
+    parser.add_argument(
+        '--sweep-significance',
+        type=str,
+        default=None,
+        help='Comma-separated grid of significance levels, runs a parameter sweep (default: --significance)'
+    )
+    
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Seed of the per-sample random states (default: None)'
+    )
+    
+    parser.add_argument(
+        '--shard',
+        type=str,
+        default=None,
+        help='Process only shard I/N of the samples file, e.g. 0/4, and write a partial result'
+    )
+    
+    parser.add_argument(
+        '--merge',
+        type=str,
+        default=None,
+        metavar='SHARD_DIR',
+        help='Merge the partial results found in SHARD_DIR into the output directory'
+    )
+    
+    parser.add_argument(
+        '--refit',
+        type=str,
+        default=None,
+        metavar='ACTIVITIES_FILE',
+        help='Recompute the exposures of the signatures selected in a previous Assignment_Solution_Activities file, '
+             'without the bootstrap selection'
+    )
+    
     return parser.parse_args()
 
 
+def parse_grid(value, default):
+    """Parse a comma-separated grid of floats."""
+    if value is None:
+        return [default]
+    return [float(item) for item in value.split(',')]
+
+
+def parse_signatures(value):
+    """Convert a COSMIC version to float, any other value is treated as a file path."""
+    try:
+        version = float(value)
+        if version in [1.0, 2.0, 3.0, 3.1, 3.4]:
+            return version
+    except ValueError:
+        # Not a version number, treat as file path
+        pass
+    return value
+
+
+def parse_shard(value):
+    """Parse a shard specification of the form I/N."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Shard must have the form I/N, got: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in the range [0, N), got: {value}")
+    return index, count
+
+
 def main():
     """Main function to run SigConfide analysis."""
     args = parse_arguments()
     
+    # Merge partial results written by --shard runs
+    if args.merge is not None:
+        if args.output is None:
+            print("Error: --output is required when --merge is provided")
+            sys.exit(1)
+        try:
+            output_file = merge_shards(args.merge, args.output, drop_zeros_columns=args.drop_zeros)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"✓ Shards merged into: {output_file}")
+        return
+    
     # If no arguments provided, run examples
     if args.samples is None:
         run_examples()
@@ -239,19 +570,37 @@ def main():
         print("Error: --signatures is required when --samples is provided")
         sys.exit(1)
     
-    # Convert signatures to float if it's a numeric version
-    signatures = args.signatures
-    try:
-        version = float(signatures)
-        if version in [1.0, 2.0, 3.0, 3.1, 3.4]:
-            signatures = version
-    except ValueError:
-        # Not a version number, treat as file path
-        pass
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    
+    # Convert signatures to float if it's a numeric version, several catalogs are separated by commas
+    signatures = [parse_signatures(catalog) for catalog in args.signatures.split(',')]
+    if len(signatures) == 1:
+        signatures = signatures[0]
+    elif shard is not None:
+        print("Error: --shard supports a single catalog in --signatures")
+        sys.exit(1)
     
     samples_path = Path(args.samples)
-    if not samples_path.exists():
-        print(f"Error: Samples file not found: {samples_path}")
+    try:
+        sample_files = expand_sample_files(args.samples)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for sample_file in sample_files:
+        if not Path(sample_file).exists():
+            print(f"Error: Samples file not found: {sample_file}")
+            sys.exit(1)
+    if len(sample_files) > 1 and shard is not None:
+        print("Error: --shard supports a single samples file")
+        sys.exit(1)
+    if shard is not None and (args.save_bootstrap or args.max_memory is not None or args.output_format != 'csv'):
+        print("Error: --shard does not support --save-bootstrap, --max-memory or --output-format sparse")
         sys.exit(1)
     
     output_path = Path(args.output)
@@ -262,6 +611,76 @@ def main():
     print("=" * 70)
     print()
     
+    if args.refit is not None:
+        if isinstance(signatures, list) or shard is not None:
+            print("Error: --refit supports a single catalog and no --shard")
+            sys.exit(1)
+        try:
+            output_file = refit(
+                str(samples_path),
+                args.refit,
+                str(output_path),
+                signatures=signatures,
+                drop_zeros_columns=args.drop_zeros,
+                output_format=args.output_format,
+                backend=args.backend
+            )
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"✓ Refit saved to: {output_file}")
+        return
+    
+    if args.sweep_thresholds is not None or args.sweep_significance is not None:
+        if isinstance(signatures, list) or shard is not None:
+            print("Error: a parameter sweep supports a single catalog and no --shard")
+            sys.exit(1)
+        if args.save_bootstrap or args.max_memory is not None:
+            print("Error: a parameter sweep does not support --save-bootstrap or --max-memory")
+            sys.exit(1)
+        try:
+            thresholds = parse_grid(args.sweep_thresholds, args.threshold)
+            significance_levels = parse_grid(args.sweep_significance, args.significance_level)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Sweep: thresholds={thresholds}, significance_levels={significance_levels}")
+        try:
+            output_files = sweep(
+                str(samples_path),
+                str(output_path),
+                thresholds,
+                significance_levels,
+                mutation_count=args.mutation_count,
+                R=args.R,
+                signatures=signatures,
+                drop_zeros_columns=args.drop_zeros,
+                output_format=args.output_format,
+                seed=args.seed,
+                chunk_size=args.chunk_size,
+                n_jobs=args.n_jobs,
+                schedule=args.schedule,
+                cost_model=args.cost_model,
+                screening=args.screening,
+                sampling=args.sampling,
+                time_budget=args.time_budget,
+                work_budget=args.work_budget,
+                degrade=args.degrade,
+                replicate_jobs=args.replicate_jobs,
+                clusters=args.clusters,
+                backend=args.backend,
+                allowed_signatures=args.allowed_signatures,
+                sample_groups=args.sample_groups
+            )
+        except Exception as e:
+            # Like 'run_single_analysis', a bad input file ends the run with a message instead of a traceback
+            print(f"Error: {e}")
+            sys.exit(1)
+        print("\n✓ Sweep completed successfully!")
+        for output_file in output_files.values():
+            print(f"  Results saved to: {output_file}")
+        return
+    
     success = run_single_analysis(
         samples_path,
         output_path,
@@ -270,7 +689,26 @@ def main():
         mutation_count=args.mutation_count,
         R=args.R,
         significance_level=args.significance_level,
-        drop_zeros_columns=args.drop_zeros
+        drop_zeros_columns=args.drop_zeros,
+        seed=args.seed,
+        shard=shard,
+        chunk_size=args.chunk_size,
+        n_jobs=args.n_jobs,
+        save_bootstrap=args.save_bootstrap,
+        schedule=args.schedule,
+        cost_model=args.cost_model,
+        output_format=args.output_format,
+        screening=args.screening,
+        sampling=args.sampling,
+        time_budget=args.time_budget,
+        work_budget=args.work_budget,
+        degrade=args.degrade,
+        max_memory=args.max_memory,
+        replicate_jobs=args.replicate_jobs,
+        clusters=args.clusters,
+        backend=args.backend,
+        allowed_signatures=args.allowed_signatures,
+        sample_groups=args.sample_groups
     )
     
     if not success:
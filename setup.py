@@ -14,6 +14,9 @@ setup(
         'numpy',
         'quadprog'
     ],
+    extras_require={
+        'numba': ['numba'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         #'License :: OSI Approved :: MIT License',
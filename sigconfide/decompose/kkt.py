@@ -0,0 +1,109 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from sigconfide.decompose.qp import decomposeQP
+
+
+class KKTFastPath:
+    """
+    Decomposition front-end that tries the closed-form equality-constrained solution before the full QP.
+
+    Dropping the sign constraints of the problem solved by 'decomposeQP' leaves the equality-constrained least-squares
+    problem min ||m - Pe|| subject to sum(e) = 1, whose solution is the affine map e = A m + c given by its KKT system.
+    When that solution is nonnegative it is also the optimum of the full problem, so the QP is only called for the
+    columns that violate nonnegativity. The map (A, c) is computed with one linear solve per signature matrix and
+    cached, and all columns of a replicate matrix are mapped with a single matrix product.
+
+    An instance can be passed as 'decomposition_method' to every estimation and model selection function;
+    'findSigExposures' uses its 'batch' method to solve whole replicate matrices at once. The counters 'columns' and
+    'hits' record how many columns were solved and how many of them took the fast path.
+
+    Examples:
+        decomposeKKT.reset_stats()
+        hybrid_selection(m, P, R=100, threshold=0.01, mutation_count=None, significance_level=0.01,
+                         decomposition_method=decomposeKKT)
+        print(decomposeKKT.hit_rate)
+    """
+
+    def __init__(self, fallback=decomposeQP, tol=1e-12, cache_size=64):
+        self.fallback = fallback
+        self.tol = tol
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.columns = 0
+        self.hits = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of the solved columns that did not need the full QP."""
+        return self.hits / self.columns if self.columns else 0.0
+
+    def report(self):
+        return {'columns': self.columns, 'hits': self.hits, 'hit_rate': self.hit_rate}
+
+    def affine_map(self, P):
+        """
+        Return the cached (A, c) such that A m + c solves the equality-constrained problem for the columns of 'P'.
+        """
+        P = np.ascontiguousarray(P, dtype=float)
+        key = (P.shape, hashlib.sha1(P.tobytes()).digest())
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        N = P.shape[1]
+        G = np.dot(P.T, P)
+        # One linear solve gives both G^-1 P' and G^-1 1
+        solved = np.linalg.solve(G, np.column_stack([P.T, np.ones(N)]))
+        GinvPt, h = solved[:, :-1], solved[:, -1]
+        s = h.sum()
+        A = GinvPt - np.outer(h, GinvPt.sum(axis=0)) / s
+        c = h / s
+
+        self._cache[key] = (A, c)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return A, c
+
+    def batch(self, M, P):
+        """
+        Find the exposures of every column of 'M', calling the fallback QP only for infeasible columns.
+
+        :param M: Tumor profiles (mutation probabilities), one per column, with a shape of (96, C).
+        :type M: numpy.ndarray
+        :param P: Signature profile matrix with a shape of (96, N).
+        :type P: numpy.ndarray
+
+        :returns: A matrix of exposures with a shape of (N, C).
+        :rtype: numpy.ndarray
+        """
+        A, c = self.affine_map(P)
+        exposures = np.dot(A, M) + c[:, None]
+
+        feasible = exposures.min(axis=0) >= -self.tol
+        infeasible = np.where(~feasible)[0]
+        if len(infeasible) > 0:
+            fallback_batch = getattr(self.fallback, 'batch', None)
+            if fallback_batch is not None:
+                exposures[:, infeasible] = fallback_batch(M[:, infeasible], P)
+            else:
+                for i in infeasible:
+                    exposures[:, i] = self.fallback(M[:, i], P)
+
+        self.columns += M.shape[1]
+        self.hits += int(feasible.sum())
+
+        # Same clean-up as in decomposeQP
+        exposures[exposures < 0] = 0
+        exposures /= exposures.sum(axis=0)
+        return exposures
+
+    def __call__(self, m, P):
+        return self.batch(np.reshape(m, (-1, 1)), P)[:, 0]
+
+
+decomposeKKT = KKTFastPath()
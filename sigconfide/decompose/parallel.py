@@ -0,0 +1,147 @@
+import multiprocessing
+import numpy as np
+
+from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.warm import warm_start
+
+# The decomposition method of a worker process, set once by 'init_worker' so tasks only carry the columns
+worker_method = None
+
+
+def init_worker(decomposition_method):
+    global worker_method
+    worker_method = decomposition_method
+
+
+def method_counters(decomposition_method):
+    """The ('columns', 'hits') counters of a method that keeps them (e.g. 'decomposeKKT'), None otherwise."""
+    if not hasattr(decomposition_method, 'columns') or not hasattr(decomposition_method, 'hits'):
+        return None
+    return decomposition_method.columns, decomposition_method.hits
+
+
+def solve_columns(decomposition_method, M, P):
+    """Solve every column of 'M' with 'decomposition_method', with its 'batch' method when it has one."""
+    batch = getattr(decomposition_method, 'batch', None)
+    if batch is not None:
+        return batch(M, P)
+    return np.apply_along_axis(decomposition_method, 0, M, P)
+
+
+def solve_chunk(args):
+    # Returns the exposures and the counters of the chunk, which the parent adds to its own method
+    M, P, observed = args
+    if observed is not None:
+        warm_start(worker_method, observed, P)
+    before = method_counters(worker_method)
+    exposures = solve_columns(worker_method, M, P)
+    if before is None:
+        return exposures, None
+    after = method_counters(worker_method)
+    return exposures, (after[0] - before[0], after[1] - before[1])
+
+
+class ParallelDecomposition:
+    """
+    Decomposition front-end that solves the replicates of one sample on a pool of worker processes.
+
+    'findSigExposures' calls 'batch' with the whole replicate matrix of every elimination and forward selection step;
+    its columns are split into at most 'n_jobs' contiguous chunks of at least 'min_columns' columns, solved by
+    'decomposition_method' in the workers and stacked back in order, so the exposures, errors and p-values are the
+    same as with 'decomposition_method' alone, for methods that solve every column on its own such as 'decomposeQP'
+    and 'decomposeWarmQP'. This cuts the latency of a single sample with large R; for a cohort, 'fit' with n_jobs
+    processes samples in parallel instead.
+
+    The pool is started on the first parallel call and reused by every step until 'close' (or the end of a 'with'
+    block). The observed profile given to 'warm_start' is sent with the chunks, so warm-started methods keep their
+    warm start in the workers. The counters ('columns', 'hits') of the workers' methods are added to the counters of
+    'decomposition_method' after every call, and 'columns' and 'hits' read them.
+    Inside a worker process of 'fit', which cannot start processes, the columns are solved in place.
+
+    :param decomposition_method: The method solving the columns. Defaults to 'decomposeQP'.
+    :type decomposition_method: function, optional
+    :param n_jobs: The number of worker processes. Defaults to the number of CPUs.
+    :type n_jobs: int, optional
+    :param min_columns: The smallest chunk of columns sent to a worker; smaller replicate matrices are solved in
+        place. Defaults to 64.
+    :type min_columns: int, optional
+
+    Examples:
+        with ParallelDecomposition(decomposeQP, n_jobs=8) as decomposeParallel:
+            hybrid_selection(m, P, R=2000, threshold=0.01, mutation_count=None, significance_level=0.01,
+                             decomposition_method=decomposeParallel)
+    """
+
+    def __init__(self, decomposition_method=decomposeQP, n_jobs=None, min_columns=64):
+        self.decomposition_method = decomposition_method
+        self.n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+        self.min_columns = min_columns
+        self._pool = None
+        self._observed = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_pool'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes; the next parallel call starts new ones."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @property
+    def columns(self):
+        return self.decomposition_method.columns
+
+    @property
+    def hits(self):
+        return self.decomposition_method.hits
+
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.n_jobs, initializer=init_worker,
+                                              initargs=(self.decomposition_method,))
+        return self._pool
+
+    def warm_start(self, m, P):
+        """Warm-start 'decomposition_method' here and, with the next chunks solved with 'P', in the workers."""
+        if getattr(self.decomposition_method, 'warm_start', None) is not None:
+            warm_start(self.decomposition_method, m, P)
+            self._observed = (np.asarray(m, dtype=float), np.array(P))
+
+    def batch(self, M, P):
+        """
+        Find the exposures of every column of 'M', split into chunks solved by the workers.
+
+        :param M: Tumor profiles (mutation probabilities), one per column, with a shape of (96, C).
+        :type M: numpy.ndarray
+        :param P: Signature profile matrix with a shape of (96, N).
+        :type P: numpy.ndarray
+
+        :returns: A matrix of exposures with a shape of (N, C).
+        :rtype: numpy.ndarray
+        """
+        n_chunks = min(self.n_jobs, M.shape[1] // max(self.min_columns, 1))
+        if n_chunks < 2 or multiprocessing.current_process().daemon:
+            return solve_columns(self.decomposition_method, M, P)
+        observed = None
+        if self._observed is not None and np.array_equal(self._observed[1], P):
+            observed = self._observed[0]
+        chunks = np.array_split(M, n_chunks, axis=1)
+        solved = self.pool().map(solve_chunk, [(chunk, P, observed) for chunk in chunks])
+        for _, counters in solved:
+            if counters is not None:
+                self.decomposition_method.columns += counters[0]
+                self.decomposition_method.hits += counters[1]
+        return np.hstack([exposures for exposures, _ in solved])
+
+    def __call__(self, m, P):
+        return self.decomposition_method(m, P)
@@ -1,7 +1,12 @@
-import quadprog
 import numpy as np
 
+# Imported on the first solve, so importing the package does not load quadprog
+quadprog = None
+
 def decomposeQP(m, P):
+    global quadprog
+    if quadprog is None:
+        import quadprog
     # N: how many signatures are selected
     N = P.shape[1]
     # G: matrix appearing in the quadratic programming objective function
@@ -0,0 +1,159 @@
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+# Decomposition backends by name: the module and attribute of the method and the module it needs to be useful.
+# Modules are only imported when a backend is used, so importing the registry does not load quadprog or numba.
+BACKENDS = {
+    'qp': ('sigconfide.decompose.qp', 'decomposeQP', 'quadprog'),
+    'kkt': ('sigconfide.decompose.kkt', 'decomposeKKT', 'quadprog'),
+    'warm': ('sigconfide.decompose.warm', 'decomposeWarmQP', 'quadprog'),
+    'simplex': ('sigconfide.decompose.simplex', 'decomposeSimplex', 'numba'),
+}
+
+DEFAULT_BACKEND = 'qp'
+
+# Backend picked by 'select_backend' for every problem shape, per machine
+CALIBRATION_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                                'sigconfide', 'backends.json')
+
+# The largest number of columns solved by a calibration, larger problems are timed on this many columns
+MAX_CALIBRATION_COLUMNS = 256
+
+
+def register_backend(name, module, attribute, requires=None):
+    """
+    Register the decomposition method 'attribute' of 'module' under 'name', to be imported when it is first used.
+
+    :param requires: A module the backend needs, e.g. 'numba'; without it the backend is not available.
+    :type requires: str, optional
+    """
+    BACKENDS[name] = (module, attribute, requires)
+
+
+def backend_available(name):
+    """Check that the backend 'name' is registered and the module it needs can be imported, without importing it."""
+    if name not in BACKENDS:
+        return False
+    requires = BACKENDS[name][2]
+    return requires is None or requires in sys.modules or importlib.util.find_spec(requires) is not None
+
+
+def available_backends():
+    return [name for name in BACKENDS if backend_available(name)]
+
+
+def get_backend(name):
+    """
+    Import and return the decomposition method of the backend 'name'.
+
+    :raises ValueError: If no backend is registered under 'name'.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown decomposition backend '{name}', use one of {', '.join(BACKENDS)} or 'auto'.")
+    module, attribute, _ = BACKENDS[name]
+    return getattr(importlib.import_module(module), attribute)
+
+
+def machine_key():
+    """The key of this machine in the calibration file: its host name, architecture and Python version."""
+    return f"{platform.node()}-{platform.machine()}-py{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def shape_key(K, N, C):
+    # The number of columns is rounded up to a power of two, so close replicate counts share a calibration
+    C = min(int(2 ** np.ceil(np.log2(max(C, 1)))), MAX_CALIBRATION_COLUMNS)
+    return f"{K}x{N}x{C}"
+
+
+def calibrate(K, N, C, backends=None, repeats=2, seed=0, atol=1e-6):
+    """
+    Time every backend on a synthetic problem of the shape (K, N, C) and return the name of the fastest correct one.
+
+    The problem has a random catalog of N signatures over K mutation types and C bootstrap replicates of a sample
+    made of a few of them; it is solved with 'findSigExposures', after 'warm_start' like in the selection. A backend
+    is correct when its exposures are within 'atol' of those of 'qp' (or of the first backend without quadprog),
+    and the fastest correct backend over 'repeats' runs is returned.
+
+    :returns: The name of the backend and the seconds taken by every backend (None for the incorrect ones).
+    :rtype: tuple(str, dict)
+    """
+    from sigconfide.estimates.standard import findSigExposures
+    from sigconfide.decompose.warm import warm_start
+
+    backends = available_backends() if backends is None else [name for name in backends if backend_available(name)]
+    if not backends:
+        raise ValueError("No decomposition backend is available.")
+    C = min(C, MAX_CALIBRATION_COLUMNS)
+    random_state = np.random.RandomState(seed)
+    P = random_state.dirichlet(np.full(K, 0.5), size=N).T
+    weights = np.zeros(N)
+    weights[random_state.choice(N, size=min(N, 4), replace=False)] = random_state.dirichlet(np.ones(min(N, 4)))
+    m = np.dot(P, weights)
+    M = random_state.multinomial(2000, m / m.sum(), size=C).T / 2000.0
+
+    reference = None
+    timings = {}
+    for name in sorted(backends, key=lambda name: name != DEFAULT_BACKEND):
+        method = get_backend(name)
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            warm_start(method, m, P)
+            exposures, _ = findSigExposures(M, P, decomposition_method=method)
+            best = min(best, time.perf_counter() - start)
+        if reference is None:
+            reference = exposures
+        timings[name] = best if np.allclose(exposures, reference, atol=atol) else None
+
+    correct = {name: seconds for name, seconds in timings.items() if seconds is not None}
+    return min(correct, key=correct.get), timings
+
+
+def select_backend(K, N, C, cache_file=CALIBRATION_FILE):
+    """
+    Return the name of the fastest correct backend for problems of the shape (K, N, C), see 'calibrate'.
+
+    The choice is cached in 'cache_file' per machine and shape, so the calibration runs once; a cache that cannot be
+    written (e.g. a read-only home folder) is ignored and the calibration runs again the next time.
+    """
+    machine, shape = machine_key(), shape_key(K, N, C)
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            cache = {}
+    name = cache.get(machine, {}).get(shape)
+    if name is not None and backend_available(name):
+        return name
+
+    name, _ = calibrate(K, N, C)
+    cache.setdefault(machine, {})[shape] = name
+    if cache_file is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+            with open(cache_file, 'w') as file:
+                json.dump(cache, file, indent=2)
+        except OSError:
+            pass
+    return name
+
+
+def resolve_backend(backend, K, N, C, cache_file=CALIBRATION_FILE):
+    """
+    Return the decomposition method for 'backend': a method is returned as is, a name is looked up in the registry
+    and 'auto' picks the fastest backend for problems of the shape (K, N, C) with 'select_backend'.
+    """
+    if callable(backend):
+        return backend
+    if backend == 'auto':
+        backend = select_backend(K, N, C, cache_file)
+    return get_backend(backend)
@@ -0,0 +1,178 @@
+import os
+import numpy as np
+from sigconfide.decompose.qp import decomposeQP
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+
+def simplex_lsq(G, D, tol=1e-12, max_iter=500):
+    """
+    Solve the sum-to-one nonnegative least-squares problem for many columns with a primal active-set method.
+
+    For every column d of D it minimizes 1/2 * e'Ge - d'e subject to sum(e) = 1 and e >= 0, which for G = P'P and
+    d = P'm is the problem solved by 'decomposeQP'. The iteration starts from the best single-signature solution and,
+    on each step, solves the equality-constrained problem restricted to the free signatures, freeing the signature
+    with the most negative multiplier or fixing at zero the first free signature that would become negative.
+
+    :param G: The matrix of the quadratic programming objective function, with a shape of (N, N).
+    :type G: numpy.ndarray
+    :param D: The linear terms of the objective function, one column per problem, with a shape of (N, C).
+    :type D: numpy.ndarray
+    :param tol: The tolerance used for the feasibility and optimality tests. Defaults to 1e-12.
+    :type tol: float, optional
+    :param max_iter: The maximal number of active-set changes per column. Defaults to 500.
+    :type max_iter: int, optional
+
+    :returns: A matrix of exposures with a shape of (N, C); the columns whose KKT system is singular (e.g. collinear
+        signatures) or that do not converge within 'max_iter' changes are NaN.
+    :rtype: numpy.ndarray
+    """
+    N = G.shape[0]
+    C = D.shape[1]
+    exposures = np.zeros((N, C))
+
+    for c in range(C):
+        d = D[:, c]
+        # Start from the best single-signature solution, optimal exposures are sparse
+        start = 0
+        for i in range(N):
+            if 0.5 * G[i, i] - d[i] < 0.5 * G[start, start] - d[start]:
+                start = i
+        free = np.zeros(N, dtype=np.bool_)
+        free[start] = True
+        e = np.zeros(N)
+        e[start] = 1.0
+        converged = False
+
+        for _ in range(max_iter):
+            # Equality-constrained problem on the free signatures (KKT system with one multiplier)
+            idx = np.where(free)[0]
+            k = idx.shape[0]
+            A = np.zeros((k + 1, k + 1))
+            b = np.zeros(k + 1)
+            for i in range(k):
+                for j in range(k):
+                    A[i, j] = G[idx[i], idx[j]]
+                A[i, k] = 1.0
+                A[k, i] = 1.0
+                b[i] = d[idx[i]]
+            b[k] = 1.0
+            try:
+                solution = np.linalg.solve(A, b)
+            except Exception:
+                break
+            if not np.all(np.isfinite(solution)):
+                break
+
+            z = np.zeros(N)
+            for i in range(k):
+                z[idx[i]] = solution[i]
+
+            if z.min() >= -tol:
+                e = z
+                # Multipliers of the bound constraints of the signatures outside the free set
+                gradient = G.dot(e) - d
+                multiplier = solution[k]
+                worst = -1
+                worst_value = -tol
+                for i in range(N):
+                    if not free[i]:
+                        mu = gradient[i] + multiplier
+                        if mu < worst_value:
+                            worst = i
+                            worst_value = mu
+                if worst < 0:
+                    converged = True
+                    break
+                free[worst] = True
+            else:
+                # Move towards z until the first free signature reaches zero and fix it at zero
+                alpha = 1.0
+                blocking = -1
+                for i in range(N):
+                    if free[i] and z[i] < 0:
+                        step = e[i] / (e[i] - z[i])
+                        if step < alpha:
+                            alpha = step
+                            blocking = i
+                e = e + alpha * (z - e)
+                for i in range(N):
+                    if free[i] and (i == blocking or e[i] <= tol):
+                        free[i] = False
+                        e[i] = 0.0
+
+        if not converged:
+            e[:] = np.nan
+        exposures[:, c] = e
+
+    return exposures
+
+
+def cache_enabled():
+    # numba caches the compiled kernel next to this file, or in NUMBA_CACHE_DIR; installs that are not writable
+    # compile it once per process instead
+    return bool(os.environ.get('NUMBA_CACHE_DIR')) or os.access(os.path.dirname(os.path.abspath(__file__)), os.W_OK)
+
+
+if NUMBA_AVAILABLE:
+    _simplex_lsq = numba.njit(cache=cache_enabled())(simplex_lsq)
+else:
+    _simplex_lsq = None
+
+
+def decomposeSimplexBatch(M, P):
+    """
+    Find the exposures of every column of 'M' with the compiled active-set kernel.
+
+    All columns are solved inside one call of compiled code, the columns the kernel cannot solve (see 'simplex_lsq')
+    are solved with 'decomposeQP', as in 'KKTFastPath'. When numba is not installed, every column is solved with
+    'decomposeQP' instead.
+
+    :param M: Tumor profiles (mutation probabilities), one per column, with a shape of (96, C).
+    :type M: numpy.ndarray
+    :param P: Signature profile matrix with a shape of (96, N).
+    :type P: numpy.ndarray
+
+    :returns: A matrix of exposures with a shape of (N, C).
+    :rtype: numpy.ndarray
+    """
+    if not NUMBA_AVAILABLE:
+        return np.column_stack([decomposeQP(M[:, i], P) for i in range(M.shape[1])])
+
+    P = np.ascontiguousarray(P, dtype=float)
+    G = np.dot(P.T, P)
+    D = np.ascontiguousarray(np.dot(P.T, M), dtype=float)
+    exposures = _simplex_lsq(G, D)
+    for i in np.flatnonzero(np.isnan(exposures[0])):
+        exposures[:, i] = decomposeQP(M[:, i], P)
+
+    # Same clean-up as in decomposeQP
+    exposures[exposures < 0] = 0
+    exposures /= exposures.sum(axis=0)
+    return exposures
+
+
+def decomposeSimplex(m, P):
+    """
+    Drop-in replacement of 'decomposeQP' backed by the compiled active-set kernel when numba is installed.
+
+    'findSigExposures' detects the 'batch' attribute of this function and solves all columns at once with
+    'decomposeSimplexBatch', so it can be passed as 'decomposition_method' to the estimation and model selection
+    functions. Without numba it falls back to 'decomposeQP'.
+
+    Examples:
+        exposures, errors = findSigExposures(tumorBRCA, signaturesCOSMIC, decomposeSimplex)
+        hybrid_selection(m, P, R=100, threshold=0.01, mutation_count=None, significance_level=0.01,
+                         decomposition_method=decomposeSimplex)
+    """
+    if not NUMBA_AVAILABLE:
+        return decomposeQP(m, P)
+    return decomposeSimplexBatch(np.reshape(m, (-1, 1)), P)[:, 0]
+
+
+decomposeSimplex.batch = decomposeSimplexBatch
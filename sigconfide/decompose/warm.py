@@ -0,0 +1,179 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.kkt import KKTFastPath
+
+
+class WarmStartQP:
+    """
+    Decomposition front-end that solves the replicates of a sample from the active set of its observed profile.
+
+    Bootstrap replicates are small perturbations of the observed profile, so their optimal sets of signatures with
+    a positive exposure (the active sets) are nearly always the same as the one of the observed profile. 'warm_start'
+    solves the observed profile with the full QP and keeps its active set F for the signature matrix; the replicates
+    are then solved on F in closed form (the equality-constrained least-squares solution, see 'KKTFastPath') and the
+    solution of a replicate is accepted when it satisfies the optimality conditions of the full problem: nonnegative
+    exposures on F and nonnegative multipliers of the bounds of the signatures outside F. A replicate that fails this
+    check updates its active set with a few primal-dual active set iterations, and only the replicates that do not
+    converge within 'max_iter' iterations are solved cold with 'fallback'.
+
+    'hybrid_selection', 'backward_elimination' and 'bootstrapSigExposures' call 'warm_start' with the observed profile
+    before solving the replicates of each model. When no observed profile was given for a signature matrix, 'batch'
+    uses the mean of the replicates it solves, an estimate of the observed profile. The counters 'columns' and 'hits'
+    record how many columns were solved and how many of them were solved from the warm start.
+
+    Examples:
+        decomposeWarmQP.reset_stats()
+        hybrid_selection(m, P, R=100, threshold=0.01, mutation_count=None, significance_level=0.01,
+                         decomposition_method=decomposeWarmQP)
+        print(decomposeWarmQP.report())
+    """
+
+    def __init__(self, fallback=decomposeQP, tol=1e-10, max_iter=2, min_group=16, cache_size=64):
+        self.fallback = fallback
+        self.tol = tol
+        self.max_iter = max_iter
+        self.min_group = min_group
+        self.cache_size = cache_size
+        self._kkt = KKTFastPath(fallback=fallback, cache_size=cache_size)
+        self._active_sets = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.columns = 0
+        self.hits = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of the solved columns that did not need a cold solve."""
+        return self.hits / self.columns if self.columns else 0.0
+
+    def report(self):
+        return {'columns': self.columns, 'hits': self.hits, 'hit_rate': self.hit_rate}
+
+    @staticmethod
+    def _key(P):
+        P = np.ascontiguousarray(P, dtype=float)
+        return P.shape, hashlib.sha1(P.tobytes()).digest()
+
+    def warm_start(self, m, P):
+        """
+        Solve the observed profile 'm' cold and keep its active set as the warm start of the replicates solved with 'P'.
+
+        :returns: The exposures of 'm'.
+        :rtype: numpy.ndarray
+        """
+        m = np.asarray(m, dtype=float)
+        exposures = self.fallback(m / m.sum(), P)
+        key = self._key(P)
+        self._active_sets[key] = exposures > self.tol
+        self._active_sets.move_to_end(key)
+        if len(self._active_sets) > self.cache_size:
+            self._active_sets.popitem(last=False)
+        return exposures
+
+    def solve_on(self, M, P, free):
+        """
+        Solve the columns of 'M' on the active set 'free' and check the optimality conditions of the full problem.
+
+        :returns: The exposures (N, C), the mask of the columns whose solution is optimal, and the active set
+            of the next iteration of every column (N, C): signatures of 'free' with a positive exposure and
+            signatures outside it with a negative multiplier.
+        :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        exposures = np.zeros((P.shape[1], M.shape[1]))
+        P_free, P_bound = P[:, free], P[:, ~free]
+        A, c = self._kkt.affine_map(P_free)
+        exposures[free] = np.dot(A, M) + c[:, None]
+        residuals = M - np.dot(P_free, exposures[free])
+        # Multiplier of the equality constraint, the same for every signature of F at the optimum
+        l = -np.dot(P_free.T, residuals).mean(axis=0)
+        multipliers = np.zeros_like(exposures)
+        multipliers[~free] = -np.dot(P_bound.T, residuals) - l
+
+        converged = (exposures.min(axis=0) >= -self.tol) & (multipliers.min(axis=0) >= -self.tol)
+        next_free = np.where(free[:, None], exposures > self.tol, multipliers < -self.tol)
+        return exposures, converged, next_free
+
+    def batch(self, M, P):
+        """
+        Find the exposures of every column of 'M' from the warm start, solving cold only the columns where it fails.
+
+        Columns whose solution on the warm active set is not optimal take up to 'max_iter' primal-dual active set
+        iterations, in groups of columns with the same active set, before they are solved cold with 'fallback'.
+
+        :param M: Tumor profiles (mutation probabilities), one per column, with a shape of (96, C).
+        :type M: numpy.ndarray
+        :param P: Signature profile matrix with a shape of (96, N).
+        :type P: numpy.ndarray
+
+        :returns: A matrix of exposures with a shape of (N, C).
+        :rtype: numpy.ndarray
+        """
+        free = self._active_sets.get(self._key(P))
+        if free is None:
+            self.warm_start(M.mean(axis=1), P)
+            free = self._active_sets[self._key(P)]
+
+        exposures = np.zeros((P.shape[1], M.shape[1]))
+        active_sets = np.repeat(free[:, None], M.shape[1], axis=1)
+        pending = np.arange(M.shape[1])
+        cold = []
+        for iteration in range(self.max_iter + 1):
+            if len(pending) == 0:
+                break
+            sets, groups, counts = np.unique(active_sets[:, pending], axis=1, return_inverse=True,
+                                             return_counts=True)
+            grouped = np.split(pending[np.argsort(groups.ravel(), kind='stable')], np.cumsum(counts)[:-1])
+            moving = []
+            for index, columns in enumerate(grouped):
+                if iteration > 0 and len(columns) < self.min_group:
+                    # Solving a small group on its own costs more than solving its columns cold
+                    cold.append(columns)
+                    continue
+                try:
+                    solved, converged, next_free = self.solve_on(M[:, columns], P, sets[:, index])
+                except np.linalg.LinAlgError:
+                    cold.append(columns)
+                    continue
+                exposures[:, columns[converged]] = solved[:, converged]
+                self.hits += int(converged.sum())
+                # A column whose active set does not change (or becomes empty) is stuck and solved cold
+                changed = np.any(next_free != sets[:, [index]], axis=0) & next_free.any(axis=0)
+                active_sets[:, columns] = next_free
+                moving.append(columns[~converged & changed])
+                cold.append(columns[~converged & ~changed])
+            pending = np.concatenate(moving) if moving else pending[:0]
+        cold = np.concatenate(cold + [pending]).astype(int)
+
+        if len(cold) > 0:
+            fallback_batch = getattr(self.fallback, 'batch', None)
+            if fallback_batch is not None:
+                exposures[:, cold] = fallback_batch(M[:, cold], P)
+            else:
+                for i in cold:
+                    exposures[:, i] = self.fallback(M[:, i], P)
+        self.columns += M.shape[1]
+
+        # Same clean-up as in decomposeQP
+        exposures[exposures < 0] = 0
+        exposures /= exposures.sum(axis=0)
+        return exposures
+
+    def __call__(self, m, P):
+        return self.batch(np.reshape(m, (-1, 1)), P)[:, 0]
+
+
+def warm_start(decomposition_method, m, P):
+    """
+    Solve the observed profile 'm' first with decomposition methods that warm-start the replicates from it
+    (see 'WarmStartQP'), other methods are left alone.
+    """
+    start = getattr(decomposition_method, 'warm_start', None)
+    if start is not None:
+        start(m, P)
+
+
+decomposeWarmQP = WarmStartQP()
@@ -1,6 +1,8 @@
 import numpy as np
-from sigconfide.utils.utils import is_wholenumber, FrobeniusNorm
+from sigconfide.utils.utils import is_wholenumber, FrobeniusNorm, multinomial_chain
 from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.warm import warm_start
+from sigconfide.estimates.standard import decompose_columns
 
 def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=decomposeQP):
     """
@@ -18,7 +20,8 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
         mutation_count (int, optional): If 'm' is a vector of counts, then 'mutation_count' equals
             the summation of all the counts. If 'm' is probabilities, 'mutation_count' must be specified.
         decomposition_method (function, optional): The method selected to get the optimal solution.
-            It should be a function. Default is 'decomposeQP'.
+            It should be a function. Default is 'decomposeQP'. With 'decomposeWarmQP', the replicates
+            are solved from the active set of the solution of 'm'.
 
     Returns:
         tuple: A tuple containing two numpy arrays.
@@ -44,7 +47,7 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
 
     # If 'mutation_count' is not specified, 'm' has to contain counts
     if mutation_count is None:
-        if all(is_wholenumber(val) for val in m):
+        if np.all(is_wholenumber(m)):
             mutation_count = int(m.sum())
         else:
             raise ValueError("Please specify the parameter 'mutation_count' in the function call or provide mutation counts in parameter 'm'.")
@@ -55,6 +58,8 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
     # Find optimal solutions using provided decomposition method for each bootstrap replicate
     # Matrix of signature exposures per replicate (column)
     K = len(m)  # number of mutation types
+    # Decomposition methods with a warm start solve the replicates from the solution of 'm'
+    warm_start(decomposition_method, m, P)
 
     def bootstrap_sample(m, mutation_count, K):
         mutations_sampled = np.random.choice(K, size=mutation_count, p=m)
@@ -70,3 +75,118 @@ def bootstrapSigExposures(m, P, R, mutation_count=None, decomposition_method=dec
     errors = np.vectorize(lambda i: FrobeniusNorm(m, P, exposures[:, i]))(range(exposures.shape[1]))
 
     return exposures, errors
+
+
+def bootstrap_cohort(M, mutation_counts, R, random_state=np.random):
+    """
+    Draw 'R' multinomial replicates of every column of the probability matrix 'M' (K, G) at once.
+
+    The counts are drawn with 'multinomial_chain', for all samples and replicates in a single call per mutation type.
+
+    :returns: The replicates normalized to probabilities, with a shape of (K, G, R).
+    :rtype: numpy.ndarray
+    """
+    totals = np.repeat(np.asarray(mutation_counts, dtype=np.int64).reshape(-1, 1), R, axis=1)
+    replicates = multinomial_chain(M, totals, random_state).astype(float)
+    replicates /= np.reshape(mutation_counts, (1, -1, 1))
+    return replicates
+
+
+def bootstrapCohortExposures(M, P, R, mutation_counts=None, decomposition_method=decomposeQP, batch_size=4096,
+                             summary=False, confidence=0.95):
+    """
+    Obtain the bootstrap distributions of the signature exposures of a whole cohort.
+
+    This is 'bootstrapSigExposures' for the G samples of 'M' at once: the replicates of all samples are drawn
+    together ('bootstrap_cohort') and solved in batches of about 'batch_size' columns of whole samples, with one
+    call of the 'batch' method of 'decomposition_method' per batch when it has one (e.g. 'decomposeSimplex' or
+    'decomposeKKT'). Decomposition methods with a warm start ('decomposeWarmQP') are warm-started and solved sample
+    by sample. The errors are computed against the observed profiles, as in 'bootstrapSigExposures'.
+
+    Only the drawing of the replicates is vectorized; every replicate is still a constrained least-squares problem
+    of its own, batched only by the methods that have a 'batch' method. The speedup over looping
+    'bootstrapSigExposures' is therefore bounded by the time of the loop over the time of the solves, and a 10 times
+    speedup is only reached when the draws dominate, i.e. with many mutations per sample. On 20 samples with 200
+    replicates of COSMIC v2.0 ('benchmarks/bootstrap_cohort.py'), it is 9 to 25 times faster with 20000 mutations
+    per sample, but only 2 to 5 times with 2000 mutations, where even free draws would give at most 2.2 times with
+    'decomposeQP' and 6.3 times with 'decomposeSimplex'.
+
+    Parameters:
+        M (numpy.ndarray): Observed tumor profiles with a shape of (96, G), counts or probabilities.
+        P (numpy.ndarray): Signature profile matrix with a shape of (96, N).
+        R (int): The number of bootstrap replicates per sample.
+        mutation_counts (int or numpy.ndarray, optional): The number of mutations of every sample, or one number
+            for all of them. Required when 'M' holds probabilities, the sums of the columns are used otherwise.
+        decomposition_method (function, optional): The method selected to get the optimal solution.
+            Default is 'decomposeQP'.
+        batch_size (int, optional): The number of replicates solved per batch. Default is 4096.
+        summary (bool, optional): If True, only summary statistics of every sample are returned, and the
+            exposures of the replicates are never held for more than one batch. Default is False.
+        confidence (float, optional): The level of the percentile confidence intervals of the summary.
+            Default is 0.95.
+
+    Returns:
+        tuple or dict: Without 'summary', a tuple containing two numpy arrays:
+            - exposures (numpy.ndarray): The exposures of every sample, signature and replicate, (G, N, R).
+            - errors (numpy.ndarray): The estimation error of every sample and replicate, (G, R).
+        With 'summary', a dictionary of arrays with a row per sample: 'mean', 'std', 'lower' and 'upper' (G, N)
+        for the exposures, and 'error' (G,) for the mean estimation error.
+
+    Raises:
+        ValueError: If the number of rows of 'M' and 'P' do not match, if 'P' has less than 2 columns, or if
+            'mutation_counts' is not specified and 'M' does not contain counts.
+
+    Examples:
+        exposures, errors = bootstrapCohortExposures(tumorBRCA, signaturesCOSMIC, 1000,
+                                                     decomposition_method=decomposeSimplex)
+        intervals = bootstrapCohortExposures(tumorBRCA, signaturesCOSMIC, 1000, summary=True)
+    """
+    M = np.asarray(M, dtype=float)
+    if M.ndim == 1:
+        M = M.reshape(-1, 1)
+    if M.shape[0] != P.shape[0]:
+        raise ValueError("Number of rows of matrices 'M' and 'P' must be the same.")
+    if P.shape[1] == 1:
+        raise ValueError("Matrices 'P' must have at least 2 columns (signatures).")
+    K, G = M.shape
+    N = P.shape[1]
+
+    if mutation_counts is None:
+        if np.all(is_wholenumber(M)):
+            mutation_counts = M.sum(axis=0).astype(np.int64)
+        else:
+            raise ValueError("Please specify the parameter 'mutation_counts' in the function call or provide mutation counts in parameter 'M'.")
+    mutation_counts = np.broadcast_to(np.asarray(mutation_counts, dtype=np.int64), (G,))
+    M = M / M.sum(axis=0)
+
+    warm = getattr(decomposition_method, 'warm_start', None) is not None
+    samples_per_batch = 1 if warm else max(1, batch_size // R)
+    if summary:
+        alpha = (1 - confidence) / 2
+        output = {'mean': np.empty((G, N)), 'std': np.empty((G, N)), 'lower': np.empty((G, N)),
+                  'upper': np.empty((G, N)), 'error': np.empty(G)}
+    else:
+        exposures, errors = np.empty((G, N, R)), np.empty((G, R))
+
+    for start in range(0, G, samples_per_batch):
+        stop = min(start + samples_per_batch, G)
+        g = stop - start
+        replicates = bootstrap_cohort(M[:, start:stop], mutation_counts[start:stop], R).reshape(K, g * R)
+        if warm:
+            warm_start(decomposition_method, M[:, start], P)
+        batch = decompose_columns(replicates, P, decomposition_method)[0]
+        batch /= np.sum(batch, axis=0)
+        # Residuals of the exposures of every replicate against the observed profile of its sample
+        residuals = np.repeat(M[:, start:stop], R, axis=1)
+        residuals -= np.dot(P, batch)
+        batch_errors = np.sqrt(np.square(residuals).sum(axis=0)).reshape(g, R)
+        batch = batch.reshape(N, g, R).transpose(1, 0, 2)
+        if summary:
+            output['mean'][start:stop] = batch.mean(axis=2)
+            output['std'][start:stop] = batch.std(axis=2)
+            output['lower'][start:stop], output['upper'][start:stop] = np.quantile(batch, [alpha, 1 - alpha], axis=2)
+            output['error'][start:stop] = batch_errors.mean(axis=1)
+        else:
+            exposures[start:stop] = batch
+            errors[start:stop] = batch_errors
+    return output if summary else (exposures, errors)
@@ -1,6 +1,5 @@
 import numpy as np
 from sigconfide.decompose.qp import decomposeQP
-from sigconfide.utils.utils import FrobeniusNorm
 def findSigExposures(M, P, decomposition_method=decomposeQP):
     """
      Find signature exposures for tumor profiles using specified decomposition method.
@@ -16,6 +15,8 @@ def findSigExposures(M, P, decomposition_method=decomposeQP):
              where N is the number of signatures (e.g., COSMIC: N=30).
          decomposition_method (function, optional): The method selected to get the
              optimal solution. It should be a function. Default is 'decomposeQP'.
+             If the function has a 'batch' attribute (e.g. 'decomposeSimplex'), all columns
+             of 'M' are solved with a single call of 'decomposition_method.batch(M, P)'.
 
      Returns:
          tuple: A tuple containing two numpy arrays.
@@ -47,11 +48,35 @@ def findSigExposures(M, P, decomposition_method=decomposeQP):
     # Normalize M by column (just in case it is not normalized)
     M = M / M.sum(axis=0)
 
-    # Find solutions
+    return decompose_columns(M, P, decomposition_method)
+
+
+def decompose_columns(M, P, decomposition_method=decomposeQP, residuals=None):
+    """
+     Find the exposures and estimation errors of the already normalized columns of 'M', without checking them.
+
+     This is the solving part of 'findSigExposures', for callers that normalize a replicate matrix once and solve it
+     for many signature matrices. 'residuals' is an optional buffer with the shape of 'M' that receives the residuals
+     of the fit, so the errors are computed without temporaries; a buffer that is not C-contiguous or not of the
+     dtype of the fit is not used. The errors are computed for all columns at once, so they can differ from
+     'FrobeniusNorm' of each column in the last bits.
+     """
     # Matrix of signature exposures per sample/patient (column)
-    exposures = np.apply_along_axis(decomposition_method, 0, M, P)
+    batch_method = getattr(decomposition_method, 'batch', None)
+    if batch_method is not None:
+        exposures = batch_method(M, P)
+    else:
+        exposures = np.apply_along_axis(decomposition_method, 0, M, P)
 
-    # Compute estimation error for each sample/patient (Frobenius norm)
-    errors = np.vectorize(lambda i: FrobeniusNorm(M[:, i], P, exposures[:, i]))(range(M.shape[1]))
+    # Estimation error for each sample/patient (Frobenius norm of the residuals of its column)
+    # 'np.dot' only writes into a C-contiguous buffer of the exact dtype of its result
+    if residuals is None or residuals.shape != M.shape or not residuals.flags.c_contiguous or \
+            residuals.dtype != np.result_type(P, exposures):
+        residuals = np.dot(P, exposures)
+    else:
+        np.dot(P, exposures, out=residuals)
+    np.subtract(M, residuals, out=residuals)
+    np.square(residuals, out=residuals)
+    errors = np.sqrt(residuals.sum(axis=0))
 
     return exposures, errors
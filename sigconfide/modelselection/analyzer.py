@@ -1,6 +1,21 @@
-from sigconfide.modelselection.hybrid import hybrid_selection
-from sigconfide.utils.utils import load_samples_file, load_signatures_file
+from sigconfide.modelselection.hybrid import hybrid_selection, solve_replicates, replicate_p_values
+from sigconfide.modelselection.backward import bootstraped_patient, BootstrapChunks, check_sampling
+from sigconfide.modelselection.screening import AnalyticScreen
+from sigconfide.modelselection.budget import SampleBudget, DEGRADE_METHODS, STATUS_OK, STATUS_FAILED
+from sigconfide.modelselection.scheduler import CostModel, sample_features, run_scheduled
+from sigconfide.modelselection.memory import plan_memory, current_rss
+from sigconfide.modelselection.clusters import cluster_selection, signature_clusters, load_clusters
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.parallel import ParallelDecomposition, method_counters
+from sigconfide.decompose.registry import resolve_backend, DEFAULT_BACKEND
+from sigconfide.utils.utils import load_signatures_file, save_activities_file, \
+    create_bootstrap_file, write_bootstrap_slice, activities_matrix, save_sparse_activities, save_status_file
+from sigconfide.utils.utils import load_mutation_types
+from sigconfide.utils.inputs import load_sample_files, sample_mutation_types, align_mutation_types, \
+    load_sample_groups, load_allowed_signatures
 from sigconfide.utils import utils
+import multiprocessing
 import numpy as np
 import os
 import sys
@@ -16,69 +31,575 @@ versions = {
 }
 
 def process_sample(args):
-    i, col, sigs, threshold, mutation_count, R, significance_level = args
+    # The seed is optional, so the tuples of the original signature (without it) still work
+    i, col, sigs, threshold, mutation_count, R, significance_level = args[:7]
+    seed = args[7] if len(args) > 7 else None
+    options = selection_options(threshold=threshold, mutation_count=mutation_count, R=R,
+                                significance_level=significance_level, seed=seed)
+    i, results = process_sample_catalogs((i, col, [sigs], options))
+    return (i,) + results[0][:2]
+
+def process_sample_catalogs(args):
+    # An optional fifth element restricts the sample to the given columns of every catalog (None for all columns)
+    i, col, catalogs, options = args[:4]
+    restriction = args[4] if len(args) > 4 else None
+    options = dict(options)
+    seed = options.pop('seed', None)
+    row = i - options.pop('offset', 0)
+    bootstrap_files = options.pop('bootstrap_files', None)
+    margin = options.pop('screening', None)
+    budget_options = options.pop('budget', None)
+    clusters = options.pop('clusters', None)
+    grid = options.pop('grid', None)
+    points = grid if grid is not None else [(options['threshold'], options['significance_level'])]
     try:
-        best_columns, estimation_exposures = hybrid_selection(
-            col, sigs, threshold=threshold, mutation_count=mutation_count, R=R, significance_level=significance_level
-        )
-        return (i, best_columns, estimation_exposures)
+        # Seed per sample so results do not depend on how the cohort is split; the random state of the sample
+        # gives the same replicates as seeding the global one, without touching it (samples may run in threads)
+        random_state = np.random.RandomState([seed, i]) if seed is not None else np.random
+        # The same replicates are used for every catalog
+        if options.get('chunk_size') is None:
+            M = bootstraped_patient(col, options['mutation_count'], options['R'], options['sampling'], random_state)
+        else:
+            M = BootstrapChunks(col, options['mutation_count'], options['R'], options['chunk_size'],
+                                sampling=options['sampling'], random_state=random_state)
     except Exception as e:
         print(f"Error processing sample {i}: {e}")
-        return (i, None, None)
+        return (i, [(None, None, None, None, STATUS_FAILED)] * (len(catalogs) * len(points)))
+
+    # Methods with a fast path (e.g. 'decomposeKKT') count the columns solved for this sample, reported per result
+    method = options.get('decomposition_method', decomposeQP)
+    results = []
+    for index, full_sigs in enumerate(catalogs):
+        columns = restriction[index] if restriction is not None else None
+        sigs = full_sigs if columns is None else full_sigs[:, columns]
+        # The p-values and bootstrap exposures of the final model are usually found in the cache, which is shared
+        # by the points of a grid
+        shared_cache = {} if isinstance(M, np.ndarray) else None
+        for threshold, significance_level in points:
+            point_options = dict(options, threshold=threshold, significance_level=significance_level)
+            # With a budget, every point solves its own models, so it is charged the same work as a single fit
+            solve_cache = shared_cache if budget_options is None or shared_cache is None else {}
+            screening = AnalyticScreen(margin) if margin is not None else None
+            budget = SampleBudget(**budget_options) if budget_options is not None else None
+            # The p-values of the models tested by the selection, the final model is usually one of them
+            step_p_values = {}
+            counters = method_counters(method)
+            try:
+                if clusters is not None:
+                    labels = clusters[index] if columns is None else np.asarray(clusters[index])[columns]
+                    best_columns, estimation_exposures = cluster_selection(
+                        col, sigs, labels, replicates=M, solve_cache=solve_cache, budget=budget,
+                        step_p_values=step_p_values, **point_options)
+                else:
+                    best_columns, estimation_exposures = hybrid_selection(
+                        col, sigs, replicates=M, solve_cache=solve_cache, screening=screening, budget=budget,
+                        step_p_values=step_p_values, **point_options)
+                status = budget.status if budget is not None else STATUS_OK
+                p_values = None
+                if status == STATUS_OK:
+                    # A degraded sample is out of budget already, its p-values are not computed. Otherwise they
+                    # were computed by the selection, unless screening decided the final model analytically
+                    p_values = step_p_values.get(tuple(int(column) for column in best_columns))
+                    if p_values is None:
+                        p_values = replicate_p_values(M, sigs, best_columns, threshold, method, solve_cache)
+                report = dict(screening.report()) if screening is not None else {}
+                if counters is not None:
+                    solved, hits = method_counters(method)
+                    report.update(fast_path_columns=solved - counters[0], fast_path_hits=hits - counters[1])
+                # Columns of a restricted catalog are reported as columns of the full catalog
+                results.append((best_columns if columns is None else columns[best_columns], estimation_exposures,
+                                p_values, report or None, status))
+            except Exception as e:
+                print(f"Error processing sample {i}: {e}")
+                results.append((None, None, None, None, STATUS_FAILED))
+                best_columns = None
+
+        if bootstrap_files is not None:
+            export_bootstrap_exposures(bootstrap_files[index], row, M, full_sigs, best_columns,
+                                       options.get('decomposition_method', decomposeQP), solve_cache, columns)
+    return (i, results)
+
+def export_bootstrap_exposures(file_name, row, M, sigs, best_columns, decomposition_method, solve_cache,
+                               columns=None):
+    """
+     Write the bootstrap exposures of the final model of one sample into the memory-mapped file 'file_name'.
+
+     Signatures outside the final model have zero exposures and the slice of a failed sample is filled with NaN.
+     The exposures of the final model are usually found in 'solve_cache', chunks are solved and written one by one.
+     With 'columns', the sample was fitted against these columns of 'sigs' and 'best_columns' are indices into them.
+     """
+    if best_columns is None:
+        R = M.shape[1] if isinstance(M, np.ndarray) else M.R
+        write_bootstrap_slice(file_name, row, slice(None), np.full((sigs.shape[1], R), np.nan))
+        return
+
+    targets = best_columns if columns is None else columns[best_columns]
+    if columns is not None:
+        sigs = sigs[:, columns]
+    if isinstance(M, np.ndarray):
+        exposures, errors = solve_replicates(M, sigs, best_columns, decomposition_method, solve_cache)
+        write_bootstrap_slice(file_name, row, targets, exposures)
+        return
+
+    start = 0
+    for chunk in M:
+        exposures, errors = findSigExposures(chunk, sigs[:, best_columns], decomposition_method=decomposition_method)
+        write_bootstrap_slice(file_name, row, targets, exposures, start=start)
+        start += chunk.shape[1]
+
+def load_catalog(signatures):
+    if isinstance(signatures, (int, float)):
+        return load_signatures_file(versions[signatures])
+    if isinstance(signatures, str):
+        return load_signatures_file(signatures)
+    raise ValueError("Parameter 'signatures' must be a COSMIC version (float) or a path to a signatures file (str).")
+
+def catalog_file(signatures):
+    return versions[signatures] if isinstance(signatures, (int, float)) else signatures
+
+def load_catalogs(signatures, mutation_types):
+    """
+     Load catalogs with 'load_catalog', with their rows reordered to the mutation types of the samples.
+
+     The samples keep the row order of their file, so the bootstrap replicates, and the results, of a sample do not
+     depend on the order of the rows of the catalog.
+     """
+    catalogs = []
+    for catalog in signatures:
+        sigs, names_signatures = load_catalog(catalog)
+        sigs = align_mutation_types(sigs, load_mutation_types(catalog_file(catalog)), mutation_types,
+                                    catalog_file(catalog))
+        catalogs.append((sigs, names_signatures))
+    return catalogs
+
+def catalog_label(signatures):
+    if isinstance(signatures, (int, float)):
+        return f"COSMIC_v{signatures}"
+    return os.path.splitext(os.path.basename(signatures))[0]
+
+def selection_options(threshold=0.01, mutation_count=None, R=100, significance_level=0.01, seed=None,
+                      chunk_size=None, offset=0, bootstrap_files=None, screening=None, sampling='multinomial',
+                      time_budget=None, work_budget=None, degrade='reduced_R', workers=False, clusters=None):
+    """
+     Check the parameters of the selection and pack them into the options of 'process_sample_catalogs'.
+
+     With 'workers', samples are processed by other processes, so a seed is drawn when none is given. 'clusters' is
+     None or the signature clusters of every catalog, which selects 'cluster_selection'.
+     """
+    check_sampling(sampling)
+    if clusters is not None and screening is not None:
+        raise ValueError("Parameters 'clusters' and 'screening' cannot be combined.")
+    if degrade not in DEGRADE_METHODS:
+        raise ValueError(f"Parameter 'degrade' must be one of {', '.join(DEGRADE_METHODS)}.")
+    budget = None
+    if time_budget is not None or work_budget is not None:
+        budget = dict(seconds=time_budget, solves=work_budget, degrade=degrade)
+    if workers and seed is None:
+        # Forked workers share the parent random state, so every sample needs its own seed
+        seed = np.random.randint(2**31 - 1)
+    return dict(threshold=threshold, mutation_count=mutation_count, R=R, significance_level=significance_level,
+                seed=seed, chunk_size=chunk_size, offset=offset, bootstrap_files=bootstrap_files,
+                screening=screening, sampling=sampling, budget=budget, clusters=clusters)
+
+def fit_catalogs(samples, names_patients, catalogs, threshold=0.01,
+                 mutation_count=None, R=100, significance_level=0.01, seed=None, offset=0, chunk_size=None,
+                 n_jobs=1, bootstrap_files=None, schedule='cost', cost_model=None, screening=None,
+                 sampling='multinomial', time_budget=None, work_budget=None, degrade='reduced_R', sample_chunk=None,
+                 replicate_jobs=1, clusters=None, backend=DEFAULT_BACKEND, restrictions=None, grid=None):
+    """
+     Run the hybrid selection for every column of an already loaded samples matrix against several catalogs.
+
+     'catalogs' is a list of (sigs, names_signatures) pairs as returned by 'load_catalog'. The bootstrap replicates of
+     each sample are generated once and shared by all catalogs. Returns one result per catalog, a dictionary of
+     arrays described in 'fit_arrays'; 'activities_matrix' converts it to the layout of
+     "Assignment_Solution_Activities.csv".
+     'offset' is the index of the first column within the whole cohort, it is used to seed each sample when 'seed'
+     is given, so that a part of the cohort gives the same results as the whole cohort.
+     With 'n_jobs' > 1 the samples are processed by a pool of worker processes. 'bootstrap_files' is an optional list
+     with one file created by 'create_bootstrap_file' per catalog, into which the workers write the bootstrap
+     exposures of the final model of each sample.
+     With schedule='cost', samples are dispatched to the workers longest-expected-first (see 'run_scheduled') and
+     'cost_model' is an optional JSON file of the per-sample cost model, loaded before and saved after the run;
+     schedule='fifo' dispatches them in file order.
+     'screening' is the margin of an 'AnalyticScreen' used for every sample, or None to use the bootstrap only.
+     'sampling' is the way replicates are generated, see 'bootstraped_patient'.
+     'time_budget' (seconds), 'work_budget' (replicate solves) and 'degrade' set the budget of the selection of
+     every sample and catalog, see 'SampleBudget'.
+     'sample_chunk' is the number of samples dispatched to a pool of workers at once: the scheduling features and the
+     tasks of a chunk are built when its turn comes and every chunk gets fresh workers, so memory does not grow with
+     the cohort. Results do not depend on it. By default the whole cohort is one chunk.
+     With 'replicate_jobs' > 1 and n_jobs=1, the replicates of every sample are solved by a pool of 'replicate_jobs'
+     processes (see 'ParallelDecomposition'), which gives the same results with a lower latency per sample.
+     'clusters' selects the cluster-aware selection ('cluster_selection'): a cosine similarity, with which the
+     clusters of every catalog are computed by 'signature_clusters', or a list with the clusters of every catalog.
+     'backend' is the name of a decomposition backend, 'auto' or a decomposition method (see 'resolve_backend').
+     'restrictions' has one entry per sample: None to fit the sample against the whole catalogs, or a list with the
+     allowed columns of every catalog (see 'restricted_columns'). A restricted sample is selected among its allowed
+     signatures only, and its results keep the layout of the whole catalog. Samples sharing the same allowed columns
+     are dispatched one after the other, so they share the caches of the decomposition backends.
+     'grid' is a list of (threshold, significance_level) pairs that replaces 'threshold' and 'significance_level':
+     every sample is selected with each pair, from the same replicates and, without a budget, the same memoized
+     replicate solves. The outputs are then ordered by catalog and, within a catalog, by pair.
+
+     :raises ValueError: If 'grid' is combined with 'bootstrap_files'.
+     """
+    points = [(threshold, significance_level)] if grid is None else [tuple(point) for point in grid]
+    if grid is not None and bootstrap_files is not None:
+        raise ValueError("The bootstrap exposures cannot be saved for a grid of parameters.")
+    if clusters is not None and not isinstance(clusters, (list, tuple)):
+        clusters = [signature_clusters(sigs, clusters) for sigs, _ in catalogs]
+    options = selection_options(threshold=threshold, mutation_count=mutation_count, R=R,
+                                significance_level=significance_level, seed=seed, chunk_size=chunk_size,
+                                offset=offset, bootstrap_files=bootstrap_files, screening=screening,
+                                sampling=sampling, time_budget=time_budget, work_budget=work_budget, degrade=degrade,
+                                workers=n_jobs > 1, clusters=clusters)
+    if grid is not None:
+        options['grid'] = points
+    G = samples.shape[1]
+    outputs = []
+    for sigs, names_signatures in [catalog for catalog in catalogs for _ in points]:
+        N = sigs.shape[1]
+        outputs.append({
+            'samples': np.asarray(names_patients),
+            'signatures': np.asarray(names_signatures[1:]),
+            'exposures': np.zeros((G, N)),
+            'selected': np.zeros((G, N), dtype=bool),
+            'errors': np.full(G, np.nan),
+            'p_values': np.full((G, N), np.nan),
+            'analytic_decisions': np.zeros(G, dtype=int),
+            'bootstrap_decisions': np.zeros(G, dtype=int),
+            'fast_path_columns': np.zeros(G, dtype=int),
+            'fast_path_hits': np.zeros(G, dtype=int),
+            'status': np.full(G, STATUS_OK, dtype=object),
+        })
+    catalogs_sigs = [sigs for sigs, _ in catalogs]
+
+    model = CostModel.load(cost_model) if n_jobs > 1 and schedule == 'cost' else None
+    sample_chunk = max(G, 1) if sample_chunk is None else sample_chunk
+    decomposition_method = resolve_backend(backend, samples.shape[0], max(sigs.shape[1] for sigs in catalogs_sigs),
+                                           min(R, chunk_size or R))
+    options['decomposition_method'] = decomposition_method
+    decomposer = None
+    if replicate_jobs > 1 and n_jobs == 1:
+        # Samples are processed one at a time, the replicates of each sample are solved by several processes
+        decomposer = ParallelDecomposition(decomposition_method, n_jobs=replicate_jobs)
+        options['decomposition_method'] = decomposer
+    restrictions = [None] * G if restrictions is None else restrictions
+    try:
+        for start in range(0, G, sample_chunk):
+            chunk = samples[:, start:start + sample_chunk]
+            tasks = [(offset + start + i, chunk[:, i], catalogs_sigs, options, restrictions[start + i])
+                     for i in range(chunk.shape[1])]
+            if model is not None:
+                features = restricted_features(chunk, catalogs_sigs, restrictions[start:start + sample_chunk], R,
+                                               threshold=threshold, mutation_count=mutation_count)
+                processed = run_scheduled(process_sample_catalogs, tasks, features, n_jobs, model)
+                for done, (i, (_, results)) in enumerate(processed):
+                    store_results(outputs, start + i, results, start + done, G)
+                continue
+
+            # Samples with the same allowed columns are processed one after the other
+            order = sorted(range(len(tasks)), key=lambda i: restriction_key(tasks[i][4]))
+            tasks = [tasks[i] for i in order]
+            pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+            try:
+                processed = pool.imap(process_sample_catalogs, tasks) if pool is not None else map(process_sample_catalogs, tasks)
+                for done, (i, results) in enumerate(processed):
+                    store_results(outputs, i - offset, results, start + done, G)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+    finally:
+        if decomposer is not None:
+            decomposer.close()
+    if model is not None and cost_model is not None:
+        model.save(cost_model)
+    return outputs
+
+def restriction_key(restriction):
+    if restriction is None:
+        return ()
+    return tuple(tuple(int(col) for col in columns) for columns in restriction)
+
+def restricted_features(samples, catalogs, restrictions, R, threshold=0.01, mutation_count=None):
+    """The 'sample_features' of every sample with its allowed columns of the catalogs, computed once per subset."""
+    groups = {}
+    for i, restriction in enumerate(restrictions):
+        groups.setdefault(restriction_key(restriction), (restriction, []))[1].append(i)
+    features = np.zeros((samples.shape[1], 5))
+    for restriction, indices in groups.values():
+        sigs = catalogs if restriction is None else [sigs[:, columns] for sigs, columns in zip(catalogs, restriction)]
+        features[indices] = sample_features(samples[:, indices], sigs, R, threshold=threshold,
+                                            mutation_count=mutation_count)
+    return features
+
+def store_results(outputs, i, results, done, n_samples):
+    for output, (best_columns, estimation_exposures, p_values, report, status) in zip(outputs, results):
+        output['status'][i] = status
+        if report is not None:
+            for key, name in (('analytic', 'analytic_decisions'), ('bootstrap', 'bootstrap_decisions'),
+                              ('fast_path_columns', 'fast_path_columns'), ('fast_path_hits', 'fast_path_hits')):
+                if key in report:
+                    output[name][i] = report[key]
+        if best_columns is not None:
+            output['exposures'][i, best_columns] = estimation_exposures[0].squeeze()
+            output['selected'][i, best_columns] = True
+            output['errors'][i] = estimation_exposures[1][0]
+            if p_values is not None:
+                output['p_values'][i, best_columns] = p_values
+
+    percent = (done + 1) / n_samples
+    sys.stdout.write('\r')
+    sys.stdout.write("[%-20s] %d%%" % ('=' * int(20 * percent), 100 * percent))
+    sys.stdout.flush()
+
+def as_catalog(signatures, names_signatures=None):
+    if not isinstance(signatures, np.ndarray):
+        return load_catalog(signatures)
+    if names_signatures is None:
+        names_signatures = [f"Signature_{k + 1}" for k in range(signatures.shape[1])]
+    if len(names_signatures) != signatures.shape[1]:
+        raise ValueError("Parameter 'names_signatures' must have one name per column of 'signatures'.")
+    return signatures, np.insert(np.asarray(names_signatures, dtype=str), 0, 'Samples')
+
+def restricted_columns(names_patients, catalogs, allowed_signatures, sample_groups=None):
+    """
+     Find the allowed columns of every catalog for every sample, for the 'restrictions' of 'fit_catalogs'.
+
+     'allowed_signatures' maps a sample name, or a group name when 'sample_groups' maps the samples to groups (e.g.
+     cancer types), to the names of its allowed signatures; samples without an entry are fitted against the whole
+     catalogs. A name missing from a catalog is skipped for that catalog. Samples of the same group share the same
+     arrays of columns.
+
+     :raises ValueError: If a name is in none of the catalogs or a sample is left with fewer than 2 signatures of a
+         catalog.
+     """
+    known = set(name for _, names_signatures in catalogs for name in names_signatures[1:])
+    for key, names in allowed_signatures.items():
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"Signatures {', '.join(unknown)} allowed for '{key}' are not in the catalogs.")
+
+    columns_of = {}
+    restrictions = []
+    for name in names_patients:
+        key = sample_groups.get(name) if sample_groups is not None else name
+        if key is None or key not in allowed_signatures:
+            restrictions.append(None)
+            continue
+        if key not in columns_of:
+            columns_of[key] = [np.flatnonzero(np.isin(names_signatures[1:], allowed_signatures[key]))
+                               for _, names_signatures in catalogs]
+            if any(len(columns) < 2 for columns in columns_of[key]):
+                raise ValueError(f"The signatures allowed for '{key}' must include at least 2 signatures of every "
+                                 f"catalog.")
+        restrictions.append(columns_of[key])
+    return restrictions
+
+def fit_arrays(samples, signatures=3.4, names_patients=None, names_signatures=None, threshold=0.01,
+               mutation_count=None, R=100, significance_level=0.01, seed=None, chunk_size=None, n_jobs=1,
+               schedule='cost', cost_model=None, bootstrap_files=None, screening=None, sampling='multinomial',
+               time_budget=None, work_budget=None, degrade='reduced_R', sample_chunk=None, replicate_jobs=1,
+               clusters=None, backend=DEFAULT_BACKEND, allowed_signatures=None, sample_groups=None, offset=0,
+               grid=None):
+    """
+    Fit mutation profiles held in memory against a signature catalog, without reading or writing files.
+
+    :param samples: Mutation profiles of the samples, one per column, with a shape of (96, G).
+    :type samples: numpy.ndarray
+    :param signatures: A COSMIC version from 'versions', the path to a signatures file, or a signature profile matrix
+        with a shape of (96, N). A list of those fits every catalog in one pass and returns one result per catalog.
+        Defaults to 3.4.
+    :type signatures: float, str, numpy.ndarray or list, optional
+    :param names_patients: Names of the samples. Defaults to "S0", "S1", ...
+    :type names_patients: list, optional
+    :param names_signatures: Names of the signatures of a signature profile matrix, or one list of names per catalog
+        for a list of catalogs. Defaults to "Signature_1", ...
+    :type names_signatures: list, optional
+    :param allowed_signatures: The names of the signatures allowed for a sample name, or for a group name with
+        'sample_groups', e.g. {"BRCA": ["SBS1", "SBS2", "SBS3", "SBS13"]}. Samples without an entry are fitted
+        against the whole catalog (see 'restricted_columns').
+    :type allowed_signatures: dict, optional
+    :param sample_groups: The group of every sample, e.g. its cancer type.
+    :type sample_groups: dict, optional
+
+    The remaining parameters are the same as in 'fit'; 'bootstrap_files' is the list of files created by
+    'create_bootstrap_file' that receive the bootstrap exposures, one per catalog, 'sample_chunk' the number of
+    samples dispatched to the workers at once, 'clusters' a cosine similarity or the signature clusters of every
+    catalog, 'backend' a backend name or a decomposition method and 'offset' the index of the first sample within a
+    larger cohort, which seeds the samples as in the whole cohort (see 'fit_catalogs'). With 'grid', a list of
+    (threshold, significance_level) pairs, every sample is selected with each pair in one pass and the result of a
+    catalog is a dictionary mapping every pair to its result.
+
+    :raises ValueError: If 'samples' is not a matrix or the number of names does not match it.
+
+    :returns: A dictionary of arrays, or a list of them for a list of catalogs:
+        - 'samples' (G,) and 'signatures' (N,): the names of the samples and of the signatures;
+        - 'exposures' (G, N): the estimated exposures, zero outside the selected signatures;
+        - 'selected' (G, N): the mask of the signatures selected for each sample;
+        - 'errors' (G,): the estimation error (Frobenius norm) of the final model, NaN for samples that failed;
+        - 'p_values' (G, N): the bootstrap p-values of the selected signatures in the final model, NaN elsewhere
+          and for degraded samples;
+        - 'analytic_decisions' and 'bootstrap_decisions' (G,): the number of signature decisions made analytically
+          and with the bootstrap when 'screening' is given, zero otherwise;
+        - 'fast_path_columns' and 'fast_path_hits' (G,): the number of columns solved for the sample by a backend
+          with a fast path ('kkt' or 'warm') and how many of them took it, zero for other backends;
+        - 'status' (G,): 'ok', the degradation of a sample that exceeded its budget ('reduced_R', 'screening' or
+          'current_model', see 'SampleBudget'), or 'failed' for samples that could not be processed.
+    :rtype: dict or list
+
+    Examples:
+        result = fit_arrays(counts, signatures=3.4, R=100, seed=7)
+        result = fit_arrays(counts, signatures=P, names_signatures=['SBS1', 'SBS5'], names_patients=names)
+    """
+    samples = np.asarray(samples)
+    if samples.ndim != 2:
+        raise ValueError("Parameter 'samples' must be a matrix with one sample per column.")
+    if names_patients is None:
+        names_patients = [f"S{i}" for i in range(samples.shape[1])]
+    if len(names_patients) != samples.shape[1]:
+        raise ValueError("Parameter 'names_patients' must have one name per column of 'samples'.")
+    names_patients = np.asarray(names_patients, dtype=str)
+
+    several = isinstance(signatures, (list, tuple))
+    if not several:
+        signatures, names_signatures = [signatures], [names_signatures]
+    elif names_signatures is None:
+        names_signatures = [None] * len(signatures)
+    catalogs = [as_catalog(catalog, names) for catalog, names in zip(signatures, names_signatures)]
+    restrictions = None
+    if allowed_signatures is not None:
+        restrictions = restricted_columns(names_patients, catalogs, allowed_signatures, sample_groups)
+    results = fit_catalogs(samples, names_patients, catalogs, threshold=threshold, mutation_count=mutation_count, R=R,
+                           significance_level=significance_level, seed=seed, chunk_size=chunk_size, n_jobs=n_jobs,
+                           bootstrap_files=bootstrap_files, schedule=schedule, cost_model=cost_model,
+                           screening=screening, sampling=sampling, time_budget=time_budget,
+                           work_budget=work_budget, degrade=degrade, sample_chunk=sample_chunk,
+                           replicate_jobs=replicate_jobs, clusters=clusters, backend=backend,
+                           restrictions=restrictions, offset=offset, grid=grid)
+    if grid is not None:
+        points = [tuple(point) for point in grid]
+        results = [dict(zip(points, results[start:start + len(points)]))
+                   for start in range(0, len(results), len(points))]
+    return results if several else results[0]
 
 def fit(samples_file, output_folder, threshold=0.01,
                mutation_count=None, R=100, significance_level=0.01, signatures=3.4,
-               drop_zeros_columns=False):
+               drop_zeros_columns=False, seed=None, chunk_size=None, n_jobs=1, save_bootstrap=False,
+               schedule='cost', cost_model=None, output_format='csv', screening=None, sampling='multinomial',
+               time_budget=None, work_budget=None, degrade='reduced_R', max_memory=None, replicate_jobs=1,
+               clusters=None, backend=DEFAULT_BACKEND, allowed_signatures=None, sample_groups=None):
     """
      Analyzes genetic samples to determine their fit against known COSMIC (Catalogue Of Somatic Mutations In Cancer) signatures or custom signatures.
      This function processes each sample from a given input file to identify the best fitting mutational signatures based on the COSMIC database or custom signatures, and then exports the exposure estimates to a specified output folder.
 
      Parameters:
-     - samples_file (str): Path to the file containing the genetic sample data to be analyzed.
+     - samples_file (str or list): Path to the file containing the genetic sample data to be analyzed. It can also be a glob pattern (e.g. "batches/*.txt.gz"), a manifest file ending with ".manifest" that lists one file or pattern per line, or a list of those; the files can be compressed with gzip (".gz") or bzip2 (".bz2"). Several files are parsed in parallel with n_jobs processes and analyzed as one cohort with one combined output. The rows of the signatures and of the other files are matched to the mutation types of the first file by their labels (e.g. "A[C>A]A" or "C>A,ACA"), and a file whose mutation types differ raises a ValueError.
      - output_folder (str): Path to the folder where the output files containing the assignment of samples to mutational signatures will be saved.
      - threshold (float, optional): The threshold value used to determine the fit of a sample to a signature. Default is 0.01.
      - mutation_count (int, optional): The observed mutation profile vector for a patient/sample. If m is a vector of counts, then mutation_count equals the summation of all the counts. If m is probabilities, then mutation_count has to be specified.
      - R (int, optional): The number of iterations for the fitting algorithm. Higher values increase accuracy but also computational time. Default is 100.
      - significance_level (float, optional): The statistical significance level used in the fitting process. Default is 0.01.
-     - cosmic_version (float, optional): The version of the COSMIC mutational signatures to use. Default is 3.4.
+     - signatures (float, str or list, optional): The version of the COSMIC mutational signatures to use or the path to a custom signatures file. Default is 3.4.
+       A list of versions and/or paths fits the cohort against every catalog in one pass: the samples are loaded once, the bootstrap replicates of each sample are shared by all catalogs, and the results of each catalog are saved in a subfolder of output_folder named after it (e.g. "COSMIC_v3.4" or the custom file name).
      - drop_zeros_columns (bool, optional): If True, columns with all zero values in the output matrix will be removed. Default is False.
+     - seed (int, optional): If given, each sample is bootstrapped with a random state seeded by (seed, sample index), which makes the results reproducible and independent of sharding. Default is None.
+     - chunk_size (int, optional): If given, the bootstrap replicates are generated and solved in chunks of chunk_size replicates and only the exceedance counts are accumulated, so memory per sample does not grow with R, which allows large R (10k-100k). Default is None.
+     - n_jobs (int, optional): The number of worker processes used to process the samples. Default is 1.
+     - replicate_jobs (int, optional): With n_jobs=1, the number of worker processes solving the bootstrap replicates of each sample (see 'ParallelDecomposition'). The replicates of every elimination step are split into chunks solved in parallel and merged in order, so the results are the same and the latency of a single sample with a large R goes down. Default is 1.
+     - backend (str, optional): The decomposition backend solving the bootstrap replicates: 'qp' (quadprog), 'kkt' (closed-form solution with a QP fallback), 'warm' (warm-started from the observed profile), 'simplex' (compiled active-set method, needs numba) or a backend added with 'register_backend'. All of them give the same exposures up to rounding. 'auto' times the available backends on a problem of the shape of the run once, picks the fastest correct one and caches the choice per machine in "~/.cache/sigconfide/backends.json" (see 'select_backend'). Backends are only imported when used. Default is 'qp'.
+     - schedule (str, optional): How samples are dispatched to the workers when n_jobs > 1. 'cost' estimates the cost of every sample from cheap features (mutation count, R, catalog size, expected number of surviving signatures), dispatches the most expensive samples first as workers become free and refines the estimate with the measured costs; 'fifo' dispatches samples in file order. Results do not depend on the schedule. Default is 'cost'.
+     - cost_model (str, optional): Path to a JSON file with the cost model, loaded before and updated after the run, so the estimates improve across runs. Default is None.
+     - screening (float, optional): If given, signatures whose bootstrap p-value is clear-cut are decided analytically from a delta-method approximation of the exposure distribution, with a confidence margin of 'screening' standard deviations (e.g. 3.0), and the bootstrap solves of an elimination step are skipped when only such signatures decide it (see 'AnalyticScreen'). This approximates the full bootstrap selection; a smaller margin skips more work. The number of analytic and bootstrap decisions is printed at the end. Default is None.
+     - sampling (str, optional): How the bootstrap replicates are generated. 'multinomial' draws independent multinomial replicates; 'stratified' stratifies the mutation draws across replicates (a Latin hypercube over the replicates of every mutation slot), so every replicate is still multinomial; the benchmark in the README shows no significant gain in stability over 'multinomial' for the same R. In both cases all elimination and forward selection steps of a sample use the same replicates (common random numbers). Default is 'multinomial'.
+     - time_budget (float, optional): The time budget in seconds of the selection of each sample. A sample that exceeds it is degraded as set by 'degrade' and then returns its current model (see 'SampleBudget'), so a pathological sample cannot hold up the batch. Default is None.
+     - work_budget (int, optional): The work budget of the selection of each sample in replicate solves (R per elimination step), a reproducible alternative to time_budget. Default is None.
+     - degrade (str, optional): The first degradation of a sample over budget: 'reduced_R' continues with a quarter of the replicates, 'screening' decides the remaining steps analytically where possible, 'current_model' stops at once. When a budget is given, the status of every sample ('ok', 'reduced_R', 'screening', 'current_model' or 'failed') is saved in "Assignment_Solution_Status.csv". Default is 'reduced_R'.
+     - max_memory (int or str, optional): The memory budget of the run in bytes, or a string such as "512M" or "4G". The peak memory is estimated from the number of mutation types, the size of the catalogs, R and the cohort size, and n_jobs (as an upper bound), chunk_size and the number of samples dispatched at once are chosen to stay within it (see 'plan_memory'): the number of workers is lowered first, which does not change the results, and the replicates are generated in chunks only when a single worker cannot hold them. The chosen plan is printed before the run and the actual peak RSS of the run and of its largest worker after it. A ValueError is raised if the budget cannot hold the cohort and one sample. Default is None.
+     - clusters (float, optional): If given, signatures whose profiles have a cosine similarity of at least about 'clusters' (e.g. 0.8) are grouped by average linkage, and the selection first decides which clusters are present, with one signature per cluster, and then which members of the kept clusters (see 'cluster_selection'). This takes fewer and smaller bootstrap solves on large catalogs with many similar signatures. The clusters of a catalog file are cached in the user cache folder, e.g. "~/.cache/sigconfide/clusters" (see 'load_clusters'). It cannot be combined with screening. Default is None.
+     - allowed_signatures (dict or str, optional): The signatures allowed for every sample, or for every group with sample_groups, as a dictionary or a JSON file such as {"BRCA": ["SBS1", "SBS2", "SBS3", "SBS13"]}. The selection of those samples starts from their allowed signatures only, which is much faster than from the whole catalog, and the output keeps the layout of the whole catalog with zero exposures for the other signatures. Samples without an entry are fitted against the whole catalog. Default is None.
+     - sample_groups (dict or str, optional): The group (e.g. the cancer type) of every sample, as a dictionary or an annotation file with a sample and its group per line, separated by a tab or a comma (see 'load_sample_groups'). Default is None.
+     - save_bootstrap (bool, optional): If True, the bootstrap exposures of the final model of every sample are also saved as a G x N x R float32 array "Bootstrap_Exposures.npy" (signatures outside the final model are zero, failed samples are NaN), together with "Bootstrap_Exposures.json" mapping the names of samples and signatures to array coordinates. The array is preallocated as a memory map and every worker writes its slices directly. Default is False.
+     - output_format (str, optional): 'csv' saves the dense "Assignment_Solution_Activities.csv"; 'sparse' saves only the exposures of the selected signatures of every sample in the compressed sparse row file "Assignment_Solution_Activities.npz" (see 'save_sparse_activities'), which is much smaller and faster to write and read for large cohorts. 'load_sparse_activities' reads it and 'sparse_activities_to_csv' converts it to the dense CSV. drop_zeros_columns is ignored for 'sparse'. Default is 'csv'.
 
      Returns:
      - None. The function saves the results in the specified output folder as "Assignment_Solution_Activities.csv". If drop_zeros_columns is True, columns containing only zeros will be excluded from the output.
 
      Note:
-     - The function requires numpy for matrix operations and assumes the availability of `load_signatures_file`, `load_samples_file`, `process_sample`, and `utils.create_folder_if_not_exists` utility functions.
+     - The function requires numpy for matrix operations and assumes the availability of `load_signatures_file`, `load_sample_files`, `fit_arrays`, and `utils.create_folder_if_not_exists` utility functions.
      - The output CSV file will contain the names of the signatures as the first row and the names of the samples as the first column. The rest of the matrix represents the estimated exposures of each sample to each signature.
      """
-    if isinstance(signatures, float):
-        sigs, names_signatures = load_signatures_file(versions[signatures])
-    if isinstance(signatures, str):
-        sigs, names_signatures = load_signatures_file(signatures)
-    samples, names_patients = load_samples_file(samples_file)
+    if output_format not in ('csv', 'sparse'):
+        raise ValueError("Parameter 'output_format' must be 'csv' or 'sparse'.")
+    baseline = current_rss()
+    mutation_types = sample_mutation_types(samples_file)
+    if isinstance(signatures, (list, tuple)):
+        catalogs = load_catalogs(signatures, mutation_types)
+        labels = [catalog_label(catalog) for catalog in signatures]
+        if len(set(labels)) != len(labels):
+            labels = [f"{label}_{index}" for index, label in enumerate(labels)]
+        output_folders = [os.path.join(output_folder, label) for label in labels]
+    else:
+        catalogs = load_catalogs([signatures], mutation_types)
+        output_folders = [output_folder]
+    samples, names_patients = load_sample_files(samples_file, mutation_types, n_jobs=n_jobs)
+    if isinstance(allowed_signatures, str):
+        allowed_signatures = load_allowed_signatures(allowed_signatures)
+    if isinstance(sample_groups, str):
+        sample_groups = load_sample_groups(sample_groups)
+    if clusters is not None:
+        if screening is not None:
+            raise ValueError("Parameters 'clusters' and 'screening' cannot be combined.")
+        # The cosine similarities do not depend on the order of the rows, so the cache of the file is used as is
+        clusters = [load_clusters(catalog_file(catalog), clusters)
+                    for catalog in (signatures if isinstance(signatures, (list, tuple)) else [signatures])]
 
-    output = np.zeros((samples.shape[1], len(names_signatures)))
-    output = np.vstack([names_signatures, output])
+    plan, sample_chunk = None, None
+    if max_memory is not None:
+        plan = plan_memory(max_memory, samples.shape[0], samples.shape[1], [sigs.shape[1] for sigs, _ in catalogs],
+                           R, n_jobs=n_jobs, chunk_size=chunk_size, output_format=output_format, baseline=baseline)
+        n_jobs, chunk_size, sample_chunk = plan.n_jobs, plan.chunk_size, plan.sample_chunk
+        print(f"Memory plan: {plan}")
 
-    for i in range(samples.shape[1]):
-        _, best_columns, estimation_exposures = process_sample(
-            (i, samples[:, i], sigs, threshold, mutation_count, R, significance_level))
+    bootstrap_files = None
+    for folder in output_folders:
+        utils.create_folder_if_not_exists(folder)
+    if save_bootstrap:
+        bootstrap_files = [os.path.join(folder, "Bootstrap_Exposures.npy") for folder in output_folders]
+        for file_name, (_, names_signatures) in zip(bootstrap_files, catalogs):
+            create_bootstrap_file(file_name, names_patients, names_signatures, R)
 
-        if best_columns is not None:
-                for ind, col in enumerate(best_columns):
-                    output[i + 1, col + 1] = estimation_exposures[0].squeeze()[ind]
-                output[i + 1, 0] = names_patients[i]
-
-                percent = (i + 1) / samples.shape[1]
-                sys.stdout.write('\r')
-                sys.stdout.write("[%-20s] %d%%" % ('=' * int(20 * percent), 100 * percent))
-                sys.stdout.flush()
-    utils.create_folder_if_not_exists(output_folder)
-    if not drop_zeros_columns:
-        np.savetxt(output_folder + "/Assignment_Solution_Activities.csv", output, delimiter=",", fmt='%s')
-    else:
-        is_non_zero_column = np.array([i != 0 if i > 0 else True for i in range(output.shape[1])])
-        for col in range(1, output.shape[1]):
-            if np.all(output[1:, col].astype(np.float32) == 0.0):
-                is_non_zero_column[col] = False
-        filtered_output = output[:, is_non_zero_column]
-        np.savetxt(output_folder + "/Assignment_Solution_Activities.csv", filtered_output, delimiter=',', fmt='%s')
+    results = fit_arrays(samples, [sigs for sigs, _ in catalogs], names_patients=names_patients,
+                         names_signatures=[names_signatures[1:] for _, names_signatures in catalogs],
+                         threshold=threshold, mutation_count=mutation_count, R=R,
+                         significance_level=significance_level, seed=seed, chunk_size=chunk_size, n_jobs=n_jobs,
+                         schedule=schedule, cost_model=cost_model, bootstrap_files=bootstrap_files,
+                         screening=screening, sampling=sampling, time_budget=time_budget,
+                         work_budget=work_budget, degrade=degrade, sample_chunk=sample_chunk,
+                         replicate_jobs=replicate_jobs, clusters=clusters, backend=backend,
+                         allowed_signatures=allowed_signatures, sample_groups=sample_groups)
+    if screening is not None:
+        analytic = sum(result['analytic_decisions'].sum() for result in results)
+        decisions = analytic + sum(result['bootstrap_decisions'].sum() for result in results)
+        print(f"\nAnalytic decisions: {analytic} of {decisions} ({100 * analytic / max(decisions, 1):.1f}%)")
+    columns = sum(result['fast_path_columns'].sum() for result in results)
+    if columns > 0:
+        hits = sum(result['fast_path_hits'].sum() for result in results)
+        print(f"\nFast path hit rate: {hits} of {columns} columns ({100 * hits / columns:.1f}%)")
+    if time_budget is not None or work_budget is not None:
+        degraded = sum(np.count_nonzero(~np.isin(result['status'], [STATUS_OK, STATUS_FAILED])) for result in results)
+        print(f"\nSamples over budget: {degraded} of {sum(len(result['status']) for result in results)}")
+
+    for result, folder in zip(results, output_folders):
+        if output_format == 'sparse':
+            save_sparse_activities(result, folder + "/Assignment_Solution_Activities.npz")
+        else:
+            save_activities_file(activities_matrix(result), folder + "/Assignment_Solution_Activities.csv",
+                                 drop_zeros_columns=drop_zeros_columns)
+        if time_budget is not None or work_budget is not None:
+            save_status_file(result, folder + "/Assignment_Solution_Status.csv")
+
+    if plan is not None:
+        plan.record_peak()
+        print(f"\nMemory plan: {plan}")
@@ -2,6 +2,7 @@ import numpy as np
 from sigconfide.estimates.standard import findSigExposures
 
 from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.warm import warm_start
 from sigconfide.utils.utils import is_wholenumber
 
 
@@ -25,7 +26,132 @@ def compute_p_value(exposures, threshold=0.01):
     return 1 - grater_than_threshold.sum(axis=1) / grater_than_threshold.shape[1]
 
 
-def bootstraped_patient(m, mutation_count, R):
+def count_exceedances(exposures, threshold=0.01):
+    """
+    Count, for each signature, the bootstrap exposures greater than a specified threshold.
+
+    Summing the counts of several chunks of replicates and dividing by the total number of replicates gives the same
+    p-values as 'compute_p_value' on all replicates at once: p = 1 - counts / R.
+
+    :param exposures: A numpy array of signature exposures obtained from (a chunk of) bootstrap replicates.
+    :type exposures: numpy.ndarray
+    :param threshold: The threshold above which exposures are considered significant. Defaults to 0.01.
+    :type threshold: float, optional
+
+    :returns: A numpy array with the number of significant exposures for each signature.
+    :rtype: numpy.ndarray
+    """
+    return np.count_nonzero(exposures > threshold, axis=1)
+
+
+SAMPLING_METHODS = ('multinomial', 'stratified')
+
+
+def stratified_multinomial(m, mutation_count, R, random_state=np.random, block_size=2**20):
+    """
+    Draw R multinomial replicates of a mutation profile with mutation slots stratified across replicates.
+
+    Every replicate draws 'mutation_count' mutations from the probabilities 'm' by inverse transform sampling. For
+    each mutation slot, the R uniforms of the R replicates are a Latin hypercube sample: one uniform in each of the
+    intervals [r / R, (r + 1) / R), randomly assigned to the replicates. Each replicate is still an exact multinomial
+    draw, but across replicates every mutation type is sampled close to its expected number of times. This reduces
+    the Monte Carlo noise of statistics that are smooth in the counts; the selection decisions are not smooth, and
+    the benchmark in the README shows no significant gain in their stability. It draws 2 * mutation_count * R
+    uniforms, where independent multinomial replicates only need O(len(m) * R) work.
+
+    :param m: Mutation probabilities, summing to 1.
+    :type m: numpy.ndarray
+    :param mutation_count: The number of mutations of every replicate.
+    :type mutation_count: int
+    :param R: The number of replicates.
+    :type R: int
+    :param random_state: The source of randomness. Defaults to the global numpy random state.
+    :type random_state: numpy.random.RandomState, optional
+    :param block_size: The maximal number of uniforms drawn at once. Defaults to 2**20.
+    :type block_size: int, optional
+
+    :returns: A matrix of mutation counts with a shape of (len(m), R).
+    :rtype: numpy.ndarray
+    """
+    K = len(m)
+    edges = np.cumsum(m)
+    edges[-1] = 1.0
+    counts = np.zeros(K * R, dtype=np.int64)
+    offsets = K * np.arange(R)
+    slots_per_block = max(1, block_size // R)
+    for start in range(0, mutation_count, slots_per_block):
+        slots = min(slots_per_block, mutation_count - start)
+        strata = np.argsort(random_state.random_sample((slots, R)), axis=1)
+        uniforms = (strata + random_state.random_sample((slots, R))) / R
+        types = np.searchsorted(edges, uniforms, side='right')
+        counts += np.bincount((np.minimum(types, K - 1) + offsets).ravel(), minlength=K * R)
+    return counts.reshape(R, K).T
+
+
+def check_sampling(sampling):
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Parameter 'sampling' must be one of {', '.join(SAMPLING_METHODS)}.")
+
+
+class BootstrapChunks:
+    """
+    Bootstrap replicates of a mutation profile generated in chunks of at most 'chunk_size' columns.
+
+    The replicates are never stored: every iteration draws the same chunks again from random states seeded by
+    (seed, chunk index), so memory does not depend on R and each elimination step sees the same replicates.
+    Replicates are drawn from the multinomial distribution, like 'bootstraped_patient' but with a different
+    random stream.
+
+    :param m: The observed mutation profile vector for a patient/sample.
+    :type m: numpy.ndarray
+    :param mutation_count: The total number of mutations. If None, 'm' has to contain counts.
+    :type mutation_count: int
+    :param R: The number of bootstrap replicates.
+    :type R: int
+    :param chunk_size: The maximal number of replicates in a chunk.
+    :type chunk_size: int
+    :param seed: The seed of the chunks. If None, it is drawn from the global numpy random state.
+    :type seed: int, optional
+    :param sampling: 'multinomial' or 'stratified' (see 'stratified_multinomial'); stratified replicates are
+        stratified within each chunk. The chunks are drawn again at every iteration, which costs
+        O(mutation_count * R) per elimination step with 'stratified'. Defaults to 'multinomial'.
+    :type sampling: str, optional
+    :param random_state: The random state the seed is drawn from when 'seed' is None. Defaults to the global numpy
+        random state.
+    :type random_state: numpy.random.RandomState, optional
+
+    :raises ValueError: If 'mutation_count' is not specified and 'm' does not contain integer counts.
+    """
+
+    def __init__(self, m, mutation_count, R, chunk_size, seed=None, sampling='multinomial', random_state=np.random):
+        if mutation_count is None:
+            if np.all(is_wholenumber(m)):
+                mutation_count = int(m.sum())
+            else:
+                raise ValueError("Please specify the parameter 'mutation_count' in the function call or provide mutation counts in parameter 'm'.")
+        if chunk_size < 1:
+            raise ValueError("Parameter 'chunk_size' must be a positive integer.")
+        check_sampling(sampling)
+
+        self.m = m / np.sum(m)
+        self.mutation_count = int(mutation_count)
+        self.R = R
+        self.chunk_size = chunk_size
+        self.seed = random_state.randint(2**31 - 1) if seed is None else seed
+        self.sampling = sampling
+
+    def __iter__(self):
+        for index, start in enumerate(range(0, self.R, self.chunk_size)):
+            size = min(self.chunk_size, self.R - start)
+            random_state = np.random.RandomState([self.seed, index])
+            if self.sampling == 'stratified':
+                counts = stratified_multinomial(self.m, self.mutation_count, size, random_state)
+            else:
+                counts = random_state.multinomial(self.mutation_count, self.m, size=size).T
+            yield counts / self.mutation_count
+
+
+def bootstraped_patient(m, mutation_count, R, sampling='multinomial', random_state=np.random):
     """
     Generate a bootstrap distribution of mutation profiles for a patient/sample.
 
@@ -38,8 +164,14 @@ def bootstraped_patient(m, mutation_count, R):
     :type mutation_count: int
     :param R: The number of bootstrap replicates to generate.
     :type R: int
+    :param sampling: 'multinomial' draws independent replicates, 'stratified' stratifies the mutation draws across
+        replicates (see 'stratified_multinomial'). Defaults to 'multinomial'.
+    :type sampling: str, optional
+    :param random_state: The source of randomness. Defaults to the global numpy random state.
+    :type random_state: numpy.random.RandomState, optional
 
-    :raises ValueError: If 'mutation_count' is not specified and 'm' does not contain integer counts.
+    :raises ValueError: If 'mutation_count' is not specified and 'm' does not contain integer counts, or if
+        'sampling' is unknown.
 
     :returns: A matrix of bootstrap replicates of the patient's mutation profile.
     :rtype: numpy.ndarray
@@ -47,18 +179,21 @@ def bootstraped_patient(m, mutation_count, R):
     K = len(m)
 
     if mutation_count is None:
-        if all(is_wholenumber(val) for val in m):
+        if np.all(is_wholenumber(m)):
             mutation_count = int(m.sum())
         else:
             raise ValueError("Please specify the parameter 'mutation_count' in the function call or provide mutation counts in parameter 'm'.")
+    check_sampling(sampling)
     m = m / np.sum(m)
 
+    if sampling == 'stratified':
+        return stratified_multinomial(m, int(mutation_count), R, random_state) / mutation_count
 
-    def bootstrap_sample(m, mutation_count, K):
-        mutations_sampled = np.random.choice(K, size=mutation_count, p=m)
-        return np.bincount(mutations_sampled, minlength=K) / mutation_count
-
-    M = np.column_stack([bootstrap_sample(m, mutation_count, K) for _ in range(R)])
+    # Replicates are counted into one preallocated matrix and scaled in place
+    M = np.empty((K, R))
+    for r in range(R):
+        M[:, r] = np.bincount(random_state.choice(K, size=mutation_count, p=m), minlength=K)
+    M /= mutation_count
 
     return M
 
@@ -98,6 +233,7 @@ def backward_elimination(
     while True:
         changed = False
 
+        warm_start(decomposition_method, m, P_temp)
         exposures, errors = findSigExposures(
             M, P_temp, decomposition_method=decomposition_method
         )
@@ -0,0 +1,105 @@
+import time
+import numpy as np
+
+from sigconfide.modelselection.backward import BootstrapChunks
+from sigconfide.modelselection.screening import AnalyticScreen
+
+# Status of a sample in the results of 'fit_arrays'
+STATUS_OK = 'ok'
+STATUS_REDUCED_R = 'reduced_R'
+STATUS_SCREENING = 'screening'
+STATUS_CURRENT_MODEL = 'current_model'
+STATUS_FAILED = 'failed'
+
+DEGRADE_METHODS = (STATUS_REDUCED_R, STATUS_SCREENING, STATUS_CURRENT_MODEL)
+
+
+class SampleBudget:
+    """
+    Time and work budget of the hybrid selection of one sample.
+
+    The work is counted in replicate solves (R per bootstrap elimination or forward selection step). When the budget
+    is exceeded, 'hybrid_selection' degrades in two stages:
+
+    1. with degrade='reduced_R' the remaining steps use a quarter of the replicates (at least 10), with
+       degrade='screening' they are decided by an 'AnalyticScreen' with a margin of 0 where possible; this stage
+       gets one more budget of the same size;
+    2. when that is exceeded too, or with degrade='current_model', the selection stops and returns the current model.
+
+    'status' records the last stage reached ('ok', 'reduced_R', 'screening' or 'current_model').
+
+    :param seconds: The time budget in seconds. Defaults to None (no limit).
+    :type seconds: float, optional
+    :param solves: The work budget in replicate solves. Defaults to None (no limit).
+    :type solves: int, optional
+    :param degrade: The first degradation stage, one of 'reduced_R', 'screening' or 'current_model'.
+        Defaults to 'reduced_R'.
+    :type degrade: str, optional
+
+    :raises ValueError: If 'degrade' is unknown.
+    """
+
+    def __init__(self, seconds=None, solves=None, degrade=STATUS_REDUCED_R):
+        if degrade not in DEGRADE_METHODS:
+            raise ValueError(f"Parameter 'degrade' must be one of {', '.join(DEGRADE_METHODS)}.")
+        self.seconds = seconds
+        self.solves = solves
+        self.degrade = degrade
+        self.start()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.used = 0
+        self.periods = 1
+        self.status = STATUS_OK
+
+    def charge(self, solves):
+        self.used += solves
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def exceeded(self):
+        if self.seconds is not None and self.elapsed > self.periods * self.seconds:
+            return True
+        return self.solves is not None and self.used > self.periods * self.solves
+
+    def next_stage(self):
+        """Move to the next degradation stage and return it."""
+        if self.status == STATUS_OK and self.degrade != STATUS_CURRENT_MODEL:
+            self.status = self.degrade
+            self.periods += 1
+        else:
+            self.status = STATUS_CURRENT_MODEL
+        return self.status
+
+
+def reduce_replicates(M, R):
+    """Keep the first R replicates of a matrix of replicates or of a 'BootstrapChunks'."""
+    if isinstance(M, np.ndarray):
+        return M[:, :R]
+    return BootstrapChunks(M.m, M.mutation_count, R, M.chunk_size, seed=M.seed, sampling=M.sampling)
+
+
+def replicates_count(M):
+    return M.shape[1] if isinstance(M, np.ndarray) else M.R
+
+
+def degrade_selection(budget, M, solve_cache, screening):
+    """
+    Degrade the remaining steps of a selection when 'budget' is exceeded (see 'SampleBudget').
+
+    :returns: Whether the selection has to stop, and the replicates, solve cache and screen of the next steps.
+    :rtype: tuple(bool, numpy.ndarray or BootstrapChunks, dict, AnalyticScreen)
+    """
+    if budget is None or not budget.exceeded():
+        return False, M, solve_cache, screening
+    stage = budget.next_stage()
+    if stage == STATUS_REDUCED_R:
+        M = reduce_replicates(M, max(replicates_count(M) // 4, 10))
+        # The memoized solves belong to the full replicates
+        solve_cache = {} if isinstance(M, np.ndarray) else None
+    elif stage == STATUS_SCREENING:
+        screening = AnalyticScreen(margin=0.0)
+    return stage == STATUS_CURRENT_MODEL, M, solve_cache, screening
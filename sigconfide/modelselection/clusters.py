@@ -0,0 +1,255 @@
+import json
+import os
+import numpy as np
+
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.warm import warm_start
+from sigconfide.modelselection.backward import compute_p_value, count_exceedances, bootstraped_patient, \
+    BootstrapChunks
+from sigconfide.modelselection.hybrid import solve_replicates
+from sigconfide.modelselection.budget import degrade_selection, replicates_count
+from sigconfide.modelselection.workspace import selection_workspace
+from sigconfide.utils.utils import load_signatures_file, catalog_hash
+
+# Cosine similarity above which signatures are grouped by default; it groups e.g. SBS5, SBS40c and SBS92 of COSMIC v3.4
+DEFAULT_SIMILARITY = 0.8
+
+# Clusters computed by 'load_clusters', one file per catalog; catalog files may be read-only package data
+CLUSTERS_FOLDER = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                               'sigconfide', 'clusters')
+
+
+def signature_clusters(P, similarity=DEFAULT_SIMILARITY):
+    """
+    Group the signatures of 'P' by the cosine similarity of their profiles.
+
+    Clusters are merged by average linkage, the pair of clusters with the highest mean similarity first, as long as
+    it is at least 'similarity'.
+
+    :param P: Signature profile matrix with a shape of (96, N).
+    :type P: numpy.ndarray
+    :param similarity: The smallest mean cosine similarity of two merged clusters. Defaults to 0.8.
+    :type similarity: float, optional
+
+    :returns: The cluster of every signature, numbered in the order of their first signature.
+    :rtype: numpy.ndarray
+    """
+    unit = P / np.linalg.norm(P, axis=0)
+    cosine = np.dot(unit.T, unit)
+    members = [[k] for k in range(P.shape[1])]
+    # Sums of the similarities between the clusters, a cluster's mean linkage is its sum over the pair sizes
+    sums = cosine.copy()
+    np.fill_diagonal(sums, -np.inf)
+    while len(members) > 1:
+        sizes = np.array([len(cluster) for cluster in members], dtype=float)
+        linkage = sums / np.outer(sizes, sizes)
+        a, b = np.unravel_index(np.argmax(linkage), linkage.shape)
+        if linkage[a, b] < similarity:
+            break
+        a, b = min(a, b), max(a, b)
+        members[a] += members.pop(b)
+        sums[a] += sums[b]
+        sums[:, a] += sums[:, b]
+        sums[a, a] = -np.inf
+        sums = np.delete(np.delete(sums, b, axis=0), b, axis=1)
+
+    labels = np.zeros(P.shape[1], dtype=int)
+    for label, cluster in enumerate(sorted(members, key=min)):
+        labels[cluster] = label
+    return labels
+
+
+def clusters_file(digest, cache_folder=CLUSTERS_FOLDER):
+    return os.path.join(cache_folder, digest + '.json')
+
+
+def load_clusters(file_name, similarity=DEFAULT_SIMILARITY, cache_folder=CLUSTERS_FOLDER):
+    """
+    Read the clusters of the signatures file 'file_name' (see 'signature_clusters') from the user cache.
+
+    The cache "<cache_folder>/<catalog hash>.json" holds the clusters of every similarity computed so far for the
+    content of the catalog, so a changed catalog gets new clusters; a cache that cannot be written (e.g. a read-only
+    home folder) is ignored and the clusters are computed again the next time. 'cache_folder' None disables it.
+    """
+    sigs, names_signatures = load_signatures_file(file_name)
+    cache_file = None if cache_folder is None else clusters_file(catalog_hash(sigs, names_signatures), cache_folder)
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+
+    key = repr(float(similarity))
+    if key not in cache:
+        cache[key] = signature_clusters(sigs, similarity).tolist()
+        if cache_file is not None:
+            try:
+                os.makedirs(cache_folder, exist_ok=True)
+                with open(cache_file, 'w') as file:
+                    json.dump(cache, file)
+            except OSError:
+                pass
+    return np.asarray(cache[key], dtype=int)
+
+
+def cluster_p_values(M, P, columns, groups, threshold, decomposition_method=decomposeQP, solve_cache=None,
+                     workspace=None):
+    """
+    Compute the p-value of every group of signatures: the fraction of the replicates 'M' in which the summed
+    exposure of the group, in the model with the signature columns 'columns' of 'P', is at most 'threshold'.
+
+    'groups' are lists of positions in 'columns'; the p-value of a group of one signature is its usual p-value.
+    """
+    indicator = np.zeros((len(groups), len(columns)))
+    for index, group in enumerate(groups):
+        indicator[index, group] = 1
+    if isinstance(M, np.ndarray):
+        exposures, errors = solve_replicates(M, P, columns, decomposition_method, solve_cache, workspace)
+        return compute_p_value(np.dot(indicator, exposures), threshold=threshold)
+
+    counts = np.zeros(len(groups), dtype=int)
+    for chunk in M:
+        exposures, errors = findSigExposures(chunk, P[:, columns], decomposition_method=decomposition_method)
+        counts += count_exceedances(np.dot(indicator, exposures), threshold=threshold)
+    return 1 - counts / M.R
+
+
+def cluster_selection(
+    m, P, clusters, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP,
+    replicates=None, solve_cache=None, chunk_size=None, sampling='multinomial', budget=None, step_p_values=None
+):
+    """
+    Perform a hybrid selection that decides the presence of clusters of similar signatures before their members.
+
+    Similar signatures (e.g. the flat SBS3, SBS5 and SBS40 of COSMIC v3.4) trade their exposures off against each
+    other in the replicates, which costs many elimination steps on large models in 'hybrid_selection'. Here the
+    backward elimination first decides which clusters are present, with a model of one signature per cluster: its
+    member with the largest exposure in the decomposition of 'm'. The members of the kept clusters then join their
+    representative and, within the clusters with several members, are removed by their own p-values, keeping at
+    least one member of every kept cluster. The forward selection re-adds the removed clusters and members in the
+    order they were removed, a cluster when the p-value of the summed exposure of its members is below
+    'significance_level' ('cluster_p_values'), with its significant members (or its most significant one); clusters
+    removed together are re-tested one by one. All steps use the same replicates.
+
+    :param clusters: The cluster of every signature of 'P', e.g. from 'signature_clusters' or 'load_clusters'.
+    :type clusters: numpy.ndarray
+
+    The remaining parameters are the same as in 'hybrid_selection'; a 'budget' is degraded with fewer replicates
+    and then stops the selection, degrade='screening' only gives it one more period. 'step_p_values' receives the
+    p-values of the models of the backward eliminations, whose groups are single signatures.
+
+    :returns: A tuple containing the indices of the significant signatures and the exposures and errors from
+        decomposing the original mutation profile.
+    :rtype: tuple(numpy.ndarray, tuple(numpy.ndarray, numpy.ndarray))
+    """
+    clusters = np.asarray(clusters)
+    if len(clusters) != P.shape[1]:
+        raise ValueError("Parameter 'clusters' must have one cluster per column of 'P'.")
+    # A cluster is represented by its member with the largest exposure in the decomposition of 'm'
+    exposures = np.ravel(findSigExposures(m.reshape(-1, 1), P, decomposition_method=decomposition_method)[0])
+    representatives = np.array([max(np.flatnonzero(clusters == label), key=lambda k: exposures[k])
+                                for label in np.unique(clusters)])
+    M = replicates
+    if M is None:
+        M = bootstraped_patient(m, mutation_count, R, sampling) if chunk_size is None else \
+            BootstrapChunks(m, mutation_count, R, chunk_size, sampling=sampling)
+    if budget is not None:
+        budget.start()
+    workspace = None
+
+    def group_p_values(columns, groups):
+        # Buffers reused by every step, replaced when a degradation reduces the replicates
+        nonlocal workspace
+        workspace = selection_workspace(workspace, M, P)
+        if solve_cache is None or tuple(int(col) for col in columns) not in solve_cache:
+            warm_start(decomposition_method, m, P[:, columns])
+            # Only the models actually solved are charged, a model found in the cache costs nothing
+            if budget is not None:
+                budget.charge(replicates_count(M))
+        p_values = cluster_p_values(M, P, columns, groups, threshold, decomposition_method, solve_cache, workspace)
+        if step_p_values is not None and len(groups) == len(columns) and \
+                all(list(group) == [index] for index, group in enumerate(groups)):
+            step_p_values[tuple(int(col) for col in columns)] = p_values
+        return p_values
+
+    best_columns = representatives
+    removed_units = []
+    stop = False
+    # Step 1: Backward elimination of clusters
+    while not stop:
+        stop, M, solve_cache, _ = degrade_selection(budget, M, solve_cache, None)
+        if stop:
+            break
+        p_values = group_p_values(best_columns, np.arange(len(best_columns)).reshape(-1, 1))
+        max_p_value = np.max(p_values)
+        if max_p_value <= significance_level:
+            break
+        removed = p_values == max_p_value
+        removed_units.append(best_columns[removed])
+        best_columns = best_columns[~removed]
+    # The members of the kept clusters join their representatives
+    best_columns = np.flatnonzero(np.isin(clusters, clusters[best_columns]))
+    removed_units = [np.flatnonzero(np.isin(clusters, clusters[unit])) for unit in removed_units]
+
+    # Step 2: Backward elimination of the members of the kept clusters
+    while not stop:
+        stop, M, solve_cache, _ = degrade_selection(budget, M, solve_cache, None)
+        if stop:
+            break
+        labels, sizes = np.unique(clusters[best_columns], return_counts=True)
+        eligible = np.isin(clusters[best_columns], labels[sizes > 1])
+        if not np.any(eligible):
+            break
+        p_values = group_p_values(best_columns, np.arange(len(best_columns)).reshape(-1, 1))
+        max_p_value = np.max(p_values[eligible])
+        if max_p_value <= significance_level:
+            break
+        removed = eligible & (p_values == max_p_value)
+        # A kept cluster keeps at least its first member
+        for label in np.unique(clusters[best_columns[removed]]):
+            members = clusters[best_columns] == label
+            if np.all(removed[members]):
+                removed[np.flatnonzero(members)[0]] = False
+        removed_units.append(best_columns[removed])
+        best_columns = best_columns[~removed]
+
+    def forward(columns, unit):
+        # Each cluster of the unit is tested by its summed exposure and, when it is significant, brings back its
+        # significant members or its most significant one
+        current_columns = np.append(columns, unit)
+        positions = len(columns) + np.arange(len(unit))
+        unit_labels = np.unique(clusters[unit])
+        groups = [positions[clusters[unit] == label] for label in unit_labels] + list(positions.reshape(-1, 1))
+        p_values = group_p_values(current_columns, groups)
+        cluster_p, member_p = p_values[:len(unit_labels)], p_values[len(unit_labels):]
+        kept = {}
+        for label, p_value in zip(unit_labels, cluster_p):
+            if p_value < significance_level:
+                members = np.flatnonzero(clusters[unit] == label)
+                significant = members[member_p[members] < significance_level]
+                kept[label] = unit[significant if len(significant) else members[[np.argmin(member_p[members])]]]
+        return kept
+
+    # Step 3: Forward selection of the removed clusters and members
+    for unit in removed_units:
+        if stop:
+            break
+        stop, M, solve_cache, _ = degrade_selection(budget, M, solve_cache, None)
+        if stop:
+            break
+        kept = forward(best_columns, unit)
+        if len(np.unique(clusters[unit])) > 1:
+            # Clusters removed together compete for the same mutations when they are re-added together, so the
+            # ones found significant are tested again one by one
+            candidates, kept = kept, {}
+            for label in candidates:
+                stop, M, solve_cache, _ = degrade_selection(budget, M, solve_cache, None)
+                if stop:
+                    break
+                kept.update(forward(best_columns, unit[clusters[unit] == label]))
+        if kept:
+            best_columns = np.append(best_columns, np.sort(np.concatenate(list(kept.values()))))
+    return (
+        best_columns,
+        findSigExposures(m.reshape(-1, 1), P[:, best_columns], decomposition_method=decomposition_method),
+    )
@@ -2,11 +2,98 @@ import numpy as np
 from sigconfide.estimates.standard import findSigExposures
 from sigconfide.decompose.qp import decomposeQP
 from sigconfide.utils.utils import is_wholenumber
-from sigconfide.modelselection.backward import compute_p_value, bootstraped_patient
+from sigconfide.modelselection.backward import compute_p_value, bootstraped_patient, count_exceedances, \
+    BootstrapChunks
+from sigconfide.decompose.warm import warm_start
+from sigconfide.modelselection.budget import degrade_selection, replicates_count
+from sigconfide.modelselection.workspace import selection_workspace
+
+
+def solve_replicates(M, P, columns, decomposition_method=decomposeQP, solve_cache=None, workspace=None):
+    """
+    Find the exposures of the replicates 'M' for the signature columns 'columns' of 'P', memoized in 'solve_cache'.
+
+    'workspace' is an optional 'SelectionWorkspace' of 'M' and 'P' whose buffers are used for the solve.
+    """
+    def solve():
+        if workspace is not None:
+            return workspace.solve(columns, decomposition_method)
+        return findSigExposures(M, P[:, columns], decomposition_method=decomposition_method)
+
+    if solve_cache is None:
+        return solve()
+    key = tuple(int(col) for col in columns)
+    if key not in solve_cache:
+        solve_cache[key] = solve()
+    return solve_cache[key]
+
+
+def replicate_p_values(M, P, columns, threshold, decomposition_method=decomposeQP, solve_cache=None,
+                       workspace=None):
+    """
+    Compute the p-values of the signature columns 'columns' of 'P' over the bootstrap replicates 'M'.
+
+    'M' is either a matrix of replicates or a 'BootstrapChunks'. Chunks are solved one at a time and only their
+    exceedance counts are kept, so memory does not depend on the number of replicates; 'solve_cache' and
+    'workspace' are not used for chunks.
+    """
+    if isinstance(M, np.ndarray):
+        exposures, errors = solve_replicates(M, P, columns, decomposition_method, solve_cache, workspace)
+        if workspace is not None:
+            return workspace.p_values(exposures, threshold)
+        return compute_p_value(exposures, threshold=threshold)
+
+    counts = np.zeros(len(columns), dtype=int)
+    for chunk in M:
+        exposures, errors = findSigExposures(chunk, P[:, columns], decomposition_method=decomposition_method)
+        counts += count_exceedances(exposures, threshold=threshold)
+    return 1 - counts / M.R
+
+
+def screened_p_values(m, M, P, columns, threshold, mutation_count, decomposition_method=decomposeQP,
+                      solve_cache=None, screening=None, needed=None, workspace=None, step_p_values=None):
+    """
+    Compute the p-values of the signature columns 'columns' of 'P', deciding clear-cut signatures with 'screening'.
+
+    Analytic decisions give p-values of 0 (kept) or 1 (removed), borderline signatures get NaN when the bootstrap
+    solves are skipped. The bootstrap p-values of the borderline signatures
+    are computed only when they are needed: when a signature in 'needed' (indices of the p-values used by the caller)
+    is borderline or, by default, when no signature is removed analytically and some are borderline.
+
+    When 'step_p_values' is given, the bootstrap p-values of all the columns are recorded in it under the tuple of
+    'columns' whenever they are computed.
+
+    :returns: The p-values and whether the bootstrap solves were skipped.
+    :rtype: tuple(numpy.ndarray, bool)
+    """
+    def bootstrap_p_values():
+        key = tuple(int(col) for col in columns)
+        if solve_cache is None or key not in solve_cache:
+            warm_start(decomposition_method, m, P[:, columns])
+        p_values = replicate_p_values(M, P, columns, threshold, decomposition_method, solve_cache, workspace)
+        if step_p_values is not None:
+            step_p_values[key] = p_values
+        return p_values
+
+    if screening is None:
+        return bootstrap_p_values(), False
+
+    status = screening.screen(m, P[:, columns], threshold, mutation_count, decomposition_method)
+    if needed is None:
+        solved = np.any(status == 0) and not np.any(status == -1)
+    else:
+        solved = np.any(status[needed] == 0)
+    screening.record(status, solved)
+    p_values = np.select([status == 1, status == -1], [0.0, 1.0], np.nan)
+    if solved:
+        borderline = status == 0
+        p_values[borderline] = bootstrap_p_values()[borderline]
+    return p_values, not solved
 
 
 def hybrid_selection(
-    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP
+    m, P, R, threshold, mutation_count, significance_level, decomposition_method=decomposeQP, replicates=None,
+    solve_cache=None, chunk_size=None, screening=None, sampling='multinomial', budget=None, step_p_values=None
 ):
     """
     Perform a hybrid selection process: start with backward elimination and follow up with forward selection.
@@ -28,40 +115,94 @@ def hybrid_selection(
     :type significance_level: float
     :param decomposition_method: The method used to decompose the mutation profile into signature exposures. Defaults to 'decomposeQP'.
     :type decomposition_method: function, optional
+    :param replicates: Bootstrap replicates of 'm' generated by 'bootstraped_patient' or a 'BootstrapChunks', e.g. to share the same replicates between several signature catalogs. If None, R replicates are generated.
+    :type replicates: numpy.ndarray or BootstrapChunks, optional
+    :param solve_cache: Memo of the replicate solves keyed by the tuple of signature columns, filled and reused across calls. It is only valid for one matrix of replicates, one 'P' and one 'decomposition_method', e.g. when the same sample is selected with several thresholds or significance levels.
+    :type solve_cache: dict, optional
+    :param chunk_size: If given, the replicates are generated and solved in chunks of 'chunk_size' columns and only the exceedance counts are accumulated, so memory per sample is constant for any R (see 'BootstrapChunks').
+    :type chunk_size: int, optional
+    :param screening: If given, signatures whose p-value is clear-cut are decided analytically and the bootstrap solves of an elimination step are skipped when they are not needed (see 'AnalyticScreen'). The result is an approximation of the full bootstrap selection, controlled by the margin of the screen, whose counters report the analytic decisions.
+    :type screening: AnalyticScreen, optional
+    :param sampling: How the replicates are generated when 'replicates' is None: 'multinomial' or 'stratified' (see 'bootstraped_patient'). The same replicates are used in every elimination and forward selection step, so nested models are always compared on common random numbers. Defaults to 'multinomial'.
+    :type sampling: str, optional
+    :param budget: If given, the time and work budget of the selection, started when the selection starts. When it is exceeded, the remaining steps are degraded (fewer replicates or analytic screening) and then the current model is returned; 'budget.status' records the degradation (see 'SampleBudget').
+    :type budget: SampleBudget, optional
+    :param step_p_values: If given, receives the bootstrap p-values of the models solved by the selection, keyed by the tuple of their signature columns, so the p-values of the final model need not be computed again (e.g. for chunks). Models decided analytically by 'screening' are not recorded.
+    :type step_p_values: dict, optional
 
     :returns: A tuple containing the indices of the significant signatures and the exposures and errors from decomposing the original mutation profile.
     :rtype: tuple(numpy.ndarray, tuple(numpy.ndarray, numpy.ndarray))
     """
     # Step 1: Backward Elimination
     best_columns = np.arange(P.shape[1])
-    P_temp = P
-    M = bootstraped_patient(m, mutation_count, R)
+    M = replicates
+    if M is None:
+        M = bootstraped_patient(m, mutation_count, R, sampling) if chunk_size is None else \
+            BootstrapChunks(m, mutation_count, R, chunk_size, sampling=sampling)
+
+    if budget is not None:
+        budget.start()
+    # Buffers reused by every step, replaced when a degradation reduces the replicates
+    workspace = selection_workspace(None, M, P)
+
+    def over_budget(M, solve_cache, screening):
+        # Degrade the remaining steps when the budget is exceeded, True means the selection has to stop
+        nonlocal workspace
+        stop, M, solve_cache, screening = degrade_selection(budget, M, solve_cache, screening)
+        workspace = selection_workspace(workspace, M, P)
+        return stop, M, solve_cache, screening
+
+    def charge(analytic):
+        if budget is not None and not analytic:
+            budget.charge(replicates_count(M))
 
     removed_columns = []
+    # Signatures removed analytically join the next group removed with a p-value of 1, as in a full bootstrap step
+    analytic_group = np.array([], dtype=int)
 
     while True:
         changed = False
-        exposures, errors = findSigExposures(M, P_temp, decomposition_method=decomposition_method)
-        p_values = compute_p_value(exposures, threshold=threshold)
+        stop, M, solve_cache, screening = over_budget(M, solve_cache, screening)
+        if stop:
+            break
+        p_values, analytic = screened_p_values(m, M, P, best_columns, threshold, mutation_count,
+                                               decomposition_method, solve_cache, screening, workspace=workspace,
+                                               step_p_values=step_p_values)
+        charge(analytic)
 
-        max_p_value = p_values.max()
+        max_p_value = np.nanmax(p_values)
         if max_p_value > significance_level:
             indices_with_max = np.where(p_values == max_p_value)[0]
-            removed_columns.append(best_columns[indices_with_max])
+            removed = best_columns[indices_with_max]
             best_columns = np.delete(best_columns, indices_with_max)
-            P_temp = P[:, best_columns]
             changed = True
+            if analytic:
+                analytic_group = np.append(analytic_group, removed)
+                continue
+            if len(analytic_group) > 0:
+                if max_p_value == 1:
+                    removed = np.sort(np.append(analytic_group, removed))
+                else:
+                    removed_columns.append(np.sort(analytic_group))
+                analytic_group = analytic_group[:0]
+            removed_columns.append(removed)
 
         if not changed:
             break
+    if len(analytic_group) > 0:
+        removed_columns.append(np.sort(analytic_group))
 
     # Step 2: Forward Selection
     for col in removed_columns:
         current_columns = np.append(best_columns, col)
-        P_test = P[:, current_columns]
 
-        exposures, errors = findSigExposures(M, P_test, decomposition_method=decomposition_method)
-        p_values = compute_p_value(exposures, threshold=threshold)
+        stop, M, solve_cache, screening = over_budget(M, solve_cache, screening)
+        if stop:
+            break
+        p_values, analytic = screened_p_values(m, M, P, current_columns, threshold, mutation_count,
+                                               decomposition_method, solve_cache, screening, needed=[-1],
+                                               workspace=workspace, step_p_values=step_p_values)
+        charge(analytic)
 
         if p_values[-1] < significance_level:  # Check if the added column is significant
             best_columns = current_columns  # Add the column to the best set
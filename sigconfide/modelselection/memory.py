@@ -0,0 +1,207 @@
+import os
+import sys
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MB = 2**20
+
+# Memory of a worker process beyond the replicates it holds: the interpreter, numpy, scipy and the decomposition
+# caches (affine maps and active sets of 'KKTFastPath' and 'WarmStartQP')
+WORKER_OVERHEAD = 96 * MB
+
+# Size of a cell of the string matrix built by 'activities_matrix' to write the CSV output
+CSV_CELL = 4 * 32
+
+# The smallest replicate chunk a plan uses before it gives up
+MIN_CHUNK_SIZE = 32
+
+UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+def parse_memory(value):
+    """
+    Convert a memory size to bytes: an int or float of bytes, or a string with a unit such as "512M" or "4G".
+
+    :raises ValueError: If the size is not positive or the unit is unknown.
+    """
+    if isinstance(value, str):
+        text = value.strip().upper().rstrip('B')
+        try:
+            value = float(text[:-1]) * UNITS[text[-1]] if text[-1:] in UNITS else float(text)
+        except (ValueError, IndexError):
+            raise ValueError(f"Invalid memory size '{value}', use bytes or a unit such as '512M' or '4G'.")
+    if value <= 0:
+        raise ValueError("The memory size must be positive.")
+    return int(value)
+
+
+def sample_footprint(K, N, R, chunk_size=None, itemsize=8):
+    """
+    Estimate the peak memory in bytes of the hybrid selection of one sample against a catalog of N signatures.
+
+    With all R replicates in memory, the replicates (K x R), the temporaries of the decomposition (about 3 K x R)
+    and the 'solve_cache' of the elimination are held at once; the cache keeps the exposures and errors of every
+    model solved, at most N + (N - 1) + ... + 1 rows of R exposures for the backward elimination and N more models
+    for the forward selection. With replicates in chunks of 'chunk_size', the footprint does not depend on R: the
+    counts and probabilities of a chunk, the temporaries and the exposures of the chunk.
+    """
+    if chunk_size is None or chunk_size >= R:
+        cached = N * (N + 1) // 2 + 2 * N
+        return itemsize * (4 * K * R + cached * R)
+    return itemsize * (5 * K * chunk_size + 2 * N * chunk_size)
+
+
+def cohort_footprint(K, G, catalogs, output_format='csv', itemsize=8):
+    """
+    Estimate the memory in bytes held by 'fit' for the whole cohort of G samples: the samples matrix and its copy
+    while the files are stacked, the result arrays of every catalog and the largest output written.
+    """
+    results = sum(G * N * (2 * itemsize + 1) + 3 * G * itemsize for N in catalogs)
+    output = G * (max(catalogs) + 1) * (itemsize + CSV_CELL) if output_format == 'csv' else G * max(catalogs) * 16
+    return 2 * K * G * itemsize + results + output
+
+
+def chunk_footprint(K, catalogs, itemsize=8):
+    """
+    Estimate the memory in bytes per sample of a chunk of samples in 'fit_catalogs': the normalized profiles and
+    the exposures of the scheduling features ('sample_features') and the tasks sent to the workers.
+    """
+    return itemsize * (3 * K + max(catalogs) + 8)
+
+
+def current_rss():
+    """The resident set size of this process in bytes, or 0 where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()[0]
+
+
+def peak_rss():
+    """
+    The peak resident set size in bytes of this process and of its largest finished child process (the workers of
+    'fit'), or (0, 0) where it is not available.
+    """
+    if resource is None:
+        return 0, 0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+class MemoryPlan:
+    """
+    The settings of a 'fit' run chosen by 'plan_memory' to stay within a memory budget.
+
+    'n_jobs' is the number of worker processes, 'chunk_size' the number of replicates generated and solved at once
+    (None for all R replicates, see 'BootstrapChunks'), 'sample_chunk' the number of samples dispatched to the
+    workers at once by 'fit_catalogs' and 'estimated' the estimated peak memory in bytes.
+    """
+
+    def __init__(self, max_memory, n_jobs, chunk_size, sample_chunk, estimated):
+        self.max_memory = max_memory
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.sample_chunk = sample_chunk
+        self.estimated = estimated
+        self.peak = None
+
+    def record_peak(self):
+        """Record the actual peak RSS of this process and of its largest worker, after the run."""
+        self.peak = peak_rss()
+        return self.peak
+
+    def report(self):
+        report = {'max_memory': self.max_memory, 'n_jobs': self.n_jobs, 'chunk_size': self.chunk_size,
+                  'sample_chunk': self.sample_chunk, 'estimated': self.estimated}
+        if self.peak is not None:
+            report['peak_rss'], report['peak_worker_rss'] = self.peak
+        return report
+
+    def __str__(self):
+        text = (f"n_jobs={self.n_jobs}, chunk_size={self.chunk_size}, sample_chunk={self.sample_chunk}, "
+                f"estimated peak {self.estimated / MB:.1f} MB of {self.max_memory / MB:.1f} MB")
+        if self.peak is not None:
+            text += f"; peak RSS {self.peak[0] / MB:.1f} MB, largest worker {self.peak[1] / MB:.1f} MB"
+        return text
+
+
+def plan_memory(max_memory, K, G, catalogs, R, n_jobs=1, chunk_size=None, output_format='csv', itemsize=8,
+                baseline=None):
+    """
+    Choose the number of workers, the replicate chunk size and the sample chunk size of a 'fit' run so that its
+    estimated peak memory stays within 'max_memory'.
+
+    The estimate is the memory already used by this process ('baseline'), the cohort ('cohort_footprint'), one
+    sample in flight per worker ('sample_footprint' for the largest catalog, plus 'WORKER_OVERHEAD' per worker
+    process) and the samples of a chunk ('chunk_footprint'). The plan keeps all R replicates in memory and lowers
+    the number of workers first, so the results are the same as without a budget; only when a single worker cannot
+    hold the replicates of a sample are they generated in chunks ('BootstrapChunks', which draws other replicates),
+    with as many workers as fit and the largest chunks that fit with them. A 'chunk_size' given by the caller is
+    kept. The sample chunk takes the rest of the budget, up to the whole cohort.
+
+    :param max_memory: The memory budget in bytes, or a string such as "4G" (see 'parse_memory').
+    :type max_memory: int or str
+    :param K: The number of mutation types.
+    :type K: int
+    :param G: The number of samples.
+    :type G: int
+    :param catalogs: The number of signatures of every catalog.
+    :type catalogs: list
+    :param R: The number of bootstrap replicates.
+    :type R: int
+    :param n_jobs: The largest number of worker processes. Defaults to 1.
+    :type n_jobs: int, optional
+    :param chunk_size: The replicate chunk size chosen by the caller, if any. Defaults to None.
+    :type chunk_size: int, optional
+    :param output_format: 'csv' or 'sparse', see 'fit'. Defaults to 'csv'.
+    :type output_format: str, optional
+    :param baseline: The memory already used, in bytes. Defaults to the current RSS of this process.
+    :type baseline: int, optional
+
+    :raises ValueError: If the budget cannot hold the cohort and one sample.
+
+    :returns: The plan.
+    :rtype: MemoryPlan
+    """
+    max_memory = parse_memory(max_memory)
+    baseline = current_rss() if baseline is None else baseline
+    fixed = baseline + cohort_footprint(K, G, catalogs, output_format, itemsize)
+    per_sample = chunk_footprint(K, catalogs, itemsize)
+    min_sample_chunk = min(G, max(1, 4 * n_jobs))
+    N = max(catalogs)
+
+    def workers_memory(jobs, chunk):
+        overhead = WORKER_OVERHEAD if jobs > 1 else 0
+        return jobs * (overhead + sample_footprint(K, N, R, chunk, itemsize))
+
+    def fits(jobs, chunk):
+        return fixed + workers_memory(jobs, chunk) + min_sample_chunk * per_sample <= max_memory
+
+    # All R replicates (or the chunks of the caller) with as many workers as fit, otherwise replicate chunks from
+    # R / 2 down to MIN_CHUNK_SIZE, the largest that fits with as many workers as fit
+    chunks = []
+    if chunk_size is None:
+        chunk = R // 2
+        while chunk >= MIN_CHUNK_SIZE:
+            chunks.append(chunk)
+            chunk //= 2
+    candidates = [(jobs, chunk_size) for jobs in range(max(n_jobs, 1), 0, -1)]
+    candidates += [(jobs, chunk) for jobs in range(max(n_jobs, 1), 0, -1) for chunk in chunks]
+    jobs, chunk = next(((jobs, chunk) for jobs, chunk in candidates if fits(jobs, chunk)), (None, None))
+    if jobs is None:
+        needed = fixed + workers_memory(1, chunks[-1] if chunks else chunk_size) + min_sample_chunk * per_sample
+        raise ValueError(f"Parameter 'max_memory' ({max_memory / MB:.1f} MB) is below the estimated "
+                         f"{needed / MB:.1f} MB needed for the cohort and one sample"
+                         + (", try output_format='sparse'." if output_format == 'csv' else "."))
+
+    left = max_memory - fixed - workers_memory(jobs, chunk)
+    sample_chunk = int(np.clip(left // per_sample, min_sample_chunk, max(G, 1)))
+    estimated = fixed + workers_memory(jobs, chunk) + sample_chunk * per_sample
+    return MemoryPlan(max_memory, jobs, chunk, sample_chunk, estimated)
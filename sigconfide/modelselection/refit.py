@@ -0,0 +1,169 @@
+import os
+import numpy as np
+
+from sigconfide.modelselection.analyzer import as_catalog, load_catalogs
+from sigconfide.modelselection.budget import STATUS_OK, STATUS_FAILED
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.registry import resolve_backend, DEFAULT_BACKEND
+from sigconfide.utils import utils
+from sigconfide.utils.inputs import load_sample_files, sample_mutation_types
+from sigconfide.utils.utils import load_activities_file, load_sparse_activities, \
+    save_activities_file, save_sparse_activities, activities_matrix, FrobeniusNorm
+
+
+def refit_arrays(samples, selected, signatures=3.4, names_patients=None, names_signatures=None,
+                 decomposition_method=decomposeQP):
+    """
+    Recompute the exposures of the signatures already selected for every sample, without the bootstrap selection.
+
+    Samples with the same selected signatures are grouped and every group is solved with one call of
+    'findSigExposures', so a cohort is refitted in seconds.
+
+    :param samples: Mutation profiles of the samples, one per column, with a shape of (96, G).
+    :type samples: numpy.ndarray
+    :param selected: The mask of the selected signatures with a shape of (G, N), or a result of 'fit_arrays'.
+    :type selected: numpy.ndarray or dict
+    :param signatures: A COSMIC version, the path to a signatures file or a signature profile matrix, as in
+        'fit_arrays'. Defaults to 3.4.
+    :type signatures: float, str or numpy.ndarray, optional
+    :param names_patients: Names of the samples. Defaults to "S0", "S1", ...
+    :type names_patients: list, optional
+    :param names_signatures: Names of the signatures of a signature profile matrix.
+    :type names_signatures: list, optional
+    :param decomposition_method: The method used to decompose the mutation profiles. Defaults to 'decomposeQP'.
+    :type decomposition_method: function, optional
+
+    :raises ValueError: If the shape of 'selected' does not match the samples and the catalog.
+
+    :returns: A dictionary of arrays in the format of 'fit_arrays'; the 'p_values' are NaN and samples without any
+        selected signature have the status 'failed'.
+    :rtype: dict
+    """
+    if isinstance(selected, dict):
+        selected = selected['selected']
+    samples = np.asarray(samples)
+    selected = np.asarray(selected, dtype=bool)
+    sigs, names_signatures = as_catalog(signatures, names_signatures)
+    G, N = samples.shape[1], sigs.shape[1]
+    if selected.shape != (G, N):
+        raise ValueError(f"Parameter 'selected' must have a shape of ({G}, {N}), one row per sample and one column "
+                         f"per signature.")
+    if names_patients is None:
+        names_patients = [f"S{i}" for i in range(G)]
+
+    result = {
+        'samples': np.asarray(names_patients, dtype=str),
+        'signatures': np.asarray(names_signatures[1:]),
+        'exposures': np.zeros((G, N)),
+        'selected': selected.copy(),
+        'errors': np.full(G, np.nan),
+        'p_values': np.full((G, N), np.nan),
+        'analytic_decisions': np.zeros(G, dtype=int),
+        'bootstrap_decisions': np.zeros(G, dtype=int),
+        'fast_path_columns': np.zeros(G, dtype=int),
+        'fast_path_hits': np.zeros(G, dtype=int),
+        'status': np.full(G, STATUS_OK, dtype=object),
+    }
+
+    subsets, groups = np.unique(selected, axis=0, return_inverse=True)
+    for index, subset in enumerate(subsets):
+        rows = np.flatnonzero(groups.ravel() == index)
+        columns = np.flatnonzero(subset)
+        if len(columns) == 0:
+            result['status'][rows] = STATUS_FAILED
+            continue
+        if len(columns) == 1:
+            # A single signature takes the whole profile, 'findSigExposures' needs at least two
+            M = samples[:, rows] / samples[:, rows].sum(axis=0)
+            exposures = np.ones((1, len(rows)))
+            errors = np.array([FrobeniusNorm(M[:, k], sigs[:, columns], exposures[:, k]) for k in range(len(rows))])
+        else:
+            exposures, errors = findSigExposures(samples[:, rows], sigs[:, columns],
+                                                 decomposition_method=decomposition_method)
+        result['exposures'][np.ix_(rows, columns)] = exposures.T
+        result['errors'][rows] = errors
+    return result
+
+
+def load_selection(activities_file, names_patients, names_signatures):
+    """
+    Read the mask of the selected signatures from a previous "Assignment_Solution_Activities.csv" or ".npz" file.
+
+    The rows must be the samples 'names_patients' in the same order (rows of samples that failed have no name) and
+    the columns are matched to 'names_signatures' by name, so files saved with drop_zeros_columns=True can be used.
+    The ".npz" file saves the mask of the selected signatures. The CSV file only has the exposures, so there a
+    signature is selected when its exposure is positive: a selected signature whose exposure is exactly 0 is read as
+    not selected, as are the columns dropped by drop_zeros_columns=True. Use output_format='sparse' in the previous
+    fit to refit exactly its selection.
+    """
+    if activities_file.endswith('.npz'):
+        previous = load_sparse_activities(activities_file, dense=True)
+        samples, signatures, mask = previous['samples'], previous['signatures'], previous['selected']
+        samples = np.where(np.isnan(previous['errors']), '', samples)
+    else:
+        previous = load_activities_file(activities_file)
+        samples, signatures = previous[1:, 0], previous[0, 1:]
+        mask = previous[1:, 1:].astype(float) > 0
+        samples = np.where(samples.astype(str) == '0.0', '', samples)
+
+    if len(samples) != len(names_patients):
+        raise ValueError(f"The activities file has {len(samples)} samples, the samples file has {len(names_patients)}.")
+    named = samples != ''
+    if np.any(samples[named] != np.asarray(names_patients)[named]):
+        raise ValueError("The samples of the activities file are not the samples of the samples file, in the same order.")
+
+    positions = {name: k for k, name in enumerate(names_signatures[1:])}
+    unknown = [name for name in signatures if name not in positions]
+    if unknown:
+        raise ValueError(f"Signatures not found in the catalog: {', '.join(unknown)}.")
+    selected = np.zeros((len(names_patients), len(positions)), dtype=bool)
+    selected[:, [positions[name] for name in signatures]] = mask
+    return selected
+
+
+def refit(samples_file, activities_file, output_folder, signatures=3.4, drop_zeros_columns=False,
+          output_format='csv', backend=DEFAULT_BACKEND):
+    """
+    Recompute the exposures of a previous 'fit' for the same samples, reusing the signatures it selected.
+
+    The bootstrap selection is not repeated: the selected signatures of every sample are read from
+    'activities_file' (see 'load_selection') and the exposures and errors are computed with one decomposition per
+    group of samples with the same signatures (see 'refit_arrays'). This is useful when the samples were normalized
+    or corrected after the fit, or for reconstruction reports.
+
+    :param samples_file: Path to the file containing the samples, in the order of the previous fit.
+    :type samples_file: str
+    :param activities_file: Path to the "Assignment_Solution_Activities.csv" or ".npz" file of the previous fit.
+    :type activities_file: str
+    :param output_folder: Path to the folder where "Assignment_Solution_Activities.csv" (or ".npz") is saved.
+    :type output_folder: str
+
+    The remaining parameters are the same as in 'fit'; 'backend' solves the groups of samples instead of the
+    bootstrap replicates.
+
+    :returns: The path of the saved result.
+    :rtype: str
+
+    Examples:
+        refit('data/tumorBRCA_normalized.txt', 'output/Assignment_Solution_Activities.csv', 'output_refit',
+              signatures=3.4)
+    """
+    if output_format not in ('csv', 'sparse'):
+        raise ValueError("Parameter 'output_format' must be 'csv' or 'sparse'.")
+    mutation_types = sample_mutation_types(samples_file)
+    (sigs, names_signatures), = load_catalogs([signatures], mutation_types)
+    samples, names_patients = load_sample_files(samples_file, mutation_types)
+    selected = load_selection(activities_file, names_patients, names_signatures)
+
+    decomposition_method = resolve_backend(backend, sigs.shape[0], sigs.shape[1], max(samples.shape[1], 1))
+    result = refit_arrays(samples, selected, sigs, names_patients=names_patients,
+                          names_signatures=names_signatures[1:], decomposition_method=decomposition_method)
+    utils.create_folder_if_not_exists(output_folder)
+    if output_format == 'sparse':
+        output_file = os.path.join(output_folder, "Assignment_Solution_Activities.npz")
+        save_sparse_activities(result, output_file)
+    else:
+        output_file = os.path.join(output_folder, "Assignment_Solution_Activities.csv")
+        save_activities_file(activities_matrix(result), output_file, drop_zeros_columns=drop_zeros_columns)
+    return output_file
@@ -0,0 +1,194 @@
+import json
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+
+from sigconfide.decompose.kkt import KKTFastPath
+
+
+def sample_features(samples, catalogs, R, threshold=0.01, mutation_count=None):
+    """
+    Compute cheap per-sample features that predict the cost of the hybrid selection.
+
+    The features are: an intercept, log(mutation count), log(R), log(number of signatures of all catalogs) and
+    log(1 + number of signatures with an exposure above 'threshold' in the equality-constrained least-squares
+    solution), a proxy for the number of signatures surviving elimination obtained with one matrix product.
+
+    :param samples: Mutation profiles of the samples, one per column, with a shape of (96, G).
+    :type samples: numpy.ndarray
+    :param catalogs: Signature profile matrices, one per catalog.
+    :type catalogs: list
+    :param R: The number of bootstrap replicates.
+    :type R: int
+
+    :returns: A matrix of features with a shape of (G, 5).
+    :rtype: numpy.ndarray
+    """
+    G = samples.shape[1]
+    counts = samples.sum(axis=0) if mutation_count is None else np.full(G, mutation_count)
+    normalized = samples / np.maximum(samples.sum(axis=0), 1e-300)
+
+    n_signatures = sum(sigs.shape[1] for sigs in catalogs)
+    survivors = np.zeros(G)
+    for sigs in catalogs:
+        try:
+            A, c = KKTFastPath(cache_size=1).affine_map(sigs)
+        except np.linalg.LinAlgError:
+            # A rank-deficient catalog has no affine map; every signature is counted as a survivor instead, which
+            # overestimates the cost but leaves the scheduling (and the fit) running
+            survivors += sigs.shape[1]
+            continue
+        survivors += ((np.dot(A, normalized) + c[:, None]) > threshold).sum(axis=0)
+
+    return np.column_stack([
+        np.ones(G),
+        np.log(np.maximum(counts, 1)),
+        np.full(G, np.log(R)),
+        np.full(G, np.log(n_signatures)),
+        np.log1p(survivors),
+    ])
+
+
+class CostModel:
+    """
+    Log-linear model of the per-sample cost (seconds of the hybrid selection) from 'sample_features'.
+
+    The weights start from a prior (cost grows linearly with R and the number of signatures, and sub-linearly with
+    the mutation count and the number of surviving signatures) and are refined by ridge regression towards the
+    prior as actual costs are recorded with 'update'. The model can be saved to and loaded from a JSON file, so the
+    estimates keep improving across runs on the same machine.
+    """
+
+    PRIOR = np.array([np.log(1e-5), 0.3, 1.0, 1.0, 0.5])
+
+    def __init__(self, weights=None, regularization=1.0):
+        self.prior = self.PRIOR.copy() if weights is None else np.asarray(weights, dtype=float)
+        self.regularization = regularization
+        self.XtX = regularization * np.eye(len(self.prior))
+        self.Xty = regularization * self.prior
+        self.weights = self.prior.copy()
+        self.n_observations = 0
+
+    def predict(self, features):
+        return np.exp(np.dot(features, self.weights))
+
+    def update(self, features, seconds):
+        features = np.atleast_2d(features)
+        log_seconds = np.log(np.maximum(np.atleast_1d(seconds), 1e-6))
+        self.XtX += np.dot(features.T, features)
+        self.Xty += np.dot(features.T, log_seconds)
+        self.weights = np.linalg.solve(self.XtX, self.Xty)
+        self.n_observations += features.shape[0]
+
+    def save(self, file_name):
+        with open(file_name, 'w') as file:
+            json.dump({'weights': self.weights.tolist(), 'n_observations': self.n_observations}, file, indent=2)
+
+    @classmethod
+    def load(cls, file_name):
+        """Load a saved model, or return a model with the prior weights if the file does not exist."""
+        if file_name is None or not os.path.exists(file_name):
+            return cls()
+        with open(file_name, 'r') as file:
+            saved = json.load(file)
+        # The saved weights become the prior of this run
+        model = cls(weights=saved['weights'], regularization=1.0 + saved.get('n_observations', 0))
+        model.n_observations = saved.get('n_observations', 0)
+        return model
+
+
+def timed_call(args):
+    function, task = args
+    start = time.perf_counter()
+    result = function(task)
+    return result, time.perf_counter() - start
+
+
+def dead_workers(workers):
+    """The exit codes of the worker processes of a pool that have exited."""
+    return [worker.exitcode for worker in workers if not worker.is_alive() and worker.exitcode is not None]
+
+
+def pool_workers(n_jobs, existing):
+    """
+    The 'n_jobs' worker processes of a pool just started, i.e. the children of this process not in 'existing'.
+
+    :raises RuntimeError: If the number of new children is not 'n_jobs' (e.g. another child was started meanwhile).
+    """
+    workers = [child for child in multiprocessing.active_children() if child not in existing]
+    if len(workers) != n_jobs:
+        raise RuntimeError(f"Expected {n_jobs} worker processes, found {len(workers)}.")
+    return workers
+
+
+def run_scheduled(function, tasks, features, n_jobs, cost_model=None, prefetch=2, poll_seconds=1.0):
+    """
+    Apply 'function' to 'tasks' on a pool of 'n_jobs' processes, longest expected task first.
+
+    Tasks are submitted one at a time as workers become free (at most 'prefetch' tasks queued per worker), so fast
+    workers take more tasks and a few expensive tasks are not left for the end. The actual cost of every task is
+    recorded in 'cost_model', and the order of the pending tasks is re-estimated with the refined model whenever the
+    number of finished tasks doubles.
+
+    :param function: The function applied to each task; it must be picklable.
+    :type function: function
+    :param tasks: The tasks.
+    :type tasks: list
+    :param features: The features of the tasks, from 'sample_features'.
+    :type features: numpy.ndarray
+    :param n_jobs: The number of worker processes.
+    :type n_jobs: int
+    :param cost_model: The cost model, refined in place. If None, a model with the prior weights is used.
+    :type cost_model: CostModel, optional
+    :param poll_seconds: How often the workers are checked while waiting for a result. Defaults to 1 second.
+    :type poll_seconds: float, optional
+
+    :raises RuntimeError: If a worker process dies (e.g. killed for lack of memory), since its task is lost.
+
+    :returns: A generator of (task index, result) pairs in completion order.
+    :rtype: generator
+    """
+    cost_model = CostModel() if cost_model is None else cost_model
+    # Pending tasks are kept sorted by increasing expected cost and taken from the end
+    pending = list(np.argsort(cost_model.predict(features), kind='stable'))
+    finished = queue.Queue()
+    in_flight = 0
+    done = 0
+    next_reorder = 1
+
+    existing = multiprocessing.active_children()
+    with multiprocessing.Pool(n_jobs) as pool:
+        # The pool replaces dead workers but never reports the task they were running, so they are watched here;
+        # there are no public accessors to the worker processes of a pool, so they are the 'n_jobs' new children
+        workers = pool_workers(n_jobs, existing)
+        while pending or in_flight:
+            while pending and in_flight < n_jobs * prefetch:
+                index = pending.pop()
+                pool.apply_async(timed_call, ((function, tasks[index]),),
+                                 callback=lambda output, index=index: finished.put((index, output, None)),
+                                 error_callback=lambda error, index=index: finished.put((index, None, error)))
+                in_flight += 1
+
+            while True:
+                try:
+                    index, output, error = finished.get(timeout=poll_seconds)
+                    break
+                except queue.Empty:
+                    exit_codes = dead_workers(workers)
+                    if exit_codes:
+                        raise RuntimeError(f"A worker process died unexpectedly (exit code {exit_codes[0]}), "
+                                           f"{in_flight} tasks were lost.")
+            in_flight -= 1
+            if error is not None:
+                raise error
+            result, seconds = output
+            cost_model.update(features[index], seconds)
+            done += 1
+            yield index, result
+
+            if done >= next_reorder and pending:
+                next_reorder *= 2
+                predicted = cost_model.predict(features[pending])
+                pending = [pending[i] for i in np.argsort(predicted, kind='stable')]
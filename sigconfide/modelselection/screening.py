@@ -0,0 +1,127 @@
+import numpy as np
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.decompose.qp import decomposeQP
+
+
+class AnalyticScreen:
+    """
+    Delta-method screening of the signatures whose bootstrap p-value is clear-cut.
+
+    Around the point estimate of the exposures, the solution of the problem solved by 'decomposeQP' is an affine
+    function of the normalized mutation profile: on the set F of signatures with a positive exposure, e_F = A m + c
+    (the equality-constrained least-squares solution on F) and, for a signature j outside F, the multiplier of its
+    bound constraint is mu_j = b_j' m + beta_j. Bootstrap replicates are multinomial with covariance
+    (diag(m) - m m') / n, which gives the standard deviation of every e_j and mu_j. A signature is decided
+    analytically when the replicates would fall on one side of the threshold with high confidence:
+
+    - kept (p-value ~ 0) if e_j - margin * sd(e_j) > threshold;
+    - removed (p-value ~ 1) if e_j + margin * sd(e_j) < threshold or, for a signature at zero,
+      mu_j - margin * sd(mu_j) > -kappa_j * threshold, where kappa_j is the curvature of the objective along the
+      direction that adds signature j to F: a replicate with multiplier mu_j* < 0 gives signature j an exposure of
+      about -mu_j* / kappa_j, which stays below the threshold.
+
+    The remaining (borderline) signatures need the bootstrap. 'hybrid_selection' skips the bootstrap solves of a
+    backward elimination step when every signature is decided analytically or at least one is removed analytically,
+    and of a forward selection step when the added signature is decided analytically.
+    The counters 'analytic' and 'bootstrap' record how many signature decisions were made each way, and 'skipped'
+    and 'solved' how many elimination steps skipped or used the bootstrap solves.
+
+    :param margin: The number of standard deviations required for an analytic decision. Larger is more
+        conservative. Defaults to 3.0.
+    :type margin: float, optional
+    :param tol: Exposures below 'tol' are considered to be at zero. Defaults to 1e-9.
+    :type tol: float, optional
+
+    Examples:
+        screen = AnalyticScreen(margin=3.0)
+        hybrid_selection(m, P, R=100, threshold=0.01, mutation_count=None, significance_level=0.01, screening=screen)
+        print(screen.report())
+    """
+
+    def __init__(self, margin=3.0, tol=1e-9):
+        if margin < 0:
+            raise ValueError("Parameter 'margin' must be nonnegative.")
+        self.margin = margin
+        self.tol = tol
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.analytic = 0
+        self.bootstrap = 0
+        self.skipped = 0
+        self.solved = 0
+
+    def report(self):
+        decisions = self.analytic + self.bootstrap
+        return {'analytic': self.analytic, 'bootstrap': self.bootstrap, 'skipped': self.skipped,
+                'solved': self.solved, 'analytic_rate': self.analytic / decisions if decisions else 0.0}
+
+    def record(self, status, solved):
+        """Count the decisions of one elimination step, 'solved' tells whether it used the bootstrap solves."""
+        borderline = int(np.count_nonzero(status == 0))
+        self.analytic += len(status) - borderline
+        if solved:
+            self.bootstrap += borderline
+            self.solved += 1
+        else:
+            self.skipped += 1
+
+    def screen(self, m, P, threshold, mutation_count=None, decomposition_method=decomposeQP):
+        """
+        Decide the signatures (columns of 'P') of the profile 'm' analytically where possible.
+
+        :param m: The observed mutation profile vector for a patient/sample.
+        :type m: numpy.ndarray
+        :param P: The signature profile matrix of the current model.
+        :type P: numpy.ndarray
+        :param threshold: The threshold of the bootstrap p-values.
+        :type threshold: float
+        :param mutation_count: The total number of mutations. If None, 'm' has to contain counts.
+        :type mutation_count: int, optional
+
+        :returns: An array with 1 for signatures kept analytically, -1 for signatures removed analytically and 0 for
+            borderline signatures.
+        :rtype: numpy.ndarray
+        """
+        n = m.sum() if mutation_count is None else mutation_count
+        p = m / m.sum()
+        exposures = findSigExposures(p.reshape(-1, 1), P, decomposition_method=decomposition_method)[0][:, 0]
+
+        status = np.zeros(P.shape[1], dtype=int)
+        free = exposures > self.tol
+        if free.sum() < 2:
+            # A single free signature has a constant exposure, the linearization carries no information
+            return status
+        P_free, P_bound = P[:, free], P[:, ~free]
+
+        k = P_free.shape[1]
+        G_free = np.dot(P_free.T, P_free)
+        try:
+            solved = np.linalg.solve(G_free, np.column_stack([P_free.T, np.ones(k)]))
+            # Curvature along the directions that add a signature at zero to F, keeping the sum of exposures
+            K = np.block([[G_free, np.ones((k, 1))], [np.ones((1, k)), np.zeros((1, 1))]])
+            W = np.vstack([np.dot(P_free.T, P_bound), np.ones((1, P_bound.shape[1]))])
+            kappa = (P_bound ** 2).sum(axis=0) - (W * np.linalg.solve(K, W)).sum(axis=0)
+        except np.linalg.LinAlgError:
+            return status
+        GinvPt, h = solved[:, :-1], solved[:, -1]
+        s = h.sum()
+        A = GinvPt - np.outer(h, GinvPt.sum(axis=0)) / s
+        c = h / s
+        # Multiplier of the equality constraint and multipliers of the bounds of the signatures at zero
+        l, l0 = np.dot(P_free, h) / s, -1 / s
+        B = np.linalg.multi_dot([P_bound.T, P_free, A]) - P_bound.T + l
+        beta = np.linalg.multi_dot([P_bound.T, P_free, c]) + l0
+
+        def sd(rows):
+            return np.sqrt(np.maximum(np.dot(rows ** 2, p) - np.dot(rows, p) ** 2, 0) / n)
+
+        e, sd_e = np.dot(A, p) + c, sd(A)
+        status_free = np.zeros(len(e), dtype=int)
+        status_free[e - self.margin * sd_e > threshold] = 1
+        status_free[e + self.margin * sd_e < threshold] = -1
+        status[free] = status_free
+
+        mu, sd_mu = np.dot(B, p) + beta, sd(B)
+        status[~free] = np.where(mu - self.margin * sd_mu > -np.maximum(kappa, 0) * threshold, -1, 0)
+        return status
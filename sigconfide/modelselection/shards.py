@@ -0,0 +1,216 @@
+import glob
+import inspect
+import json
+import os
+import numpy as np
+
+from sigconfide.modelselection.analyzer import load_catalog, fit_arrays, catalog_file, activities_matrix
+from sigconfide.modelselection.clusters import load_clusters
+from sigconfide.decompose.registry import select_backend
+from sigconfide.utils.inputs import align_mutation_types, load_allowed_signatures, load_sample_groups
+from sigconfide.utils import utils
+from sigconfide.utils.utils import load_samples_file, read_samples_header, catalog_hash, \
+    save_activities_file, load_activities_file, load_mutation_types, save_status_file
+
+SHARD_PATTERN = "Assignment_Solution_Activities.shard-{:04d}-of-{:04d}"
+
+# Options of 'fit_arrays' that change the results, they are saved with every shard and must match when merging;
+# the other options (n_jobs, schedule, cost_model, replicate_jobs, sample_chunk) only change how a shard is run
+RESULT_OPTIONS = ('chunk_size', 'screening', 'sampling', 'time_budget', 'work_budget', 'degrade', 'clusters',
+                  'backend', 'allowed_signatures', 'sample_groups')
+
+
+def shard_columns(n_samples, shard_index, num_shards):
+    """
+    Compute the range of sample columns processed by one shard.
+
+    The samples are split into 'num_shards' contiguous ranges whose sizes differ by at most one.
+
+    :param n_samples: The total number of samples in the cohort.
+    :type n_samples: int
+    :param shard_index: The index of the shard, from 0 to num_shards - 1.
+    :type shard_index: int
+    :param num_shards: The number of shards.
+    :type num_shards: int
+
+    :raises ValueError: If 'shard_index' is not in the range [0, num_shards).
+
+    :returns: The range of sample columns of the shard.
+    :rtype: range
+    """
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError("Parameter 'shard_index' must be in the range [0, num_shards).")
+    start = shard_index * n_samples // num_shards
+    stop = (shard_index + 1) * n_samples // num_shards
+    return range(start, stop)
+
+
+def fit_shard(samples_file, output_folder, shard_index, num_shards, threshold=0.01,
+              mutation_count=None, R=100, significance_level=0.01, signatures=3.4, seed=None,
+              **selection_options):
+    """
+    Run 'fit' on the column range 'shard_index'/'num_shards' of the samples file.
+
+    Only the sample columns of the shard are parsed. The partial result is written to the output folder as
+    "Assignment_Solution_Activities.shard-XXXX-of-YYYY.csv" (zero columns are never dropped from partial results),
+    together with a JSON file holding the metadata needed by 'merge_shards': the catalog hash, the fitting
+    parameters, the seed and the column range of the shard. With a time or work budget, the status of the samples
+    is written to "Assignment_Solution_Activities.shard-XXXX-of-YYYY.status.csv".
+
+    :param samples_file: Path to the file containing the genetic sample data to be analyzed.
+    :type samples_file: str
+    :param output_folder: Path to the folder where the partial result is saved.
+    :type output_folder: str
+    :param shard_index: The index of the shard, from 0 to num_shards - 1.
+    :type shard_index: int
+    :param num_shards: The number of shards the samples file is split into.
+    :type num_shards: int
+    :param seed: The seed of the per-sample random states. With a seed the merged result is identical to the
+        result of 'fit' run with the same seed on the whole file.
+    :type seed: int, optional
+    :param selection_options: Options of 'fit_arrays', e.g. 'chunk_size', 'n_jobs', 'screening' or 'backend'.
+        'allowed_signatures' and 'sample_groups' can be files, as in 'fit', and 'clusters' a cosine similarity. The
+        options in 'RESULT_OPTIONS' are saved in the metadata, with 'backend'='auto' replaced by the backend it
+        selects, so that the shards of a cohort are computed alike on every machine.
+
+    The remaining parameters are the same as in 'fit'; the bootstrap exposures cannot be saved with shards.
+
+    :raises ValueError: If 'bootstrap_files' is given.
+
+    :returns: The path of the partial result.
+    :rtype: str
+    """
+    if 'bootstrap_files' in selection_options:
+        raise ValueError("The bootstrap exposures cannot be saved with shards.")
+    _, _, _, names_patients = read_samples_header(samples_file)
+    columns = shard_columns(len(names_patients), shard_index, num_shards)
+
+    sigs, names_signatures = load_catalog(signatures)
+    sigs = align_mutation_types(sigs, load_mutation_types(catalog_file(signatures)), load_mutation_types(samples_file),
+                                catalog_file(signatures))
+    if len(columns) > 0:
+        samples, names_shard = load_samples_file(samples_file, columns=columns)
+    else:
+        samples, names_shard = np.empty((sigs.shape[0], 0)), names_patients[:0]
+
+    defaults = inspect.signature(fit_arrays).parameters
+    options = {name: selection_options.get(name, defaults[name].default) for name in RESULT_OPTIONS}
+    if isinstance(options['allowed_signatures'], str):
+        options['allowed_signatures'] = load_allowed_signatures(options['allowed_signatures'])
+    if isinstance(options['sample_groups'], str):
+        options['sample_groups'] = load_sample_groups(options['sample_groups'])
+    if options['backend'] == 'auto':
+        # Machines may calibrate differently, the backend is fixed before fitting and recorded in the metadata
+        options['backend'] = select_backend(sigs.shape[0], sigs.shape[1], min(R, options['chunk_size'] or R))
+    selection_options.update(options)
+    saved = dict(options)
+    if isinstance(options['clusters'], (int, float)):
+        selection_options['clusters'] = [load_clusters(catalog_file(signatures), options['clusters'])]
+    elif options['clusters'] is not None:
+        saved['clusters'] = [np.asarray(labels).tolist() for labels in options['clusters']]
+    if callable(options['backend']):
+        saved['backend'] = getattr(options['backend'], '__name__', type(options['backend']).__name__)
+
+    result = fit_arrays(samples, sigs, names_patients=names_shard, names_signatures=names_signatures[1:],
+                        threshold=threshold, mutation_count=mutation_count, R=R,
+                        significance_level=significance_level, seed=seed, offset=columns.start,
+                        **selection_options)
+
+    metadata = {
+        'shard_index': shard_index,
+        'num_shards': num_shards,
+        'start': columns.start,
+        'stop': columns.stop,
+        'n_samples': len(names_patients),
+        'catalog_hash': catalog_hash(sigs, names_signatures),
+        'parameters': {
+            'threshold': threshold,
+            'mutation_count': mutation_count,
+            'R': R,
+            'significance_level': significance_level,
+            **saved,
+        },
+        'seed': seed,
+    }
+
+    utils.create_folder_if_not_exists(output_folder)
+    prefix = os.path.join(output_folder, SHARD_PATTERN.format(shard_index, num_shards))
+    save_activities_file(activities_matrix(result), prefix + ".csv")
+    if options['time_budget'] is not None or options['work_budget'] is not None:
+        save_status_file(result, prefix + ".status.csv")
+    with open(prefix + ".json", 'w') as file:
+        json.dump(metadata, file, indent=2)
+
+    return prefix + ".csv"
+
+
+def merge_shards(shard_folder, output_folder, drop_zeros_columns=False):
+    """
+    Validate the partial results written by 'fit_shard' and stitch them into "Assignment_Solution_Activities.csv",
+    and their statuses into "Assignment_Solution_Status.csv" when they were computed with a budget.
+
+    All shards must be present exactly once, must cover the whole cohort and must have been computed with the
+    same catalog, parameters (including the options in 'RESULT_OPTIONS') and seed. Columns with only zeros are dropped after merging, so a signature is kept
+    when it is used by a sample of any shard.
+
+    :param shard_folder: Path to the folder containing the partial results.
+    :type shard_folder: str
+    :param output_folder: Path to the folder where the merged result is saved.
+    :type output_folder: str
+    :param drop_zeros_columns: If True, columns with all zero values in the merged matrix will be removed.
+    :type drop_zeros_columns: bool, optional
+
+    :raises ValueError: If shards are missing, duplicated or were computed with different settings.
+
+    :returns: The path of the merged result.
+    :rtype: str
+    """
+    metadata_files = sorted(glob.glob(os.path.join(shard_folder, "Assignment_Solution_Activities.shard-*.json")))
+    if not metadata_files:
+        raise ValueError(f"No shards found in {shard_folder}.")
+
+    shards = []
+    for metadata_file in metadata_files:
+        with open(metadata_file, 'r') as file:
+            shards.append((json.load(file), metadata_file[:-len(".json")] + ".csv"))
+    shards.sort(key=lambda shard: shard[0]['shard_index'])
+
+    reference = shards[0][0]
+    num_shards = reference['num_shards']
+    for metadata, _ in shards:
+        for key in ('num_shards', 'n_samples', 'catalog_hash', 'parameters', 'seed'):
+            if metadata[key] != reference[key]:
+                raise ValueError(f"Shard {metadata['shard_index']} was computed with a different '{key}'.")
+
+    indices = [metadata['shard_index'] for metadata, _ in shards]
+    if indices != list(range(num_shards)):
+        missing = sorted(set(range(num_shards)) - set(indices))
+        raise ValueError(f"Shards must be present exactly once, missing: {missing}, found: {indices}.")
+
+    stop = 0
+    for metadata, _ in shards:
+        if metadata['start'] != stop:
+            raise ValueError(f"Shard {metadata['shard_index']} does not start where the previous shard stops.")
+        stop = metadata['stop']
+    if stop != reference['n_samples']:
+        raise ValueError("Shards do not cover all the samples.")
+
+    parts = [load_activities_file(csv_file) for _, csv_file in shards]
+    header = parts[0][0]
+    for part in parts[1:]:
+        if not np.array_equal(part[0], header):
+            raise ValueError("Shards have different signature names.")
+    output = np.vstack([header] + [part[1:] for part in parts])
+
+    utils.create_folder_if_not_exists(output_folder)
+    output_file = os.path.join(output_folder, "Assignment_Solution_Activities.csv")
+    save_activities_file(output, output_file, drop_zeros_columns=drop_zeros_columns)
+
+    parameters = reference['parameters']
+    if parameters.get('time_budget') is not None or parameters.get('work_budget') is not None:
+        statuses = [load_activities_file(csv_file[:-len(".csv")] + ".status.csv") for _, csv_file in shards]
+        status_file = os.path.join(output_folder, "Assignment_Solution_Status.csv")
+        np.savetxt(status_file, np.vstack([statuses[0][0]] + [status[1:] for status in statuses]), delimiter=',',
+                   fmt='%s')
+
+    return output_file
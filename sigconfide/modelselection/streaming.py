@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import numpy as np
+
+from sigconfide.modelselection.analyzer import process_sample_catalogs, selection_options, as_catalog
+from sigconfide.decompose.registry import resolve_backend, DEFAULT_BACKEND
+
+
+async def iterate_samples(samples):
+    """Iterate over an async iterator or a plain iterable of samples."""
+    if hasattr(samples, '__aiter__'):
+        async for sample in samples:
+            yield sample
+    else:
+        for sample in samples:
+            yield sample
+
+
+async def fit_stream(samples, signatures=3.4, names_signatures=None, threshold=0.01, mutation_count=None, R=100,
+                     significance_level=0.01, seed=None, chunk_size=None, screening=None, sampling='multinomial',
+                     time_budget=None, work_budget=None, degrade='reduced_R', n_jobs=1, max_pending=None,
+                     executor=None, backend=DEFAULT_BACKEND):
+    """
+    Fit a stream of samples and yield the result of every sample as soon as it is finished.
+
+    The samples are read from 'samples' only when fewer than 'max_pending' of them are being processed, so a fast
+    producer is held back (backpressure) and memory stays bounded. Each sample is processed with 'hybrid_selection'
+    in 'executor', like a sample of 'fit_arrays' (with 'seed', sample i of the stream gets the same results as
+    column i of 'fit_arrays'), and the results are yielded in completion order, so a slow sample does not hold up
+    the samples after it.
+
+    Closing the generator or cancelling the task that iterates over it cancels the samples not started yet and
+    closes 'samples' when it is an async generator; the samples being processed are finished by the executor but
+    their results are dropped.
+
+    :param samples: An async iterator or an iterable of (sample_name, profile) pairs, where 'profile' is the
+        mutation profile (96,) of the sample in the row order of the catalog.
+    :type samples: AsyncIterable or Iterable
+    :param signatures: A COSMIC version, the path to a signatures file or a signature profile matrix, as in
+        'fit_arrays'. Defaults to 3.4.
+    :type signatures: float, str or numpy.ndarray, optional
+    :param names_signatures: Names of the signatures of a signature profile matrix.
+    :type names_signatures: list, optional
+    :param n_jobs: The number of worker processes of the executor created when 'executor' is None; with 1, samples
+        are processed one at a time in a thread. Defaults to 1.
+    :type n_jobs: int, optional
+    :param max_pending: The largest number of samples submitted and not yet yielded. Defaults to 2 * n_jobs.
+    :type max_pending: int, optional
+    :param executor: A 'concurrent.futures' executor to use instead, e.g. shared with other stages. Every sample
+        draws its replicates from its own random state, so threads do not share the global numpy random state.
+    :type executor: concurrent.futures.Executor, optional
+
+    The remaining parameters are the same as in 'fit'.
+
+    :returns: An async generator of (sample_name, best_columns, exposures, errors): the indices of the selected
+        signatures, their exposures and the estimation error; a sample that failed gives (sample_name, None, None,
+        nan).
+    :rtype: AsyncGenerator
+
+    Examples:
+        async for name, best_columns, exposures, errors in fit_stream(profiles, signatures=3.4, n_jobs=4, seed=7):
+            await store(name, best_columns, exposures)
+    """
+    sigs, _ = as_catalog(signatures, names_signatures)
+    options = selection_options(threshold=threshold, mutation_count=mutation_count, R=R,
+                                significance_level=significance_level, seed=seed, chunk_size=chunk_size,
+                                screening=screening, sampling=sampling, time_budget=time_budget,
+                                work_budget=work_budget, degrade=degrade, workers=n_jobs > 1 or executor is not None)
+    options['decomposition_method'] = resolve_backend(backend, sigs.shape[0], sigs.shape[1], min(R, chunk_size or R))
+    max_pending = 2 * max(n_jobs, 1) if max_pending is None else max_pending
+    if max_pending < 1:
+        raise ValueError("Parameter 'max_pending' must be a positive integer.")
+
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(n_jobs) if n_jobs > 1 \
+            else concurrent.futures.ThreadPoolExecutor(1)
+    loop = asyncio.get_running_loop()
+    source = iterate_samples(samples)
+    pending = {}
+    fetch = None
+    exhausted = False
+    index = 0
+    try:
+        while True:
+            # The next sample is read while others are processed, as long as there is room for it
+            if fetch is None and not exhausted and len(pending) < max_pending:
+                fetch = asyncio.ensure_future(source.__anext__())
+            waiting = set(pending) | ({fetch} if fetch is not None else set())
+            if not waiting:
+                break
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            if fetch in done:
+                try:
+                    name, profile = fetch.result()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    task = (index, np.asarray(profile, dtype=float), [sigs], options)
+                    pending[loop.run_in_executor(executor, process_sample_catalogs, task)] = (index, name)
+                    index += 1
+                done.discard(fetch)
+                fetch = None
+
+            # Samples finished together are yielded in stream order
+            for future in sorted(done, key=lambda future: pending[future][0]):
+                _, name = pending.pop(future)
+                _, results = future.result()
+                best_columns, estimation_exposures = results[0][:2]
+                if best_columns is None:
+                    yield name, None, None, np.nan
+                else:
+                    yield (name, np.asarray(best_columns), np.ravel(estimation_exposures[0]),
+                           float(estimation_exposures[1][0]))
+    finally:
+        if fetch is not None:
+            # The source can only be closed once the read in progress has stopped
+            fetch.cancel()
+            await asyncio.gather(fetch, return_exceptions=True)
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+        await source.aclose()
+        if hasattr(samples, 'aclose'):
+            await samples.aclose()
@@ -0,0 +1,107 @@
+import os
+
+from sigconfide.modelselection.analyzer import load_catalogs, catalog_file, fit_arrays
+from sigconfide.modelselection.clusters import load_clusters
+from sigconfide.utils import utils
+from sigconfide.utils.utils import save_activities_file, activities_matrix, save_sparse_activities, save_status_file
+from sigconfide.utils.inputs import load_sample_files, sample_mutation_types, load_allowed_signatures, \
+    load_sample_groups
+
+
+def sweep_label(threshold, significance_level):
+    return f"threshold_{threshold}_significance_{significance_level}"
+
+
+def sweep_samples(samples, names_patients, sigs, names_signatures, thresholds, significance_levels, **options):
+    """
+    Run the hybrid selection of every sample for every combination of 'thresholds' and 'significance_levels'.
+
+    This is 'fit_arrays' with a 'grid': the bootstrap replicates of each sample are generated once and shared by all
+    grid points, and the replicate solves are memoized per (sample, signature subset), so grid points whose
+    eliminations go through the same subsets reuse the solves instead of repeating them.
+
+    :param samples: Mutation profiles of the samples, one per column, with a shape of (96, G).
+    :type samples: numpy.ndarray
+    :param names_patients: Names of the samples.
+    :type names_patients: numpy.ndarray
+    :param sigs: Signature profile matrix with a shape of (96, N).
+    :type sigs: numpy.ndarray
+    :param names_signatures: Names of the signatures preceded by the 'Samples' header, as returned by 'load_catalog'.
+    :type names_signatures: numpy.ndarray
+    :param thresholds: The grid of thresholds.
+    :type thresholds: list
+    :param significance_levels: The grid of significance levels.
+    :type significance_levels: list
+    :param options: The other options of 'fit_arrays', e.g. 'R', 'seed', 'chunk_size', 'n_jobs' or 'backend'.
+
+    :returns: A dictionary mapping each (threshold, significance_level) pair to its result, as returned by
+        'fit_arrays'.
+    :rtype: dict
+    """
+    grid = [(threshold, significance_level)
+            for threshold in thresholds for significance_level in significance_levels]
+    return fit_arrays(samples, sigs, names_patients=names_patients, names_signatures=names_signatures[1:], grid=grid,
+                      **options)
+
+
+def sweep(samples_file, output_folder, thresholds, significance_levels, signatures=3.4, drop_zeros_columns=False,
+          output_format='csv', **options):
+    """
+    Run 'fit' for every combination of 'thresholds' and 'significance_levels' in a single pass.
+
+    The samples file and the catalog are loaded once, the bootstrap replicates are generated once per sample and the
+    replicate solves are shared between grid points (see 'sweep_samples'). The result of each combination is saved as
+    "Assignment_Solution_Activities.csv" (or ".npz") in the subfolder
+    "threshold_<threshold>_significance_<significance_level>" of 'output_folder'. With the same 'seed', each result
+    is identical to the result of 'fit' with that combination.
+
+    :param samples_file: Path to the file containing the genetic sample data to be analyzed.
+    :type samples_file: str
+    :param output_folder: Path to the folder where the subfolders with results are saved.
+    :type output_folder: str
+    :param thresholds: The grid of thresholds.
+    :type thresholds: list
+    :param significance_levels: The grid of significance levels.
+    :type significance_levels: list
+    :param options: The other options of 'fit', e.g. 'mutation_count', 'R', 'seed', 'n_jobs', 'screening', the
+        budgets, 'clusters', 'backend' or 'allowed_signatures'. The bootstrap exposures cannot be saved and the
+        memory is not planned ('save_bootstrap' and 'max_memory' are not accepted).
+
+    The remaining parameters are the same as in 'fit'.
+
+    :returns: A dictionary mapping each (threshold, significance_level) pair to the path of its result.
+    :rtype: dict
+
+    Examples:
+        sweep('data/tumorBRCA.txt', 'output', thresholds=[0.01, 0.02, 0.05], significance_levels=[0.01, 0.05],
+              mutation_count=1000, seed=7)
+    """
+    if output_format not in ('csv', 'sparse'):
+        raise ValueError("Parameter 'output_format' must be 'csv' or 'sparse'.")
+    mutation_types = sample_mutation_types(samples_file)
+    (sigs, names_signatures), = load_catalogs([signatures], mutation_types)
+    samples, names_patients = load_sample_files(samples_file, mutation_types, n_jobs=options.get('n_jobs', 1))
+    if isinstance(options.get('allowed_signatures'), str):
+        options['allowed_signatures'] = load_allowed_signatures(options['allowed_signatures'])
+    if isinstance(options.get('sample_groups'), str):
+        options['sample_groups'] = load_sample_groups(options['sample_groups'])
+    if isinstance(options.get('clusters'), (int, float)):
+        options['clusters'] = [load_clusters(catalog_file(signatures), options['clusters'])]
+
+    results = sweep_samples(samples, names_patients, sigs, names_signatures, thresholds, significance_levels,
+                            **options)
+
+    output_files = {}
+    for (threshold, significance_level), result in results.items():
+        folder = os.path.join(output_folder, sweep_label(threshold, significance_level))
+        utils.create_folder_if_not_exists(folder)
+        if output_format == 'sparse':
+            output_file = os.path.join(folder, "Assignment_Solution_Activities.npz")
+            save_sparse_activities(result, output_file)
+        else:
+            output_file = os.path.join(folder, "Assignment_Solution_Activities.csv")
+            save_activities_file(activities_matrix(result), output_file, drop_zeros_columns=drop_zeros_columns)
+        if options.get('time_budget') is not None or options.get('work_budget') is not None:
+            save_status_file(result, os.path.join(folder, "Assignment_Solution_Status.csv"))
+        output_files[(threshold, significance_level)] = output_file
+    return output_files
@@ -0,0 +1,62 @@
+import numpy as np
+
+from sigconfide.estimates.standard import decompose_columns
+
+
+class SelectionWorkspace:
+    """
+    Buffers of the selection of one sample, allocated once and reused by every elimination and forward step.
+
+    'findSigExposures' normalizes the replicates and the signatures are copied out of 'P' for every model, and the
+    errors and p-values of every model need temporaries of the size of the replicates; over a selection that is
+    about N models times R columns of garbage. The workspace normalizes the replicates 'M' once (with the same
+    operation as 'findSigExposures', so the results are identical), and keeps a signature buffer filled in place
+    with the columns of a model, a residual buffer for the errors and a mask buffer for the p-values. Only the
+    exposures and errors of a model are new arrays, since they are kept in the 'solve_cache'.
+
+    The signature matrix given to the decomposition method is a view of the buffer, valid until the next solve;
+    the methods of this package only keep copies or hashes of it.
+
+    :param M: Bootstrap replicates of the sample, one per column, with a shape of (K, R).
+    :type M: numpy.ndarray
+    :param P: Signature profile matrix with a shape of (K, N).
+    :type P: numpy.ndarray
+    """
+
+    def __init__(self, M, P):
+        self._source = (M, P)
+        self.M = M / M.sum(axis=0)
+        self.P = np.asarray(P, dtype=float)
+        K, N = self.P.shape
+        # Column-major, so the leading columns of the buffer are a contiguous matrix
+        self._signatures = np.empty((K, N), order='F')
+        self._residuals = np.empty(self.M.shape)
+        self._mask = np.empty((N, self.M.shape[1]), dtype=bool)
+
+    def matches(self, M, P):
+        return M is self._source[0] and P is self._source[1]
+
+    def signatures(self, columns):
+        """Copy the columns 'columns' of 'P' into the signature buffer and return the filled part."""
+        out = self._signatures[:, :len(columns)]
+        np.take(self.P, columns, axis=1, out=out)
+        return out
+
+    def solve(self, columns, decomposition_method):
+        """Find the exposures and errors of the replicates for the signature columns 'columns' of 'P'."""
+        return decompose_columns(self.M, self.signatures(columns), decomposition_method, residuals=self._residuals)
+
+    def p_values(self, exposures, threshold):
+        """The same p-values as 'compute_p_value', with the mask of the exceedances in the mask buffer."""
+        mask = self._mask[:exposures.shape[0], :exposures.shape[1]]
+        np.greater(exposures, threshold, out=mask)
+        return 1 - np.count_nonzero(mask, axis=1) / mask.shape[1]
+
+
+def selection_workspace(workspace, M, P):
+    """Return 'workspace' if it belongs to the replicates 'M' and 'P', a new workspace otherwise (None for chunks)."""
+    if not isinstance(M, np.ndarray):
+        return None
+    if workspace is not None and workspace.matches(M, P):
+        return workspace
+    return SelectionWorkspace(M, P)
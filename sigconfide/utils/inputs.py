@@ -0,0 +1,138 @@
+import glob
+import json
+import multiprocessing
+import os
+import numpy as np
+
+from sigconfide.utils.utils import load_samples_file, load_mutation_types
+
+
+def expand_sample_files(samples):
+    """
+    List the sample files given by a path, a glob pattern, a manifest or a list of those.
+
+    A manifest is a file ending with ".manifest" that lists one path or glob pattern per line, relative to the folder
+    of the manifest; empty lines and lines starting with '#' are ignored. Glob patterns are expanded in sorted order.
+    Sample files can be compressed with gzip (".gz") or bzip2 (".bz2").
+
+    :raises ValueError: If a glob pattern matches no file.
+    """
+    if isinstance(samples, (list, tuple)):
+        return [file_name for item in samples for file_name in expand_sample_files(item)]
+    samples = str(samples)
+    if glob.has_magic(samples):
+        files = sorted(glob.glob(samples))
+        if not files:
+            raise ValueError(f"No sample files match '{samples}'.")
+        return files
+    if samples.endswith('.manifest'):
+        folder = os.path.dirname(samples)
+        with open(samples, 'r') as file:
+            lines = [line.strip() for line in file]
+        return expand_sample_files([os.path.join(folder, line) for line in lines if line and not line.startswith('#')])
+    return [samples]
+
+
+def align_mutation_types(samples, mutation_types, reference, file_name, reference_name='the samples'):
+    """
+    Reorder the rows of 'samples' (a samples or signatures matrix from 'file_name'), labelled by 'mutation_types',
+    to the order of the mutation types 'reference'.
+
+    :raises ValueError: If the mutation types are not a permutation of 'reference'.
+    """
+    if np.array_equal(mutation_types, reference):
+        return samples
+    positions = {mutation_type: row for row, mutation_type in enumerate(mutation_types)}
+    if len(positions) != len(mutation_types) or set(positions) != set(reference):
+        raise ValueError(f"The mutation types of '{file_name}' do not match the mutation types of {reference_name}.")
+    return samples[[positions[mutation_type] for mutation_type in reference]]
+
+
+def load_aligned_samples(args):
+    file_name, reference, reference_name = args
+    samples, names_patients = load_samples_file(file_name)
+    if reference is not None:
+        samples = align_mutation_types(samples, load_mutation_types(file_name), reference, file_name, reference_name)
+    return samples, names_patients
+
+
+def sample_mutation_types(samples):
+    """Read the mutation types of the first of the sample files given by 'samples' (see 'expand_sample_files')."""
+    return load_mutation_types(expand_sample_files(samples)[0])
+
+
+def load_sample_files(samples, mutation_types=None, n_jobs=1):
+    """
+    Load and combine the sample files given by 'samples' (see 'expand_sample_files') into one samples matrix.
+
+    The files are decompressed and parsed by a pool of 'n_jobs' processes. The rows of every file are reordered to
+    the mutation types 'mutation_types' (see 'load_mutation_types'), by default those of the first file, so files
+    written in different orders, e.g. "A[C>A]A" or "C>A,ACA" first, can be combined.
+
+    :param samples: A path, a glob pattern, a manifest or a list of those.
+    :type samples: str or list
+    :param mutation_types: The mutation types in the order of the rows of the result. Defaults to the mutation
+        types of the first file.
+    :type mutation_types: numpy.ndarray, optional
+    :param n_jobs: The number of processes parsing the files. Defaults to 1.
+    :type n_jobs: int, optional
+
+    :raises ValueError: If the mutation types of a file do not match 'mutation_types', or if a sample name appears
+        in several files.
+
+    :returns: The samples (96 x G) of all files side by side, in the order of the files, and their names.
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    """
+    files = expand_sample_files(samples)
+    reference_name = 'the samples'
+    if mutation_types is None and len(files) > 1:
+        mutation_types, reference_name = load_mutation_types(files[0]), f"'{files[0]}'"
+    tasks = [(file_name, mutation_types, reference_name) for file_name in files]
+    if n_jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(n_jobs, len(tasks))) as pool:
+            loaded = pool.map(load_aligned_samples, tasks)
+    else:
+        loaded = [load_aligned_samples(task) for task in tasks]
+
+    names_patients = np.concatenate([names for _, names in loaded])
+    unique, counts = np.unique(names_patients, return_counts=True)
+    if np.any(counts > 1):
+        raise ValueError(f"Samples found in several files: {', '.join(unique[counts > 1][:5])}.")
+    return np.hstack([matrix.reshape(matrix.shape[0], -1) for matrix, _ in loaded]), names_patients
+
+
+def load_sample_groups(file_name):
+    """
+    Read a sample annotation file: one sample and its group (e.g. its cancer type) per line, separated by a tab or a
+    comma. Empty lines and lines starting with '#' are ignored, and a first line "sample<sep>group" is a header.
+
+    :returns: The group of every sample.
+    :rtype: dict
+    """
+    groups = {}
+    with open(file_name, 'r') as file:
+        for number, line in enumerate(file):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split('\t' if '\t' in line else ',')]
+            if len(fields) != 2:
+                raise ValueError(f"Line {number + 1} of '{file_name}' must have a sample and a group.")
+            if number == 0 and fields[0].lower() == 'sample':
+                continue
+            groups[fields[0]] = fields[1]
+    return groups
+
+
+def load_allowed_signatures(file_name):
+    """
+    Read the signatures allowed for every sample or group: a JSON file such as {"BRCA": ["SBS1", "SBS2", ...]}.
+
+    :returns: The names of the allowed signatures of every sample or group.
+    :rtype: dict
+    """
+    with open(file_name, 'r') as file:
+        allowed = json.load(file)
+    if not isinstance(allowed, dict) or not all(isinstance(names, list) for names in allowed.values()):
+        raise ValueError(f"'{file_name}' must map every sample or group to a list of signature names.")
+    return allowed
@@ -0,0 +1,224 @@
+import json
+import os
+import numpy as np
+
+from sigconfide.utils import utils
+from sigconfide.utils.utils import load_mutation_types, multinomial_chain
+
+# Samples are drawn in blocks with their own random states, so a cohort only depends on the seed and its parameters,
+# not on the format or the chunk size used to write it
+BLOCK_SIZE = 1024
+
+
+def draw_mutation_counts(random_state, size, mutation_counts):
+    """
+    Draw the number of mutations of 'size' samples.
+
+    'mutation_counts' is an int (every sample has the same number of mutations), a (median, sigma) tuple of a
+    log-normal distribution, or a function of (random_state, size) returning the counts.
+    """
+    if callable(mutation_counts):
+        counts = mutation_counts(random_state, size)
+    elif isinstance(mutation_counts, (tuple, list)):
+        median, sigma = mutation_counts
+        counts = random_state.lognormal(np.log(median), sigma, size=size)
+    else:
+        counts = np.full(size, mutation_counts)
+    return np.maximum(np.round(counts), 1).astype(np.int64)
+
+
+def draw_block(P, seed, block_index, size, mutation_counts, sparsity, concentration):
+    """
+    Draw one block of samples: ground-truth exposures (N x size) and multinomial mutation counts (96 x size).
+    """
+    random_state = np.random.RandomState([seed, block_index])
+    N = P.shape[1]
+
+    # Active signatures: at least one, on average (1 - sparsity) of the catalog
+    n_active = 1 + random_state.binomial(N - 1, 1 - sparsity, size=size)
+    ranks = np.argsort(random_state.rand(size, N), axis=1)
+    active = ranks < n_active[:, None]
+
+    # Dirichlet exposures over the active signatures
+    exposures = random_state.gamma(concentration, size=(size, N)) * active
+    exposures /= exposures.sum(axis=1, keepdims=True)
+    exposures = exposures.T
+
+    probabilities = np.dot(P, exposures)
+    probabilities /= probabilities.sum(axis=0)
+
+    # Multinomial counts as a chain of binomials, vectorized over the samples
+    counts = multinomial_chain(probabilities, draw_mutation_counts(random_state, size, mutation_counts), random_state)
+
+    return exposures, counts
+
+
+def synthetic_blocks(n_samples, signatures=3.4, seed=0, mutation_counts=(2000, 1.0), sparsity=0.9,
+                     concentration=1.0):
+    """
+    Generate a synthetic cohort block by block.
+
+    Yields (start, exposures, counts) for consecutive blocks of at most BLOCK_SIZE samples, where 'exposures' is the
+    N x B matrix of ground-truth exposures and 'counts' the 96 x B matrix of mutation counts. See 'generate_cohort'
+    for the parameters.
+    """
+    # Imported here, since the utilities are below the model selection
+    from sigconfide.modelselection.analyzer import load_catalog
+
+    if not 0 <= sparsity < 1:
+        raise ValueError("Parameter 'sparsity' must be in the range [0, 1).")
+    P, _ = load_catalog(signatures)
+    for block_index, start in enumerate(range(0, n_samples, BLOCK_SIZE)):
+        size = min(BLOCK_SIZE, n_samples - start)
+        exposures, counts = draw_block(P, seed, block_index, size, mutation_counts, sparsity, concentration)
+        yield start, exposures, counts
+
+
+def generate_cohort(n_samples, signatures=3.4, seed=0, mutation_counts=(2000, 1.0), sparsity=0.9,
+                    concentration=1.0):
+    """
+    Generate a synthetic cohort of mutation profiles with known signature exposures.
+
+    For every sample, a random subset of signatures is active, their exposures are drawn from a Dirichlet
+    distribution and the mutation profile is drawn from the multinomial distribution of the mixed signatures.
+    The cohort is fully determined by the seed and the parameters.
+
+    :param n_samples: The number of samples (cohort size, up to 1e6 and more).
+    :type n_samples: int
+    :param signatures: A COSMIC version from 'versions' or the path to a signatures file. Defaults to 3.4.
+    :type signatures: float or str, optional
+    :param seed: The seed of the cohort. Defaults to 0.
+    :type seed: int, optional
+    :param mutation_counts: The number of mutations per sample: an int, a (median, sigma) tuple of a log-normal
+        distribution, or a function of (random_state, size). Defaults to (2000, 1.0).
+    :type mutation_counts: int, tuple or function, optional
+    :param sparsity: The expected fraction of inactive signatures per sample, in [0, 1). At least one signature is
+        always active. Defaults to 0.9.
+    :type sparsity: float, optional
+    :param concentration: The concentration of the Dirichlet distribution of the exposures. Defaults to 1.0.
+    :type concentration: float, optional
+
+    :returns: A tuple (counts, exposures, names): the 96 x G matrix of mutation counts, the N x G matrix of
+        ground-truth exposures and the names of the samples.
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+
+    Examples:
+        counts, exposures, names = generate_cohort(1000, signatures=3.4, seed=1, mutation_counts=(500, 1.5))
+    """
+    blocks = list(synthetic_blocks(n_samples, signatures, seed, mutation_counts, sparsity, concentration))
+    counts = np.hstack([block[2] for block in blocks])
+    exposures = np.hstack([block[1] for block in blocks])
+    names = np.array([f"S{i}" for i in range(n_samples)])
+    return counts, exposures, names
+
+
+def write_cohort(output, n_samples, format='txt', signatures=3.4, seed=0, mutation_counts=(2000, 1.0),
+                 sparsity=0.9, concentration=1.0, chunk_size=100000):
+    """
+    Generate a synthetic cohort (see 'generate_cohort') and write it to disk.
+
+    Formats:
+    - 'txt': a tab-separated samples file readable by 'load_samples_file' and 'fit' (mutation types as rows,
+      samples as columns); the ground-truth exposures are saved next to it as "<name>.exposures.npy".
+    - 'npy': "<output>" holds the 96 x G int32 counts and "<name>.exposures.npy" the N x G float32 exposures,
+      both written block by block through memory maps.
+    - 'chunked': the folder "<output>" holds "counts_XXXXX.npy" and "exposures_XXXXX.npy" with at most
+      'chunk_size' samples each, and "index.json" describing the chunks and the generation parameters.
+
+    Only 'txt' keeps the whole count matrix in memory; 'npy' and 'chunked' use memory bounded by the block size
+    and 'chunk_size'.
+
+    :param output: The path of the file (txt, npy) or of the folder (chunked).
+    :type output: str
+    :param n_samples: The number of samples.
+    :type n_samples: int
+    :param format: One of 'txt', 'npy' or 'chunked'. Defaults to 'txt'.
+    :type format: str, optional
+    :param chunk_size: The number of samples per chunk of the 'chunked' format. Defaults to 100000.
+    :type chunk_size: int, optional
+
+    The remaining parameters are the same as in 'generate_cohort'.
+
+    :raises ValueError: If the format is unknown.
+
+    :returns: The path of the written cohort.
+    :rtype: str
+
+    Examples:
+        write_cohort('data/synthetic.txt', 1000, signatures=2.0, seed=7)
+        write_cohort('data/synthetic', 1000000, format='chunked', chunk_size=50000, seed=7)
+    """
+    # Imported here, since the utilities are below the model selection
+    from sigconfide.modelselection.analyzer import load_catalog, versions
+
+    if format not in ('txt', 'npy', 'chunked'):
+        raise ValueError("Parameter 'format' must be one of 'txt', 'npy' or 'chunked'.")
+
+    P, _ = load_catalog(signatures)
+    K, N = P.shape
+    blocks = synthetic_blocks(n_samples, signatures, seed, mutation_counts, sparsity, concentration)
+    base = os.path.splitext(output)[0]
+
+    if format == 'txt':
+        counts, exposures, names = generate_cohort(n_samples, signatures, seed, mutation_counts, sparsity,
+                                                   concentration)
+        catalog_file = versions[signatures] if isinstance(signatures, (int, float)) else signatures
+        mutation_types = load_mutation_types(catalog_file)
+        with open(output, 'w') as file:
+            file.write('\t'.join(['Type'] + list(names)) + '\n')
+            for mutation_type, row in zip(mutation_types, counts):
+                file.write(mutation_type + '\t' + '\t'.join(map(str, row)) + '\n')
+        np.save(base + '.exposures.npy', exposures.astype(np.float32))
+        return output
+
+    if format == 'npy':
+        counts_file = np.lib.format.open_memmap(output, mode='w+', dtype=np.int32, shape=(K, n_samples))
+        exposures_file = np.lib.format.open_memmap(base + '.exposures.npy', mode='w+', dtype=np.float32,
+                                                   shape=(N, n_samples))
+        for start, exposures, counts in blocks:
+            counts_file[:, start:start + counts.shape[1]] = counts
+            exposures_file[:, start:start + exposures.shape[1]] = exposures
+        counts_file.flush()
+        exposures_file.flush()
+        del counts_file, exposures_file
+        return output
+
+    utils.create_folder_if_not_exists(output)
+    chunks = []
+    buffered = []
+
+    def flush_chunk(buffered):
+        index = len(chunks)
+        counts = np.hstack([block[2] for block in buffered]).astype(np.int32)
+        exposures = np.hstack([block[1] for block in buffered]).astype(np.float32)
+        np.save(os.path.join(output, f"counts_{index:05d}.npy"), counts)
+        np.save(os.path.join(output, f"exposures_{index:05d}.npy"), exposures)
+        chunks.append({'start': buffered[0][0], 'size': counts.shape[1],
+                       'counts': f"counts_{index:05d}.npy", 'exposures': f"exposures_{index:05d}.npy"})
+
+    for start, exposures, counts in blocks:
+        # Blocks are split at chunk boundaries
+        offset = 0
+        while offset < counts.shape[1]:
+            filled = sum(block[2].shape[1] for block in buffered)
+            take = min(chunk_size - filled, counts.shape[1] - offset)
+            buffered.append((start + offset, exposures[:, offset:offset + take], counts[:, offset:offset + take]))
+            offset += take
+            if filled + take == chunk_size:
+                flush_chunk(buffered)
+                buffered = []
+    if buffered:
+        flush_chunk(buffered)
+
+    index = {
+        'n_samples': n_samples,
+        'signatures': signatures,
+        'seed': seed,
+        'mutation_counts': mutation_counts if not callable(mutation_counts) else None,
+        'sparsity': sparsity,
+        'concentration': concentration,
+        'chunks': chunks,
+    }
+    with open(os.path.join(output, 'index.json'), 'w') as file:
+        json.dump(index, file, indent=2)
+    return output
@@ -1,4 +1,8 @@
 import numpy as np
+import bz2
+import gzip
+import hashlib
+import json
 import os
 
 def FrobeniusNorm(M, P, E):
@@ -8,6 +12,29 @@ def FrobeniusNorm(M, P, E):
 def is_wholenumber(x, tol=1e-15):
     return np.abs(x - np.round(x)) < tol
 
+
+def multinomial_chain(probabilities, totals, random_state=np.random):
+    """
+    Draw multinomial counts for every column of 'probabilities' (K, G) as a chain of binomials, one call per row.
+
+    Row k gets a binomial of the mutations left over the probability left, and the last row gets the mutations left,
+    so the counts always sum to 'totals'. 'totals' has a shape of (G,) or (G, R) for R draws of every column.
+
+    :returns: The counts with a shape of (K,) + totals.shape.
+    :rtype: numpy.ndarray
+    """
+    K, G = probabilities.shape
+    left = np.array(totals, dtype=np.int64)
+    remaining = np.ones(G)
+    counts = np.empty((K,) + left.shape, dtype=np.int64)
+    for k in range(K - 1):
+        p = np.clip(probabilities[k] / np.maximum(remaining, 1e-300), 0, 1)
+        counts[k] = random_state.binomial(left, p.reshape(p.shape + (1,) * (left.ndim - 1)))
+        left -= counts[k]
+        remaining -= probabilities[k]
+    counts[K - 1] = left
+    return counts
+
 def detect_format(line):
     # Check if the line contains tabs - this suggests TSV format
     if '\t' in line:
@@ -25,11 +52,48 @@ def detect_format(line):
     # If none of the above were detected, return an unknown value
     return 'Unknown Format', None
 
-def load_samples_file(file_name):
-    with open(file_name, 'r') as file:
+def open_text(file_name):
+    """Open a text file for reading, decompressing '.gz' and '.bz2' files."""
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt')
+    if file_name.endswith('.bz2'):
+        return bz2.open(file_name, 'rt')
+    return open(file_name, 'r')
+
+def read_samples_header(file_name):
+    with open_text(file_name) as file:
+        head = file.readline() + file.readline()
+    format, sep = detect_format(head.strip())
+    if format == 'Unknown Format':
+        raise ValueError('Unknown Format')
+
+    header = np.array(head.splitlines()[0].rstrip('\n').split(sep))
+    offset = 1 if format in ('TSV Format', 'Mutated TSV Format') else 2
+
+    return format, sep, offset, header[offset:]
+
+def load_samples_file(file_name, columns=None):
+    if columns is not None:
+        # Parse only the requested sample columns: each line is split no further than the last of them and the
+        # other fields are never converted
+        format, sep, offset, patients_names = read_samples_header(file_name)
+        columns = np.arange(len(patients_names))[columns]
+        fields = offset + columns
+        last = int(fields.max()) + 1 if len(fields) else 0
+        rows = []
+        with open_text(file_name) as file:
+            file.readline()
+            for line in file:
+                if line.strip():
+                    values = line.rstrip('\r\n').split(sep, last)
+                    rows.append([values[field] for field in fields])
+        samples = np.array(rows, dtype=float).reshape(len(rows), len(columns))
+
+        return samples, patients_names[columns]
+
+    with open_text(file_name) as file:
         csv_line = ''.join(file.readlines()).strip()
         format, sep = detect_format(csv_line)
-        file.seek(0)
     if format == 'Unknown Format':
         raise ValueError('Unknown Format')
 
@@ -46,11 +110,31 @@ def load_samples_file(file_name):
 
     return samples, patients_names
 
+def load_mutation_types(file_name):
+    """
+    Read the mutation types (row labels) of a samples or signatures file, in the form "A[C>A]A".
+
+    Files with two label columns, such as "C>A,ACA", are converted to that form and quotes are removed.
+    """
+    with open_text(file_name) as file:
+        head = file.readline() + file.readline()
+    format, sep = detect_format(head.strip())
+    if format == 'Unknown Format':
+        raise ValueError('Unknown Format')
+    first_row = [field.strip().strip('"') for field in head.splitlines()[1].split(sep)]
+    two_columns = len(first_row) > 2 and '>' in first_row[0] and first_row[1].isalpha()
+
+    labels = np.genfromtxt(file_name, delimiter=sep, skip_header=1, usecols=(0, 1) if two_columns else (0,),
+                           dtype=str, comments=None)
+    labels = np.char.strip(np.char.strip(labels.reshape(len(labels), -1)), '"')
+    if two_columns:
+        return np.array([f"{context[0]}[{substitution}]{context[-1]}" for substitution, context in labels])
+    return labels[:, 0]
+
 def load_signatures_file(file_name):
-    with open(file_name, 'r') as file:
+    with open_text(file_name) as file:
         csv_line = ''.join(file.readlines()).strip()
         format, sep = detect_format(csv_line)
-        file.seek(0)
     signatures = np.genfromtxt(file_name, delimiter=sep, skip_header=1)
     names_signatures = np.genfromtxt(file_name, delimiter=sep, skip_header=0, max_rows=1, dtype=str)[1:]
     names_signatures = np.insert(names_signatures, 0, 'Samples', axis=0)
@@ -58,6 +142,125 @@ def load_signatures_file(file_name):
 
     return signatures, names_signatures
 
+def catalog_hash(signatures, names_signatures):
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(signatures, dtype=float).tobytes())
+    digest.update('\t'.join(str(name) for name in names_signatures).encode('utf-8'))
+    return digest.hexdigest()
+
+def save_activities_file(output, file_name, drop_zeros_columns=False):
+    if drop_zeros_columns:
+        is_non_zero_column = np.ones(output.shape[1], dtype=bool)
+        for col in range(1, output.shape[1]):
+            if np.all(output[1:, col].astype(np.float32) == 0.0):
+                is_non_zero_column[col] = False
+        output = output[:, is_non_zero_column]
+    np.savetxt(file_name, output, delimiter=',', fmt='%s')
+
+def load_activities_file(file_name):
+    output = np.genfromtxt(file_name, delimiter=',', dtype=str)
+    return output.reshape(-1, output.shape[-1])
+
+def activities_matrix(result):
+    """
+    Convert a result of 'fit_arrays' to the layout of "Assignment_Solution_Activities.csv".
+
+    The names of the signatures are the first row and the names of the samples the first column; the first cell of
+    a sample that could not be processed is left at zero, as in earlier versions.
+    """
+    output = np.zeros((result['exposures'].shape[0], result['exposures'].shape[1] + 1))
+    output[:, 1:] = result['exposures']
+    output = np.vstack([np.insert(result['signatures'], 0, 'Samples'), output])
+    processed = ~np.isnan(result['errors'])
+    output[1:, 0][processed] = result['samples'][processed]
+    return output
+
+def save_sparse_activities(result, file_name):
+    """
+    Save a result of 'fit_arrays' as a compressed sparse row (CSR) .npz file.
+
+    Row g of the exposure matrix holds the exposures 'data[indptr[g]:indptr[g + 1]]' of the signatures
+    'indices[indptr[g]:indptr[g + 1]]' selected for sample g. The file also holds the names of the samples and of the
+    signatures, the estimation errors (NaN for samples that failed) and the status of the samples.
+    """
+    rows, columns = np.nonzero(result['selected'])
+    indptr = np.zeros(result['selected'].shape[0] + 1, dtype=np.int64)
+    np.cumsum(result['selected'].sum(axis=1), out=indptr[1:])
+    np.savez(file_name, indptr=indptr, indices=columns.astype(np.int32), data=result['exposures'][rows, columns],
+             samples=np.asarray(result['samples'], dtype=str), signatures=np.asarray(result['signatures'], dtype=str),
+             errors=result['errors'], status=np.asarray(result['status'], dtype=str))
+
+def save_status_file(result, file_name):
+    """
+    Save the status of every sample of a result of 'fit_arrays' as a CSV file with the columns "Samples" and "Status".
+    """
+    output = np.column_stack([result['samples'], result['status']]).astype(str)
+    np.savetxt(file_name, np.vstack([['Samples', 'Status'], output]), delimiter=',', fmt='%s')
+
+def load_sparse_activities(file_name, dense=False):
+    """
+    Load a file written by 'save_sparse_activities'.
+
+    Returns a dictionary with the CSR arrays 'indptr', 'indices' and 'data' and the arrays 'samples', 'signatures',
+    'errors' and 'status' (files written before the status was saved have no 'status'). With dense=True, the dense 'exposures' and 'selected' matrices (G x N) are added, in the format
+    returned by 'fit_arrays'.
+    """
+    with np.load(file_name, allow_pickle=False) as file:
+        result = {key: file[key] for key in file.files}
+    if dense:
+        shape = (len(result['samples']), len(result['signatures']))
+        rows = np.repeat(np.arange(shape[0]), np.diff(result['indptr']))
+        result['exposures'] = np.zeros(shape)
+        result['exposures'][rows, result['indices']] = result['data']
+        result['selected'] = np.zeros(shape, dtype=bool)
+        result['selected'][rows, result['indices']] = True
+    return result
+
+def sparse_activities_to_csv(file_name, csv_file, drop_zeros_columns=False):
+    """
+    Convert a file written by 'save_sparse_activities' to the dense "Assignment_Solution_Activities.csv" layout.
+    """
+    save_activities_file(activities_matrix(load_sparse_activities(file_name, dense=True)), csv_file,
+                         drop_zeros_columns=drop_zeros_columns)
+
+def create_bootstrap_file(file_name, names_patients, names_signatures, R):
+    """
+    Preallocate a G x N x R float32 .npy file for the bootstrap exposures and write its index next to it.
+
+    'names_signatures' is the header of the activities matrix ('Samples' followed by the names of the signatures).
+    The index (same name with a .json extension) maps the names of samples and signatures to array coordinates.
+    """
+    names_signatures = list(names_signatures[1:])
+    shape = (len(names_patients), len(names_signatures), R)
+    array = np.lib.format.open_memmap(file_name, mode='w+', dtype=np.float32, shape=shape)
+    array.flush()
+    del array
+
+    index = {
+        'shape': list(shape),
+        'axes': ['sample', 'signature', 'replicate'],
+        'samples': {str(name): i for i, name in enumerate(names_patients)},
+        'signatures': {str(name): i for i, name in enumerate(names_signatures)},
+    }
+    with open(os.path.splitext(file_name)[0] + '.json', 'w') as file:
+        json.dump(index, file, indent=2)
+
+def write_bootstrap_slice(file_name, row, columns, exposures, start=0):
+    """
+    Write the exposures (len(columns) x replicates) of one sample into a file created by 'create_bootstrap_file'.
+
+    The file is opened as a memory map, so workers write their slices directly.
+    """
+    array = np.load(file_name, mmap_mode='r+')
+    array[row, columns, start:start + exposures.shape[1]] = exposures
+    array.flush()
+    del array
+
+def load_bootstrap_file(file_name):
+    with open(os.path.splitext(file_name)[0] + '.json', 'r') as file:
+        index = json.load(file)
+    return np.load(file_name, mmap_mode='r'), index
+
 def create_folder_if_not_exists(folder_path):
     try:
         os.makedirs(folder_path, exist_ok=True)
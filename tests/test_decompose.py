@@ -3,8 +3,21 @@ import unittest
 from scipy.optimize import minimize
 
 from sigconfide.decompose.qp import decomposeQP
+from sigconfide.decompose.kkt import KKTFastPath
+from sigconfide.decompose.warm import WarmStartQP
+from sigconfide.decompose.parallel import ParallelDecomposition
+from sigconfide.decompose.registry import get_backend, register_backend, calibrate, select_backend, \
+    resolve_backend, machine_key, shape_key, BACKENDS
+from sigconfide.estimates.bootstrap import bootstrapSigExposures
+from sigconfide.modelselection.backward import bootstraped_patient, backward_elimination
+from sigconfide.modelselection.hybrid import hybrid_selection
+from sigconfide.decompose.simplex import decomposeSimplex, simplex_lsq, decomposeSimplexBatch
+from sigconfide.decompose import simplex
+from sigconfide.estimates.standard import findSigExposures
 from sigconfide.utils.utils import FrobeniusNorm, load_samples_file, load_signatures_file
 import os
+import json
+import tempfile
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 def decomposeQPScipy(m, P):
@@ -63,5 +76,164 @@ class TestDecomposeQP(unittest.TestCase):
             np.testing.assert_array_almost_equal(exposuresFast, exposuresSlow, decimal=1)
 
 
+class TestDecomposeSimplex(unittest.TestCase):
+    def test_simplex_lsq_matches_decomposeQP(self):
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        signaturesCOSMIC, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        M = samples[:, :20] / samples[:, :20].sum(axis=0)
+
+        # Uncompiled kernel, so the test does not depend on numba
+        exposures = simplex_lsq(np.dot(signaturesCOSMIC.T, signaturesCOSMIC), np.dot(signaturesCOSMIC.T, M))
+        exposures[exposures < 0] = 0
+        exposures /= exposures.sum(axis=0)
+        expected = np.column_stack([decomposeQP(M[:, i], signaturesCOSMIC) for i in range(M.shape[1])])
+
+        np.testing.assert_array_almost_equal(exposures, expected, decimal=7)
+
+    def test_unsolved_columns_fall_back_to_decomposeQP(self):
+        # The KKT system of the free signatures of a rank-one G is singular
+        b = np.array([1.0, -4.0, 3.0])
+        exposures = simplex_lsq(np.outer(b, b), np.array([[0.3, 0.8, 0.3], [1.0, -4.0, 3.0]]).T)
+        self.assertTrue(np.all(np.isnan(exposures[:, 0])))
+        self.assertFalse(np.any(np.isnan(exposures[:, 1])))
+
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        signaturesCOSMIC, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        M = samples[:, :5] / samples[:, :5].sum(axis=0)
+        kernel = simplex._simplex_lsq
+        # Columns that do not converge within one active-set change are solved by decomposeQP
+        simplex._simplex_lsq = lambda G, D: simplex_lsq(G, D, max_iter=1)
+        try:
+            exposures = decomposeSimplexBatch(M, signaturesCOSMIC)
+        finally:
+            simplex._simplex_lsq = kernel
+        expected = np.column_stack([decomposeQP(M[:, i], signaturesCOSMIC) for i in range(M.shape[1])])
+        np.testing.assert_array_almost_equal(exposures, expected, decimal=7)
+
+    def test_decomposeSimplex_as_decomposition_method(self):
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        signaturesCOSMIC, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+
+        exposures, errors = findSigExposures(samples, signaturesCOSMIC, decomposition_method=decomposeSimplex)
+        expected_exposures, expected_errors = findSigExposures(samples, signaturesCOSMIC)
+
+        np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
+        np.testing.assert_array_almost_equal(errors, expected_errors, decimal=7)
+        np.testing.assert_array_almost_equal(decomposeSimplex(samples[:, 0], signaturesCOSMIC),
+                                             decomposeQP(samples[:, 0], signaturesCOSMIC), decimal=7)
+
+
+class TestKKTFastPath(unittest.TestCase):
+    def test_fast_path_matches_decomposeQP(self):
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        signaturesCOSMIC, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        sigsBRCA = [0, 1, 2, 4, 5, 7, 12, 16, 17, 19, 25, 29]
+        decomposeKKT = KKTFastPath()
+
+        for P in (signaturesCOSMIC, signaturesCOSMIC[:, sigsBRCA], signaturesCOSMIC[:, [0, 2, 12]]):
+            exposures, errors = findSigExposures(samples, P, decomposition_method=decomposeKKT)
+            expected_exposures, expected_errors = findSigExposures(samples, P)
+
+            np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
+            np.testing.assert_array_almost_equal(errors, expected_errors, decimal=7)
+
+        self.assertEqual(decomposeKKT.columns, 3 * samples.shape[1])
+        self.assertGreater(decomposeKKT.hits, 0)
+        self.assertAlmostEqual(decomposeKKT.hit_rate, decomposeKKT.hits / decomposeKKT.columns)
+
+
+
+class TestWarmStartQP(unittest.TestCase):
+    def setUp(self):
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        self.signaturesCOSMIC, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        self.patient = samples[:, 0]
+
+    def test_warm_start_matches_decomposeQP(self):
+        np.random.seed(0)
+        M = bootstraped_patient(self.patient, 2000, 100)
+        decomposeWarm = WarmStartQP()
+
+        for P in (self.signaturesCOSMIC, self.signaturesCOSMIC[:, [0, 1, 2, 4, 5, 7, 12, 16]]):
+            decomposeWarm.warm_start(self.patient, P)
+            exposures, errors = findSigExposures(M, P, decomposition_method=decomposeWarm)
+            expected_exposures, expected_errors = findSigExposures(M, P)
+
+            np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
+            np.testing.assert_array_almost_equal(errors, expected_errors, decimal=7)
+
+        self.assertEqual(decomposeWarm.columns, 200)
+        self.assertGreater(decomposeWarm.hits, 0)
+
+    def test_warm_start_in_bootstrap_and_backward_elimination(self):
+        decomposeWarm = WarmStartQP()
+        for decomposition_method in (decomposeQP, decomposeWarm):
+            np.random.seed(1)
+            exposures, errors = bootstrapSigExposures(self.patient, self.signaturesCOSMIC, 20, 2000,
+                                                      decomposition_method=decomposition_method)
+            np.random.seed(1)
+            selection = backward_elimination(self.patient, self.signaturesCOSMIC, 20, 0.01, 2000, 0.01,
+                                             decomposition_method=decomposition_method)
+            if decomposition_method is decomposeQP:
+                expected_exposures, expected_selection = exposures, selection
+
+        np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
+        np.testing.assert_array_equal(selection[0], expected_selection[0])
+        self.assertGreater(decomposeWarm.hits, 0)
+
+
+class TestParallelDecomposition(unittest.TestCase):
+    def test_parallel_selection_matches_serial(self):
+        samples, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        P, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        np.random.seed(2)
+        M = bootstraped_patient(samples[:, 0], 2000, 100)
+
+        for decomposition_method in (decomposeQP, WarmStartQP()):
+            expected = hybrid_selection(samples[:, 0], P, 100, 0.01, 2000, 0.01, replicates=M, solve_cache={},
+                                        decomposition_method=decomposition_method)
+            with ParallelDecomposition(decomposition_method, n_jobs=2, min_columns=16) as decomposeParallel:
+                exposures = decomposeParallel.batch(M / M.sum(axis=0), P)
+                selection = hybrid_selection(samples[:, 0], P, 100, 0.01, 2000, 0.01, replicates=M,
+                                             solve_cache={}, decomposition_method=decomposeParallel)
+            np.testing.assert_array_equal(exposures, findSigExposures(M, P, decomposition_method)[0])
+            np.testing.assert_array_equal(selection[0], expected[0])
+            np.testing.assert_array_equal(selection[1][0], expected[1][0])
+
+
+
+class TestBackendRegistry(unittest.TestCase):
+    def test_backends_are_looked_up_by_name(self):
+        self.assertIs(get_backend('qp'), decomposeQP)
+        self.assertIs(get_backend('simplex'), decomposeSimplex)
+        self.assertIs(resolve_backend(decomposeQP, 96, 30, 100), decomposeQP)
+        with self.assertRaises(ValueError):
+            get_backend('cplex')
+
+        register_backend('scipy', __name__, 'decomposeQPScipy')
+        try:
+            self.assertIs(get_backend('scipy'), decomposeQPScipy)
+        finally:
+            del BACKENDS['scipy']
+
+    def test_calibration_picks_a_correct_backend(self):
+        name, timings = calibrate(96, 12, 32, backends=['qp', 'kkt'], repeats=1)
+        self.assertIn(name, ('qp', 'kkt'))
+        self.assertTrue(all(seconds is not None for seconds in timings.values()))
+
+    def test_selection_is_cached_per_machine_and_shape(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache_file = os.path.join(folder, 'backends.json')
+            name = select_backend(96, 12, 100, cache_file=cache_file)
+            with open(cache_file) as file:
+                self.assertEqual(json.load(file)[machine_key()][shape_key(96, 12, 100)], name)
+
+            # A cached choice is used without calibrating again
+            with open(cache_file, 'w') as file:
+                json.dump({machine_key(): {shape_key(96, 12, 100): 'kkt'}}, file)
+            self.assertEqual(select_backend(96, 12, 120, cache_file=cache_file), 'kkt')
+            self.assertIs(resolve_backend('auto', 96, 12, 100, cache_file=cache_file), get_backend('kkt'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,8 @@
 import unittest
-from sigconfide.estimates.bootstrap import bootstrapSigExposures
+from sigconfide.estimates.bootstrap import bootstrapSigExposures, bootstrapCohortExposures, bootstrap_cohort
 from sigconfide.estimates.crossvalidation import crossValidationSigExposures
-from sigconfide.estimates.standard import findSigExposures
-from sigconfide.utils.utils import load_samples_file, load_signatures_file
+from sigconfide.estimates.standard import findSigExposures, decompose_columns
+from sigconfide.utils.utils import load_samples_file, load_signatures_file, FrobeniusNorm
 import numpy as np
 import os
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -26,6 +26,20 @@ class TestEstimateExposures(unittest.TestCase):
         np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
         np.testing.assert_array_almost_equal(errors, expected_errors, decimal=7)
 
+    def test_decompose_columns_with_any_residual_buffer(self):
+        M = np.array([[0.5, 0.3, 0.2], [0.9, 0.05, 0.05], [0.7, 0.1, 0.2]]).T
+        P = np.array([[0.2, 0.3, 0.5], [0.1, 0.4, 0.5], [0.3, 0.1, 0.6]]).T
+        expected_exposures, expected_errors = findSigExposures(M, P)
+        expected = [FrobeniusNorm(M[:, i], P, expected_exposures[:, i]) for i in range(3)]
+
+        np.testing.assert_allclose(expected_errors, expected, rtol=1e-14)
+        for residuals in (np.empty((3, 3)), np.empty((3, 3), order='F'), np.empty((3, 3), dtype=np.float32),
+                          np.empty((3, 6))[:, ::2]):
+            exposures, errors = decompose_columns(M / M.sum(axis=0), P, residuals=residuals)
+            np.testing.assert_array_equal(errors, expected_errors)
+        exposures, errors = findSigExposures(M.astype(np.float32), P.astype(np.float32))
+        np.testing.assert_allclose(errors, expected_errors, rtol=1e-5)
+
     def test_findSigExposuresReal(self):
         profile, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
         signatures, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
@@ -55,6 +69,44 @@ class TestBootstrapSigExposures(unittest.TestCase):
 
         np.testing.assert_array_almost_equal(exposures, expected_exposures, decimal=7)
 
+    def test_bootstrap_cohort(self):
+        profile, names = load_samples_file(os.path.join(current_dir, 'data', 'tumorBRCA.txt'))
+        signatures, names_signatures = load_signatures_file(os.path.join(current_dir, 'data', 'COSMIC_v2_SBS_GRCh37.txt'))
+        profile = profile[:, :5]
+        mutation_counts = np.array([100, 500, 1000, 2000, 50])
+
+        replicates = bootstrap_cohort(profile / profile.sum(axis=0), mutation_counts, 20)
+        self.assertEqual(replicates.shape, (96, 5, 20))
+        np.testing.assert_array_almost_equal(replicates.sum(axis=0), np.ones((5, 20)))
+        counts = replicates * mutation_counts[:, None]
+        np.testing.assert_array_almost_equal(counts, np.round(counts))
+        # The mutations left by the binomials of the other types go to the last one, even when a column sums to less than 1
+        counts = bootstrap_cohort(profile / profile.sum(axis=0) * 0.99, mutation_counts, 20) * \
+            mutation_counts[:, None]
+        np.testing.assert_array_equal(np.round(counts).sum(axis=0), np.repeat(mutation_counts[:, None], 20, axis=1))
+
+        np.random.seed(3)
+        exposures, errors = bootstrapCohortExposures(profile, signatures, 20, mutation_counts, batch_size=40)
+        self.assertEqual(exposures.shape, (5, 30, 20))
+        self.assertEqual(errors.shape, (5, 20))
+        np.testing.assert_array_almost_equal(exposures.sum(axis=1), np.ones((5, 20)))
+        # The same replicates give the same exposures as 'findSigExposures'
+        np.random.seed(3)
+        probabilities = profile / profile.sum(axis=0)
+        # With batch_size=40, the replicates of two samples are drawn per batch
+        replicates = np.concatenate([bootstrap_cohort(probabilities[:, start:start + 2], mutation_counts[start:start + 2], 20)
+                                     for start in (0, 2, 4)], axis=1)
+        expected, _ = findSigExposures(replicates[:, 1], signatures)
+        np.testing.assert_array_almost_equal(exposures[1], expected)
+
+        np.random.seed(3)
+        summary = bootstrapCohortExposures(profile, signatures, 20, mutation_counts, batch_size=40, summary=True)
+        np.testing.assert_array_almost_equal(summary['mean'], exposures.mean(axis=2))
+        np.testing.assert_array_almost_equal(summary['upper'], np.quantile(exposures, 0.975, axis=2))
+        np.testing.assert_array_almost_equal(summary['error'], errors.mean(axis=1))
+        with self.assertRaises(ValueError):
+            bootstrapCohortExposures(profile, signatures, 20)
+
 
 class TestCrossValidationSigExposures(unittest.TestCase):
 
@@ -1,10 +1,31 @@
-from sigconfide.modelselection.analyzer import fit
+from sigconfide.modelselection.analyzer import fit, fit_arrays, load_catalog, activities_matrix, catalog_file, \
+    process_sample
+from sigconfide.modelselection.scheduler import CostModel, run_scheduled, sample_features
+from sigconfide.modelselection.shards import fit_shard, merge_shards
+from sigconfide.modelselection.sweep import sweep
+from sigconfide.modelselection.refit import refit, refit_arrays, load_selection
+from sigconfide.modelselection.streaming import fit_stream
+from sigconfide.utils.utils import load_activities_file, load_bootstrap_file, load_samples_file, \
+    load_sparse_activities, sparse_activities_to_csv, load_mutation_types, save_activities_file, save_sparse_activities
+from sigconfide.utils.inputs import align_mutation_types
+
+import numpy as np
+import gzip
+import json
+import asyncio
+import concurrent.futures
 
 import unittest
 import os
 import shutil
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
+def exit_on_negative(task):
+    # A worker killed while running a task, e.g. for lack of memory
+    if task < 0:
+        os._exit(3)
+    return task
+
 def remove_folder(folder_path):
     try:
         shutil.rmtree(folder_path)
@@ -37,3 +58,470 @@ class TestCosmicFit(unittest.TestCase):
 
         self.assertTrue(os.path.exists(expected_output_path), "The CSV file was not generated.")
         remove_folder(output_dir)
+
+    def test_fit_several_catalogs_matches_separate_fits(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        breast_signatures = os.path.join(current_dir, 'data', 'Breast_Signatures.csv')
+        fit(samples_file, 'output_catalogs', signatures=[2.0, breast_signatures], R=10, seed=3)
+
+        for signatures, label in ((2.0, 'COSMIC_v2.0'), (breast_signatures, 'Breast_Signatures')):
+            fit(samples_file, 'output_catalog', signatures=signatures, R=10, seed=3)
+            expected = load_activities_file(os.path.join('output_catalog', 'Assignment_Solution_Activities.csv'))
+            actual = load_activities_file(os.path.join('output_catalogs', label, 'Assignment_Solution_Activities.csv'))
+            np.testing.assert_array_equal(actual, expected)
+        remove_folder('output_catalogs')
+        remove_folder('output_catalog')
+
+    def test_fit_arrays_matches_fit(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        samples, names_patients = load_samples_file(samples_file)
+        # The rows of the catalog are reordered to the mutation types of the samples file, as in 'fit'
+        sigs, names_signatures = load_catalog(2.0)
+        sigs = align_mutation_types(sigs, load_mutation_types(catalog_file(2.0)), load_mutation_types(samples_file),
+                                    catalog_file(2.0))
+        fit(samples_file, 'output_arrays', signatures=2.0, R=10, seed=4)
+        result = fit_arrays(samples, signatures=sigs, names_patients=names_patients,
+                            names_signatures=names_signatures[1:], R=10, seed=4)
+
+        expected = load_activities_file(os.path.join('output_arrays', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(activities_matrix(result), expected)
+        np.testing.assert_array_equal(result['signatures'], names_signatures[1:])
+        np.testing.assert_array_equal(result['selected'], result['exposures'] > 0)
+        self.assertTrue(np.all(np.isnan(result['p_values'][~result['selected']])))
+        self.assertTrue(np.all((result['p_values'][result['selected']] >= 0)))
+        self.assertTrue(np.all(result['errors'] >= 0))
+        remove_folder('output_arrays')
+
+        with self.assertRaises(ValueError):
+            fit_arrays(samples, signatures=sigs, names_signatures=['Signature_1'])
+
+    def test_process_sample_matches_fit_arrays(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'reduced_data.dat'))
+        sigs, _ = load_catalog(2.0)
+        result = fit_arrays(samples, signatures=sigs, R=20, seed=1)
+
+        i, best_columns, (exposures, errors) = process_sample((0, samples[:, 0], sigs, 0.01, None, 20, 0.01, 1))
+        self.assertEqual(i, 0)
+        np.testing.assert_array_equal(np.sort(best_columns), np.flatnonzero(result['selected'][0]))
+        np.testing.assert_array_equal(np.ravel(exposures), result['exposures'][0, best_columns])
+        # The original arguments, without a seed
+        i, best_columns, estimation_exposures = process_sample((0, samples[:, 0], sigs, 0.01, None, 20, 0.01))
+        self.assertIsNotNone(best_columns)
+
+    def test_sparse_output_converts_to_csv(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit(samples_file, 'output_dense', signatures=2.0, R=10, seed=6, drop_zeros_columns=True)
+        fit(samples_file, 'output_sparse', signatures=2.0, R=10, seed=6, output_format='sparse')
+        sparse_file = os.path.join('output_sparse', 'Assignment_Solution_Activities.npz')
+        self.assertFalse(os.path.exists(os.path.join('output_sparse', 'Assignment_Solution_Activities.csv')))
+
+        result = load_sparse_activities(sparse_file)
+        self.assertEqual(result['indptr'].shape, (4,))
+        self.assertEqual(len(result['indices']), result['indptr'][-1])
+        self.assertEqual(len(result['data']), result['indptr'][-1])
+        self.assertEqual(len(result['signatures']), 30)
+
+        sparse_activities_to_csv(sparse_file, os.path.join('output_sparse', 'converted.csv'), drop_zeros_columns=True)
+        expected = load_activities_file(os.path.join('output_dense', 'Assignment_Solution_Activities.csv'))
+        actual = load_activities_file(os.path.join('output_sparse', 'converted.csv'))
+        np.testing.assert_array_equal(actual, expected)
+        remove_folder('output_dense')
+        remove_folder('output_sparse')
+
+    def test_budget_flags_degraded_samples(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        samples, names = load_samples_file(samples_file)
+        result = fit_arrays(samples, 2.0, names_patients=names, R=10, seed=3)
+        self.assertEqual(list(result['status']), ['ok'] * len(names))
+
+        degraded = fit_arrays(samples, 2.0, names_patients=names, R=10, seed=3, work_budget=10,
+                              degrade='current_model')
+        self.assertEqual(list(degraded['status']), ['current_model'] * len(names))
+        self.assertTrue(np.all(np.isnan(degraded['p_values'])))
+
+        fit(samples_file, 'output_budget', signatures=2.0, R=10, seed=3, work_budget=10)
+        status = load_activities_file(os.path.join('output_budget', 'Assignment_Solution_Status.csv'))
+        np.testing.assert_array_equal(status[0], ['Samples', 'Status'])
+        np.testing.assert_array_equal(status[1:, 0], names)
+        self.assertTrue(np.all(np.isin(status[1:, 1], ['reduced_R', 'current_model'])))
+        remove_folder('output_budget')
+
+    def test_refit_reproduces_fit_exposures(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit(samples_file, 'output_fit', signatures=2.0, R=10, seed=4, drop_zeros_columns=True)
+        output_file = refit(samples_file, os.path.join('output_fit', 'Assignment_Solution_Activities.csv'),
+                            'output_refit', signatures=2.0, drop_zeros_columns=True)
+
+        expected = load_activities_file(os.path.join('output_fit', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(load_activities_file(output_file), expected)
+        remove_folder('output_fit')
+        remove_folder('output_refit')
+
+        samples, names = load_samples_file(samples_file)
+        result = fit_arrays(samples, 2.0, names_patients=names, R=10, seed=4)
+        refitted = refit_arrays(samples * 3, result, 2.0, names_patients=names)
+        np.testing.assert_allclose(refitted['exposures'], result['exposures'], atol=1e-8)
+        np.testing.assert_array_equal(refitted['selected'], result['selected'])
+        with self.assertRaises(ValueError):
+            refit_arrays(samples, result['selected'][:, 1:], 2.0)
+
+    def test_load_selection_reads_zero_exposures_only_from_npz(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        samples, names = load_samples_file(samples_file)
+        sigs, names_signatures = load_catalog(2.0)
+        result = fit_arrays(samples, 2.0, names_patients=names, R=10, seed=4)
+        # A selected signature whose exposure is exactly 0
+        column = np.flatnonzero(result['selected'][0])[0]
+        result['exposures'][0, column] = 0
+        os.makedirs('output_selection', exist_ok=True)
+        csv_file = os.path.join('output_selection', 'Assignment_Solution_Activities.csv')
+        npz_file = os.path.join('output_selection', 'Assignment_Solution_Activities.npz')
+        save_activities_file(activities_matrix(result), csv_file)
+        save_sparse_activities(result, npz_file)
+
+        from_csv = load_selection(csv_file, names, names_signatures)
+        from_npz = load_selection(npz_file, names, names_signatures)
+        remove_folder('output_selection')
+
+        np.testing.assert_array_equal(from_npz, result['selected'])
+        self.assertFalse(from_csv[0, column])
+        from_csv[0, column] = True
+        np.testing.assert_array_equal(from_csv, result['selected'])
+
+    def test_fit_manifest_of_compressed_files_matches_single_file(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        with open(samples_file) as file:
+            lines = [line.rstrip('\n').split(',') for line in file]
+        os.makedirs('sample_files', exist_ok=True)
+        # The cohort split into two gzipped files, the second one with the rows in reverse order
+        parts = (('part_0.csv.gz', [0, 1, 2], lines), ('part_1.csv.gz', [0, 1, 3, 4], lines[:1] + lines[:0:-1]))
+        for name, columns, rows in parts:
+            with gzip.open(os.path.join('sample_files', name), 'wt') as file:
+                file.writelines(','.join(line[c] for c in columns) + '\n' for line in rows)
+        with open(os.path.join('sample_files', 'cohort.manifest'), 'w') as file:
+            file.write('part_0.csv.gz\npart_1.csv.gz\n')
+
+        fit(samples_file, 'output_single', signatures=2.0, R=10, seed=5)
+        fit(os.path.join('sample_files', 'cohort.manifest'), 'output_manifest', signatures=2.0, R=10, seed=5,
+            n_jobs=2)
+        fit(os.path.join('sample_files', 'part_*.csv.gz'), 'output_glob', signatures=2.0, R=10, seed=5)
+        expected = load_activities_file(os.path.join('output_single', 'Assignment_Solution_Activities.csv'))
+        for output_folder in ('output_manifest', 'output_glob'):
+            actual = load_activities_file(os.path.join(output_folder, 'Assignment_Solution_Activities.csv'))
+            np.testing.assert_array_equal(actual, expected)
+            remove_folder(output_folder)
+        remove_folder('output_single')
+        remove_folder('sample_files')
+
+    def test_memory_budget_does_not_change_results(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit(samples_file, 'output_unbudgeted', signatures=2.0, R=10, seed=8)
+        fit(samples_file, 'output_budgeted', signatures=2.0, R=10, seed=8, n_jobs=2, max_memory='64G')
+        expected = load_activities_file(os.path.join('output_unbudgeted', 'Assignment_Solution_Activities.csv'))
+        actual = load_activities_file(os.path.join('output_budgeted', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(actual, expected)
+        remove_folder('output_unbudgeted')
+        remove_folder('output_budgeted')
+        with self.assertRaises(ValueError):
+            fit(samples_file, 'output_budgeted', signatures=2.0, R=10, max_memory='1M')
+        remove_folder('output_budgeted')
+
+        samples, names_patients = load_samples_file(samples_file)
+        whole = fit_arrays(samples, 2.0, R=10, seed=8)
+        for n_jobs, schedule in ((1, 'cost'), (2, 'fifo'), (2, 'cost')):
+            chunked = fit_arrays(samples, 2.0, R=10, seed=8, n_jobs=n_jobs, schedule=schedule, sample_chunk=2)
+            np.testing.assert_array_equal(chunked['exposures'], whole['exposures'])
+
+    def test_replicate_jobs_do_not_change_results(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'reduced_data.dat'))
+        expected = fit_arrays(samples, 2.0, R=160, seed=9)
+        result = fit_arrays(samples, 2.0, R=160, seed=9, replicate_jobs=2)
+        np.testing.assert_array_equal(result['exposures'], expected['exposures'])
+        np.testing.assert_array_equal(result['p_values'], expected['p_values'])
+
+    def test_backends_give_the_same_selection(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'reduced_data.dat'))
+        expected = fit_arrays(samples, 2.0, R=20, seed=6)
+        for backend in ('kkt', 'simplex'):
+            result = fit_arrays(samples, 2.0, R=20, seed=6, backend=backend)
+            np.testing.assert_array_equal(result['selected'], expected['selected'])
+            np.testing.assert_array_almost_equal(result['exposures'], expected['exposures'])
+        with self.assertRaises(ValueError):
+            fit_arrays(samples, 2.0, R=20, backend='cplex')
+
+    def test_fast_path_counters_are_collected_from_workers(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'reduced_data.dat'))
+        expected = fit_arrays(samples, 2.0, R=160, seed=6, backend='kkt')
+        self.assertTrue(np.all(expected['fast_path_columns'] > 0))
+        self.assertTrue(np.all(expected['fast_path_hits'] <= expected['fast_path_columns']))
+        for options in (dict(n_jobs=2), dict(replicate_jobs=2)):
+            result = fit_arrays(samples, 2.0, R=160, seed=6, backend='kkt', **options)
+            np.testing.assert_array_equal(result['fast_path_columns'], expected['fast_path_columns'])
+            np.testing.assert_array_equal(result['fast_path_hits'], expected['fast_path_hits'])
+        self.assertFalse(np.any(fit_arrays(samples, 2.0, R=20, seed=6)['fast_path_columns']))
+
+    def test_fit_with_signature_clusters(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'reduced_data.dat'))
+        result = fit_arrays(samples, 3.4, R=20, seed=4, clusters=0.8)
+        self.assertEqual(result['selected'].shape, (3, 86))
+        self.assertTrue(np.all(result['selected'].sum(axis=1) > 0))
+        self.assertTrue(np.all(result['status'] == 'ok'))
+        np.testing.assert_array_almost_equal(result['exposures'].sum(axis=1), np.ones(3))
+        with self.assertRaises(ValueError):
+            fit_arrays(samples, 3.4, R=20, clusters=0.8, screening=3.0)
+
+    def test_fit_with_allowed_signatures(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        samples, names_patients = load_samples_file(samples_file)
+        P, names = load_catalog(2.0)
+        P = align_mutation_types(P, load_mutation_types(catalog_file(2.0)), load_mutation_types(samples_file),
+                                 catalog_file(2.0))
+        allowed = ['Signature_1', 'Signature_3', 'Signature_5', 'Signature_13']
+        columns = np.flatnonzero(np.isin(names[1:], allowed))
+        result = fit_arrays(samples, P, names_patients=names_patients, names_signatures=names[1:], R=20, seed=5,
+                            sample_groups={'S0': 'BRCA', 'S2': 'BRCA'}, allowed_signatures={'BRCA': allowed})
+        # The output keeps the layout of the whole catalog, restricted samples only use their allowed signatures
+        self.assertEqual(result['selected'].shape, (3, 30))
+        self.assertFalse(np.any(result['selected'][[0, 2]][:, np.setdiff1d(np.arange(30), columns)]))
+        reduced = fit_arrays(samples, P[:, columns], names_patients=names_patients, names_signatures=allowed, R=20,
+                             seed=5)
+        np.testing.assert_array_equal(result['exposures'][[0, 2]][:, columns], reduced['exposures'][[0, 2]])
+        with self.assertRaises(ValueError):
+            fit_arrays(samples, P, names_signatures=names[1:], R=20, allowed_signatures={'S0': ['Signature_1', 'SBS1']})
+        with self.assertRaises(ValueError):
+            fit_arrays(samples, P, names_signatures=names[1:], R=20, allowed_signatures={'S0': ['Signature_1']})
+
+        os.makedirs('output_allowed', exist_ok=True)
+        with open(os.path.join('output_allowed', 'groups.tsv'), 'w') as file:
+            file.write('sample\tcancer_type\nS0\tBRCA\nS2\tBRCA\n')
+        with open(os.path.join('output_allowed', 'allowed.json'), 'w') as file:
+            json.dump({'BRCA': allowed}, file)
+        fit(samples_file, 'output_allowed', signatures=2.0, R=20, seed=5,
+            allowed_signatures=os.path.join('output_allowed', 'allowed.json'),
+            sample_groups=os.path.join('output_allowed', 'groups.tsv'))
+        activities = load_activities_file(os.path.join('output_allowed', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(activities, activities_matrix(result))
+        remove_folder('output_allowed')
+
+    def test_fit_saves_bootstrap_exposures(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit(samples_file, 'output_bootstrap', signatures=2.0, R=10, seed=2, save_bootstrap=True)
+        fit(samples_file, 'output_bootstrap_jobs', signatures=2.0, R=10, seed=2, save_bootstrap=True, n_jobs=2)
+
+        exposures, index = load_bootstrap_file(os.path.join('output_bootstrap', 'Bootstrap_Exposures.npy'))
+        self.assertEqual(exposures.shape, (3, 30, 10))
+        self.assertEqual(exposures.dtype, np.float32)
+        self.assertEqual(index['samples']['S2'], 2)
+        self.assertEqual(index['signatures']['Signature_30'], 29)
+        np.testing.assert_array_almost_equal(exposures.sum(axis=1), np.ones((3, 10)), decimal=5)
+
+        exposures_jobs, _ = load_bootstrap_file(os.path.join('output_bootstrap_jobs', 'Bootstrap_Exposures.npy'))
+        np.testing.assert_array_equal(exposures_jobs, exposures)
+        del exposures, exposures_jobs
+        remove_folder('output_bootstrap')
+        remove_folder('output_bootstrap_jobs')
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_cost_schedule_matches_serial_fit(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        cost_model = os.path.join('output_schedule', 'cost_model.json')
+        os.makedirs('output_schedule', exist_ok=True)
+        fit(samples_file, 'output_serial', signatures=2.0, R=10, seed=3)
+        fit(samples_file, 'output_schedule', signatures=2.0, R=10, seed=3, n_jobs=2, cost_model=cost_model)
+
+        expected = load_activities_file(os.path.join('output_serial', 'Assignment_Solution_Activities.csv'))
+        actual = load_activities_file(os.path.join('output_schedule', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(actual, expected)
+        self.assertEqual(CostModel.load(cost_model).n_observations, 3)
+        remove_folder('output_serial')
+        remove_folder('output_schedule')
+
+    def test_cost_model_update_moves_towards_observed_costs(self):
+        features = np.column_stack([np.ones(4), np.log([100, 1000, 10000, 100000]), np.full(4, np.log(100)),
+                                    np.full(4, np.log(30)), np.log1p([2, 3, 5, 8])])
+        observed = np.array([0.01, 0.05, 0.2, 1.0])
+        model = CostModel()
+        before = np.abs(np.log(model.predict(features)) - np.log(observed)).mean()
+        for _ in range(20):
+            model.update(features, observed)
+        after = np.abs(np.log(model.predict(features)) - np.log(observed)).mean()
+        self.assertLess(after, before)
+        self.assertEqual(model.n_observations, 80)
+
+    def test_singular_catalog_features(self):
+        P = np.random.rand(96, 3)
+        P /= P.sum(axis=0)
+        samples = np.random.randint(0, 20, (96, 4))
+        features = sample_features(samples, [np.column_stack([P, P[:, 0]])], 10)
+        self.assertEqual(features.shape, (4, 5))
+        np.testing.assert_array_almost_equal(features[:, 4], np.full(4, np.log1p(4)))
+
+    def test_dead_worker_is_reported(self):
+        tasks = [1, 2, -1, 3]
+        features = np.ones((len(tasks), 5))
+        with self.assertRaises(RuntimeError):
+            list(run_scheduled(exit_on_negative, tasks, features, 2, poll_seconds=0.1))
+
+
+class TestShards(unittest.TestCase):
+
+    def test_merged_shards_match_fit(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit(samples_file, 'output_full', signatures=2.0, R=10, seed=7, drop_zeros_columns=True)
+        for shard_index in range(2):
+            fit_shard(samples_file, 'output_shards', shard_index, 2, signatures=2.0, R=10, seed=7)
+        merge_shards('output_shards', 'output_merged', drop_zeros_columns=True)
+
+        expected = load_activities_file(os.path.join('output_full', 'Assignment_Solution_Activities.csv'))
+        merged = load_activities_file(os.path.join('output_merged', 'Assignment_Solution_Activities.csv'))
+        np.testing.assert_array_equal(merged, expected)
+        for folder in ('output_full', 'output_shards', 'output_merged'):
+            remove_folder(folder)
+
+    def test_merged_shards_match_fit_with_options(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        options = dict(screening=3.0, work_budget=40, chunk_size=5, backend='kkt',
+                       allowed_signatures={'S1': ['Signature_1', 'Signature_3', 'Signature_5']})
+        fit(samples_file, 'output_full_options', signatures=2.0, R=10, seed=7, **options)
+        for shard_index in range(2):
+            fit_shard(samples_file, 'output_shards_options', shard_index, 2, signatures=2.0, R=10, seed=7,
+                      n_jobs=2, **options)
+        merge_shards('output_shards_options', 'output_merged_options')
+
+        for name in ('Assignment_Solution_Activities.csv', 'Assignment_Solution_Status.csv'):
+            expected = load_activities_file(os.path.join('output_full_options', name))
+            merged = load_activities_file(os.path.join('output_merged_options', name))
+            np.testing.assert_array_equal(merged, expected)
+
+        # A shard computed with other options is rejected
+        fit_shard(samples_file, 'output_shards_options', 1, 2, signatures=2.0, R=10, seed=7,
+                  **dict(options, screening=None))
+        with self.assertRaises(ValueError):
+            merge_shards('output_shards_options', 'output_merged_options')
+        with self.assertRaises(ValueError):
+            fit_shard(samples_file, 'output_shards_options', 0, 2, signatures=2.0, bootstrap_files=[])
+        for folder in ('output_full_options', 'output_shards_options', 'output_merged_options'):
+            remove_folder(folder)
+
+    def test_merge_rejects_missing_shard(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        fit_shard(samples_file, 'output_shards_missing', 1, 3, signatures=2.0, R=10, seed=7)
+
+        with self.assertRaises(ValueError):
+            merge_shards('output_shards_missing', 'output_merged_missing')
+        remove_folder('output_shards_missing')
+
+
+class TestSweep(unittest.TestCase):
+
+    def test_sweep_matches_fit_for_every_combination(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        output_files = sweep(samples_file, 'output_sweep', thresholds=[0.01, 0.05], significance_levels=[0.01, 0.1],
+                             signatures=2.0, R=10, seed=5)
+
+        self.assertEqual(len(output_files), 4)
+        for (threshold, significance_level), output_file in output_files.items():
+            fit(samples_file, 'output_sweep_fit', threshold=threshold, significance_level=significance_level,
+                signatures=2.0, R=10, seed=5)
+            expected = load_activities_file(os.path.join('output_sweep_fit', 'Assignment_Solution_Activities.csv'))
+            np.testing.assert_array_equal(load_activities_file(output_file), expected)
+        remove_folder('output_sweep')
+        remove_folder('output_sweep_fit')
+
+    def test_sweep_matches_fit_with_options(self):
+        samples_file = os.path.join(current_dir, 'data', 'reduced_data.dat')
+        for options in (dict(chunk_size=4, work_budget=30, n_jobs=2),
+                        dict(screening=3.0, backend='kkt', allowed_signatures={'S1': ['Signature_1', 'Signature_5']}),
+                        dict(clusters=0.8, time_budget=60)):
+            output_files = sweep(samples_file, 'output_sweep', thresholds=[0.01, 0.05], significance_levels=[0.05],
+                                 signatures=2.0, R=10, seed=6, **options)
+            for (threshold, significance_level), output_file in output_files.items():
+                fit(samples_file, 'output_sweep_fit', threshold=threshold, significance_level=significance_level,
+                    signatures=2.0, R=10, seed=6, **options)
+                expected = load_activities_file(os.path.join('output_sweep_fit', 'Assignment_Solution_Activities.csv'))
+                np.testing.assert_array_equal(load_activities_file(output_file), expected)
+        with self.assertRaises(TypeError):
+            sweep(samples_file, 'output_sweep', thresholds=[0.01], significance_levels=[0.05], signatures=2.0,
+                  save_bootstrap=True)
+        remove_folder('output_sweep')
+        remove_folder('output_sweep_fit')
+
+
+class TestStream(unittest.TestCase):
+
+    def test_stream_matches_fit_arrays(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'format_1.dat'))
+        samples = samples[:, :6]
+        expected = fit_arrays(samples, 2.0, names_patients=names_patients[:6], R=10, seed=3)
+
+        async def profiles():
+            for name, profile in zip(names_patients[:6], samples.T):
+                await asyncio.sleep(0)
+                yield name, profile
+
+        async def collect(n_jobs):
+            return [result async for result in fit_stream(profiles(), 2.0, R=10, seed=3, n_jobs=n_jobs)]
+
+        for n_jobs in (1, 2):
+            streamed = asyncio.run(collect(n_jobs))
+            self.assertEqual(sorted(name for name, _, _, _ in streamed), sorted(names_patients[:6]))
+            for name, best_columns, exposures, errors in streamed:
+                row = list(names_patients).index(name)
+                np.testing.assert_array_equal(np.flatnonzero(expected['selected'][row]), np.sort(best_columns))
+                np.testing.assert_array_equal(expected['exposures'][row, best_columns], exposures)
+                self.assertEqual(expected['errors'][row], errors)
+
+    def test_stream_backpressure_and_cancellation(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'format_1.dat'))
+        read = []
+
+        def profiles():
+            for name, profile in zip(names_patients, samples.T):
+                read.append(name)
+                yield name, profile
+
+        async def first_result():
+            stream = fit_stream(profiles(), 2.0, R=10, seed=3, max_pending=2)
+            async for result in stream:
+                await stream.aclose()
+                return result
+
+        name, best_columns, exposures, errors = asyncio.run(first_result())
+        self.assertIn(name, names_patients[:2])
+        # At most 'max_pending' samples are taken ahead of the consumer
+        self.assertLessEqual(len(read), 3)
+
+    def test_stream_closes_async_source_and_keeps_global_random_state(self):
+        samples, names_patients = load_samples_file(os.path.join(current_dir, 'data', 'format_1.dat'))
+        expected = fit_arrays(samples[:, :4], 2.0, names_patients=names_patients[:4], R=10, seed=3)
+        closed = []
+
+        async def profiles():
+            try:
+                for name, profile in zip(names_patients, samples.T):
+                    await asyncio.sleep(0)
+                    yield name, profile
+            finally:
+                closed.append(True)
+
+        async def first_results(executor):
+            results = []
+            stream = fit_stream(profiles(), 2.0, R=10, seed=3, max_pending=2, executor=executor)
+            async for result in stream:
+                results.append(result)
+                if len(results) == 2:
+                    await stream.aclose()
+            return results
+
+        np.random.seed(11)
+        state = np.random.get_state()[1].copy()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            streamed = asyncio.run(first_results(executor))
+        np.testing.assert_array_equal(np.random.get_state()[1], state)
+        self.assertEqual(closed, [True])
+        for name, best_columns, exposures, errors in streamed:
+            row = list(names_patients).index(name)
+            np.testing.assert_array_equal(np.flatnonzero(expected['selected'][row]), np.sort(best_columns))
+            np.testing.assert_array_equal(expected['exposures'][row, best_columns], exposures)
@@ -1,8 +1,20 @@
 import numpy as np
 import unittest
+import os
+import shutil
+import tempfile
 
 from sigconfide.modelselection.backward import compute_p_value
 from sigconfide.modelselection.backward import bootstraped_patient
+from sigconfide.modelselection.backward import count_exceedances, BootstrapChunks, stratified_multinomial
+from sigconfide.modelselection.hybrid import hybrid_selection, replicate_p_values
+from sigconfide.modelselection.screening import AnalyticScreen
+from sigconfide.modelselection.budget import SampleBudget
+from sigconfide.modelselection.memory import plan_memory, parse_memory, MB
+from sigconfide.modelselection.workspace import SelectionWorkspace, selection_workspace
+from sigconfide.modelselection.clusters import signature_clusters, load_clusters, cluster_selection
+from sigconfide.estimates.standard import findSigExposures
+from sigconfide.decompose.qp import decomposeQP
 class TestComputePValue(unittest.TestCase):
 
     def test_compute_p_value(self):
@@ -51,3 +63,263 @@ class TestBootstrapedPatient(unittest.TestCase):
         with self.assertRaises(ValueError):
             bootstraped_patient(m, None, R)  # Should raise ValueError
 
+
+class TestBootstrapChunks(unittest.TestCase):
+
+    def test_count_exceedances_matches_compute_p_value(self):
+        exposures = np.random.rand(5, 40) * 0.05
+        counts = count_exceedances(exposures[:, :15]) + count_exceedances(exposures[:, 15:])
+
+        np.testing.assert_array_almost_equal(1 - counts / 40, compute_p_value(exposures))
+
+    def test_chunks_are_reproducible(self):
+        chunks = BootstrapChunks(np.array([10, 20, 30]), None, R=25, chunk_size=10, seed=3)
+        first = list(chunks)
+        second = list(chunks)
+
+        self.assertEqual([chunk.shape for chunk in first], [(3, 10), (3, 10), (3, 5)])
+        for chunk_first, chunk_second in zip(first, second):
+            np.testing.assert_array_equal(chunk_first, chunk_second)
+            np.testing.assert_array_almost_equal(chunk_first.sum(axis=0), np.ones(chunk_first.shape[1]))
+
+    def test_chunked_selection_matches_whole_replicates(self):
+        np.random.seed(0)
+        P = np.random.rand(96, 6)
+        P /= P.sum(axis=0)
+        m = np.random.multinomial(500, np.dot(P, [0.5, 0.3, 0.2, 0, 0, 0]))
+        chunks = BootstrapChunks(m, None, R=30, chunk_size=7, seed=1)
+
+        chunked = hybrid_selection(m, P, 30, 0.01, None, 0.01, replicates=chunks)
+        whole = hybrid_selection(m, P, 30, 0.01, None, 0.01, replicates=np.column_stack(list(chunks)))
+
+        np.testing.assert_array_equal(chunked[0], whole[0])
+        np.testing.assert_array_almost_equal(chunked[1][0], whole[1][0])
+
+    def test_chunked_selection_records_the_final_p_values(self):
+        np.random.seed(0)
+        P = np.random.rand(96, 6)
+        P /= P.sum(axis=0)
+        m = np.random.multinomial(500, np.dot(P, [0.5, 0.3, 0.2, 0, 0, 0]))
+        chunks = BootstrapChunks(m, None, R=30, chunk_size=7, seed=1)
+        step_p_values = {}
+
+        best_columns, _ = hybrid_selection(m, P, 30, 0.01, None, 0.01, replicates=chunks,
+                                           step_p_values=step_p_values)
+
+        np.testing.assert_array_equal(step_p_values[tuple(int(col) for col in best_columns)],
+                                      replicate_p_values(chunks, P, best_columns, 0.01))
+
+
+class TestStratifiedSampling(unittest.TestCase):
+
+    def test_replicates_have_multinomial_moments(self):
+        m = np.array([0.5, 0.3, 0.15, 0.05])
+        counts = stratified_multinomial(m, 200, 4000, np.random.RandomState(0))
+
+        self.assertEqual(counts.shape, (4, 4000))
+        np.testing.assert_array_equal(counts.sum(axis=0), np.full(4000, 200))
+        np.testing.assert_allclose(counts.mean(axis=1), 200 * m, rtol=1e-3)
+        np.testing.assert_allclose(counts.var(axis=1), 200 * m * (1 - m), rtol=0.1)
+
+    def test_totals_across_replicates_are_balanced(self):
+        m = np.array([0.5, 0.3, 0.15, 0.05])
+        stratified = [stratified_multinomial(m, 100, 50, np.random.RandomState(seed)).sum(axis=1) for seed in range(20)]
+        independent = [np.random.RandomState(seed).multinomial(100, m, size=50).sum(axis=0) for seed in range(20)]
+
+        self.assertLess(np.std(stratified, axis=0).max(), np.std(independent, axis=0).min())
+
+    def test_sampling_option(self):
+        m = np.array([10, 20, 30])
+        np.random.seed(1)
+        M = bootstraped_patient(m, None, 20, sampling='stratified')
+        np.testing.assert_array_almost_equal(M.sum(axis=0), np.ones(20))
+        chunks = BootstrapChunks(m, None, R=20, chunk_size=8, seed=2, sampling='stratified')
+        self.assertEqual([chunk.shape for chunk in chunks], [(3, 8), (3, 8), (3, 4)])
+        with self.assertRaises(ValueError):
+            bootstraped_patient(m, None, 20, sampling='sobol')
+
+
+class TestAnalyticScreen(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.P = np.random.rand(96, 8)
+        self.P /= self.P.sum(axis=0)
+        self.m = np.random.multinomial(2000, np.dot(self.P, [0.5, 0.3, 0.15, 0.05, 0, 0, 0, 0]))
+
+    def test_analytic_decisions_agree_with_bootstrap(self):
+        status = AnalyticScreen(margin=3.0).screen(self.m, self.P, 0.01)
+        M = bootstraped_patient(self.m, None, 200)
+        p_values = compute_p_value(findSigExposures(M, self.P)[0], threshold=0.01)
+
+        self.assertTrue(np.any(status != 0))
+        self.assertTrue(np.all(p_values[status == 1] <= 0.01))
+        self.assertTrue(np.all(p_values[status == -1] >= 0.99))
+
+    def test_screened_selection_matches_bootstrap_selection(self):
+        M = bootstraped_patient(self.m, None, 50)
+        screen = AnalyticScreen(margin=3.0)
+        screened = hybrid_selection(self.m, self.P, 50, 0.01, None, 0.01, replicates=M, screening=screen)
+        full = hybrid_selection(self.m, self.P, 50, 0.01, None, 0.01, replicates=M)
+
+        np.testing.assert_array_equal(np.sort(screened[0]), np.sort(full[0]))
+        report = screen.report()
+        self.assertGreater(report['analytic'], 0)
+        self.assertGreater(report['skipped'], 0)
+
+    def test_infinite_margin_decides_nothing(self):
+        M = bootstraped_patient(self.m, None, 30)
+        screen = AnalyticScreen(margin=np.inf)
+        screened = hybrid_selection(self.m, self.P, 30, 0.01, None, 0.01, replicates=M, screening=screen)
+        full = hybrid_selection(self.m, self.P, 30, 0.01, None, 0.01, replicates=M)
+
+        np.testing.assert_array_equal(screened[0], full[0])
+        self.assertEqual(screen.analytic, 0)
+        self.assertEqual(screen.skipped, 0)
+
+
+class TestSampleBudget(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.P = np.random.rand(96, 8)
+        self.P /= self.P.sum(axis=0)
+        self.m = np.random.multinomial(2000, np.dot(self.P, [0.4, 0.3, 0.2, 0.1, 0, 0, 0, 0]))
+        self.M = bootstraped_patient(self.m, None, 40)
+
+    def test_generous_budget_does_not_change_selection(self):
+        budget = SampleBudget(seconds=600, solves=10**6)
+        budgeted = hybrid_selection(self.m, self.P, 40, 0.01, None, 0.01, replicates=self.M, budget=budget)
+        full = hybrid_selection(self.m, self.P, 40, 0.01, None, 0.01, replicates=self.M)
+
+        np.testing.assert_array_equal(budgeted[0], full[0])
+        self.assertEqual(budget.status, 'ok')
+        self.assertGreater(budget.used, 0)
+
+    def test_exceeded_budget_degrades(self):
+        for degrade in ('reduced_R', 'screening', 'current_model'):
+            budget = SampleBudget(solves=40, degrade=degrade)
+            best_columns, _ = hybrid_selection(self.m, self.P, 40, 0.01, None, 0.01, replicates=self.M,
+                                               budget=budget)
+            self.assertIn(budget.status, (degrade, 'current_model'))
+            self.assertLessEqual(budget.used, 3 * 40)
+            self.assertTrue(set(best_columns) <= set(range(8)))
+
+        budget = SampleBudget(solves=40, degrade='current_model')
+        best_columns, _ = hybrid_selection(self.m, self.P, 40, 0.01, None, 0.01, replicates=self.M, budget=budget)
+        self.assertEqual(budget.used, 80)
+
+    def test_unknown_degradation_raises(self):
+        with self.assertRaises(ValueError):
+            SampleBudget(seconds=1, degrade='skip')
+
+
+class TestSelectionWorkspace(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(3)
+        self.P = np.random.rand(96, 8)
+        self.P /= self.P.sum(axis=0)
+        self.m = np.random.multinomial(1500, np.dot(self.P, [0.5, 0.3, 0.2, 0, 0, 0, 0, 0]))
+        self.M = bootstraped_patient(self.m, None, 40)
+
+    def test_workspace_matches_find_sig_exposures(self):
+        workspace = SelectionWorkspace(self.M, self.P)
+        for columns in ([0, 1, 2, 3, 4, 5, 6, 7], [2, 0, 5], [1, 4]):
+            exposures, errors = workspace.solve(np.array(columns), decomposeQP)
+            expected_exposures, expected_errors = findSigExposures(self.M, self.P[:, columns])
+            np.testing.assert_array_equal(exposures, expected_exposures)
+            np.testing.assert_array_almost_equal(errors, expected_errors, decimal=12)
+            np.testing.assert_array_equal(workspace.p_values(exposures, 0.01), compute_p_value(exposures, 0.01))
+
+    def test_workspace_follows_the_replicates(self):
+        workspace = selection_workspace(None, self.M, self.P)
+        self.assertIs(selection_workspace(workspace, self.M, self.P), workspace)
+        self.assertIsNot(selection_workspace(workspace, self.M[:, :10], self.P), workspace)
+        self.assertIsNone(selection_workspace(workspace, BootstrapChunks(self.m, None, 40, 10), self.P))
+
+
+class TestMemoryPlan(unittest.TestCase):
+    def test_parse_memory(self):
+        self.assertEqual(parse_memory('512M'), 512 * MB)
+        self.assertEqual(parse_memory('1.5GB'), 1536 * MB)
+        self.assertEqual(parse_memory(1000), 1000)
+        with self.assertRaises(ValueError):
+            parse_memory('4X')
+
+    def test_plan_stays_within_budget(self):
+        # A generous budget keeps all workers and replicates and dispatches the whole cohort at once
+        plan = plan_memory('16G', 96, 10000, [86], 1000, n_jobs=8, baseline=100 * MB)
+        self.assertEqual((plan.n_jobs, plan.chunk_size, plan.sample_chunk), (8, None, 10000))
+
+        # Workers are lowered before the replicates are chunked
+        plan = plan_memory('1G', 96, 10000, [86], 1000, n_jobs=8, baseline=100 * MB)
+        self.assertLess(plan.n_jobs, 8)
+        self.assertIsNone(plan.chunk_size)
+        self.assertLessEqual(plan.estimated, 1024 * MB)
+
+        plan = plan_memory('2G', 96, 10000, [86], 100000, n_jobs=8, baseline=100 * MB)
+        self.assertIsNotNone(plan.chunk_size)
+        self.assertLessEqual(plan.estimated, 2048 * MB)
+
+        with self.assertRaises(ValueError):
+            plan_memory('100M', 96, 10**6, [86], 100, baseline=100 * MB)
+
+
+class TestClusters(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2)
+        self.P = np.random.rand(96, 8)
+        # Signature 8 is a slightly perturbed copy of signature 0
+        self.P = np.hstack([self.P, self.P[:, [0]] * np.random.uniform(0.9, 1.1, (96, 1))])
+        self.P /= self.P.sum(axis=0)
+        self.m = np.random.multinomial(2000, np.dot(self.P, [0.4, 0.3, 0.2, 0, 0, 0, 0, 0, 0.1]))
+
+    def test_similar_signatures_are_clustered(self):
+        labels = signature_clusters(self.P, 0.99)
+        self.assertEqual(labels[0], labels[8])
+        self.assertEqual(len(np.unique(labels)), 8)
+        np.testing.assert_array_equal(labels[:8], np.arange(8))
+        self.assertEqual(len(np.unique(signature_clusters(self.P, 0.0))), 1)
+
+    def test_clusters_are_cached_in_the_cache_folder(self):
+        folder = tempfile.mkdtemp()
+        try:
+            catalog = os.path.join(os.path.dirname(__file__), 'data', 'COSMIC_v2_SBS_GRCh37.txt')
+            cache_folder = os.path.join(folder, 'clusters')
+            labels = load_clusters(catalog, 0.8, cache_folder=cache_folder)
+            self.assertEqual(len(os.listdir(cache_folder)), 1)
+            self.assertFalse(os.path.exists(os.path.splitext(catalog)[0] + '.clusters.json'))
+            np.testing.assert_array_equal(load_clusters(catalog, 0.8, cache_folder=cache_folder), labels)
+            np.testing.assert_array_equal(load_clusters(catalog, 0.8, cache_folder=None), labels)
+            self.assertEqual(len(labels), 30)
+            self.assertLess(len(np.unique(labels)), 30)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_cluster_selection_keeps_one_of_similar_signatures(self):
+        M = bootstraped_patient(self.m, None, 50)
+        labels = signature_clusters(self.P, 0.99)
+        best_columns, (exposures, errors) = cluster_selection(self.m, self.P, labels, 50, 0.01, None, 0.01,
+                                                              replicates=M, solve_cache={})
+        self.assertTrue({1, 2} <= set(best_columns))
+        self.assertTrue(set(best_columns) & {0, 8})
+        self.assertTrue(set(best_columns) <= {0, 1, 2, 8})
+        self.assertAlmostEqual(exposures.sum(), 1.0)
+
+        with self.assertRaises(ValueError):
+            cluster_selection(self.m, self.P, labels[:8], 50, 0.01, None, 0.01, replicates=M)
+
+    def test_cluster_selection_charges_only_solved_models(self):
+        M = bootstraped_patient(self.m, None, 50)
+        labels = signature_clusters(self.P, 0.99)
+        solve_cache = {}
+        first, second = SampleBudget(solves=10**6), SampleBudget(solves=10**6)
+        cluster_selection(self.m, self.P, labels, 50, 0.01, None, 0.01, replicates=M, solve_cache=solve_cache,
+                          budget=first)
+        cluster_selection(self.m, self.P, labels, 50, 0.01, None, 0.01, replicates=M, solve_cache=solve_cache,
+                          budget=second)
+
+        self.assertEqual(first.used, 50 * len(solve_cache))
+        self.assertEqual(second.used, 0)
@@ -1,6 +1,13 @@
 import unittest
 from sigconfide.utils.utils import *
+from sigconfide.utils.synthetic import generate_cohort, write_cohort
+from sigconfide.utils.inputs import expand_sample_files, load_sample_files, load_sample_groups, \
+    load_allowed_signatures
+import bz2
+import gzip
+import json
 import os
+import tempfile
 current_dir = os.path.dirname(os.path.abspath(__file__))
 class TestUtils(unittest.TestCase):
     def test_detect_format(self):
@@ -92,3 +99,97 @@ class TestLoadSamplesFile(unittest.TestCase):
         np.testing.assert_array_equal(samples, expected_result)
 
 
+class TestSampleFiles(unittest.TestCase):
+    def setUp(self):
+        self.temporary = tempfile.TemporaryDirectory()
+        self.folder = self.temporary.name
+        for name, opener, suffix in (('format_1.dat', gzip.open, '.gz'), ('format_2.dat', bz2.open, '.bz2')):
+            with open(os.path.join(current_dir, 'data', name), 'rb') as source:
+                with opener(os.path.join(self.folder, name + suffix), 'wb') as file:
+                    file.write(source.read())
+
+    def tearDown(self):
+        self.temporary.cleanup()
+
+    def test_load_compressed(self):
+        samples, names = load_sample_files(os.path.join(self.folder, 'format_2.dat.bz2'))
+        expected, expected_names = load_samples_file(os.path.join(current_dir, 'data', 'format_2.dat'))
+        np.testing.assert_array_equal(samples, expected)
+        np.testing.assert_array_equal(names, expected_names)
+        np.testing.assert_array_equal(load_mutation_types(os.path.join(self.folder, 'format_1.dat.gz')),
+                                      load_mutation_types(os.path.join(current_dir, 'data', 'format_1.dat')))
+
+    def test_rows_are_aligned_by_mutation_type(self):
+        # format_2.dat holds the samples of format_1.dat with the rows in another order
+        mutation_types = load_mutation_types(os.path.join(current_dir, 'data', 'format_1.dat'))
+        samples, _ = load_sample_files(os.path.join(self.folder, 'format_2.dat.bz2'), mutation_types)
+        expected, _ = load_samples_file(os.path.join(current_dir, 'data', 'format_1.dat'))
+        np.testing.assert_array_equal(samples, expected)
+        with self.assertRaises(ValueError):
+            load_sample_files(os.path.join(self.folder, 'format_2.dat.bz2'), mutation_types[::2])
+
+    def test_manifest_and_glob(self):
+        with open(os.path.join(self.folder, 'cohort.manifest'), 'w') as file:
+            file.write('# Two copies of the same samples\n\nformat_1.dat.gz\nformat_2.dat.bz2\n')
+        files = expand_sample_files(os.path.join(self.folder, 'cohort.manifest'))
+        self.assertEqual(files, [os.path.join(self.folder, 'format_1.dat.gz'),
+                                 os.path.join(self.folder, 'format_2.dat.bz2')])
+        self.assertEqual(expand_sample_files(os.path.join(self.folder, 'format_*')), files)
+        with self.assertRaises(ValueError):
+            expand_sample_files(os.path.join(self.folder, '*.txt'))
+        # The same sample names in several files are rejected
+        with self.assertRaises(ValueError):
+            load_sample_files(files, n_jobs=2)
+
+    def test_sample_groups_and_allowed_signatures(self):
+        with open(os.path.join(self.folder, 'groups.tsv'), 'w') as file:
+            file.write('sample\tcancer_type\n# Annotation\nS0\tBRCA\nS1\tLUAD\n\nS2\tBRCA\n')
+        self.assertEqual(load_sample_groups(os.path.join(self.folder, 'groups.tsv')),
+                         {'S0': 'BRCA', 'S1': 'LUAD', 'S2': 'BRCA'})
+        with open(os.path.join(self.folder, 'groups.csv'), 'w') as file:
+            file.write('S0,BRCA,extra\n')
+        with self.assertRaises(ValueError):
+            load_sample_groups(os.path.join(self.folder, 'groups.csv'))
+
+        with open(os.path.join(self.folder, 'allowed.json'), 'w') as file:
+            json.dump({'BRCA': ['SBS1', 'SBS2']}, file)
+        self.assertEqual(load_allowed_signatures(os.path.join(self.folder, 'allowed.json')),
+                         {'BRCA': ['SBS1', 'SBS2']})
+        with open(os.path.join(self.folder, 'allowed.json'), 'w') as file:
+            json.dump(['SBS1', 'SBS2'], file)
+        with self.assertRaises(ValueError):
+            load_allowed_signatures(os.path.join(self.folder, 'allowed.json'))
+
+
+class TestSyntheticCohort(unittest.TestCase):
+    def test_generate_cohort_is_deterministic(self):
+        counts, exposures, names = generate_cohort(1500, signatures=2.0, seed=4, mutation_counts=300, sparsity=0.8)
+        counts_again, exposures_again, _ = generate_cohort(1500, signatures=2.0, seed=4, mutation_counts=300,
+                                                           sparsity=0.8)
+
+        self.assertEqual(counts.shape, (96, 1500))
+        self.assertEqual(exposures.shape, (30, 1500))
+        np.testing.assert_array_equal(counts, counts_again)
+        np.testing.assert_array_equal(counts.sum(axis=0), np.full(1500, 300))
+        np.testing.assert_array_almost_equal(exposures.sum(axis=0), np.ones(1500))
+        self.assertTrue(np.all((exposures > 0).sum(axis=0) >= 1))
+
+    def test_write_cohort_formats(self):
+        counts, _, _ = generate_cohort(1100, signatures=2.0, seed=9)
+        with tempfile.TemporaryDirectory() as folder:
+            text_file = os.path.join(folder, 'synthetic.txt')
+            npy_file = os.path.join(folder, 'synthetic.npy')
+            chunks_folder = os.path.join(folder, 'synthetic_chunks')
+            write_cohort(text_file, 1100, signatures=2.0, seed=9)
+            write_cohort(npy_file, 1100, format='npy', signatures=2.0, seed=9)
+            write_cohort(chunks_folder, 1100, format='chunked', signatures=2.0, seed=9, chunk_size=400)
+
+            samples, names = load_samples_file(text_file)
+            np.testing.assert_array_equal(samples, counts)
+            np.testing.assert_array_equal(np.load(npy_file), counts)
+            self.assertTrue(os.path.exists(os.path.join(folder, 'synthetic.exposures.npy')))
+            with open(os.path.join(chunks_folder, 'index.json')) as file:
+                chunks = json.load(file)['chunks']
+            self.assertEqual([chunk['size'] for chunk in chunks], [400, 400, 300])
+            np.testing.assert_array_equal(
+                np.hstack([np.load(os.path.join(chunks_folder, chunk['counts'])) for chunk in chunks]), counts)